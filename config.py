@@ -7,6 +7,13 @@ from aiogram.types import BotCommand
 # Загружаем переменные из .env
 load_dotenv()
 
+def env_bool(name: str, default: bool = False) -> bool:
+    """Читает булев флаг из переменной окружения (1/true/yes/on)"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
 class Config:
     # Настройки бота
     BOT_TOKEN = os.getenv("BOT_TOKEN")  # Токен из .env
@@ -22,6 +29,65 @@ class Config:
     DB_PASSWORD = os.getenv("DB_PASSWORD")
     DB_HOST = os.getenv("DB_HOST", "localhost")  # По умолчанию localhost
     DB_PORT = os.getenv("DB_PORT", "5432")       # По умолчанию 5432
+    DB_URL = os.getenv("DB_URL")  # Полная строка подключения вместо DB_* (например, sqlite+aiosqlite:///loadtest.sqlite3)
+
+    # Профиль движка БД и пул соединений
+    DB_PROFILE = os.getenv("DB_PROFILE", "production")          # production / development
+    DB_ECHO = env_bool("DB_ECHO", DB_PROFILE == "development")  # Логирование SQL
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))     # Ожидание соединения, сек
+    DB_POOL_PRE_PING = env_bool("DB_POOL_PRE_PING", True)
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))     # Пересоздание соединений, сек
+    DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+    DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "100"))
+
+    # Кеш клиентов по telegram_id
+    CLIENT_CACHE_SIZE = int(os.getenv("CLIENT_CACHE_SIZE", "10000"))
+    CLIENT_CACHE_TTL = float(os.getenv("CLIENT_CACHE_TTL", "300"))  # сек
+
+    # Справочник типов кредитов в памяти
+    LOAN_TYPE_CACHE_TTL = float(os.getenv("LOAN_TYPE_CACHE_TTL", "600"))  # сек
+
+    # Документы из шаблонов (utils.documents)
+    DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", "512"))  # Готовых документов в кеше
+    PDF_FONT_PATH = os.getenv("PDF_FONT_PATH", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")  # TTF с кириллицей
+
+    # Фоновое начисление пени (прогон идемпотентен в пределах дня)
+    PENALTY_ACCRUAL_ENABLED = env_bool("PENALTY_ACCRUAL_ENABLED", True)
+    PENALTY_ACCRUAL_INTERVAL = float(os.getenv("PENALTY_ACCRUAL_INTERVAL", "3600"))  # сек
+
+    # Напоминания о платежах (services.reminders)
+    REMINDERS_ENABLED = env_bool("REMINDERS_ENABLED", True)
+    REMINDER_INTERVAL = float(os.getenv("REMINDER_INTERVAL", "3600"))        # Период прогона, сек
+    REMINDER_DAYS_BEFORE = int(os.getenv("REMINDER_DAYS_BEFORE", "3"))       # За сколько дней до срока
+    REMINDER_RATE = float(os.getenv("REMINDER_RATE", "25"))                  # Сообщений в секунду на бота (лимит Telegram ~30)
+    REMINDER_CHAT_INTERVAL = float(os.getenv("REMINDER_CHAT_INTERVAL", "1")) # Пауза между сообщениями в один чат, сек
+    REMINDER_WORKERS = int(os.getenv("REMINDER_WORKERS", "8"))               # Одновременных отправок
+    REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", "3"))     # Прогонов с ошибкой до отказа
+    REMINDER_LEASE = float(os.getenv("REMINDER_LEASE", "900"))              # Через сколько незавершенная отправка повторяется, сек
+
+    # Хранилище FSM: memory / redis / db
+    FSM_STORAGE = os.getenv("FSM_STORAGE", "db")
+    REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    FSM_DB_URL = os.getenv("FSM_DB_URL")          # Отдельная БД для db-режима, например sqlite+aiosqlite:///fsm.sqlite3
+    FSM_TTL = int(os.getenv("FSM_TTL", "0"))      # Время жизни состояний в Redis, сек (0 - без ограничения)
+
+    # Режим получения обновлений: polling / webhook
+    BOT_MODE = os.getenv("BOT_MODE", "polling")
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")    # Публичный https-адрес; пусто - webhook не регистрируется
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")        # X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "64"))
+    WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))  # сек
+
+    # Замеры обработчиков (services.perf)
+    SLOW_HANDLER_MS = float(os.getenv("SLOW_HANDLER_MS", "1000"))  # Порог записи в лог медленных обработчиков
+    METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")        # Prometheus; в режиме webhook - на том же сервере
+    METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))          # Отдельный порт в режиме polling (0 - выключено)
 
     USER_COMMANDS = [
         BotCommand(command="start", description="Начать работу"),
@@ -32,10 +98,13 @@ class Config:
 
     ADMIN_COMMANDS = [
         BotCommand(command="admin", description="Админ-панель"),
+        BotCommand(command="perf", description="Замеры обработчиков"),
         *USER_COMMANDS  # Админ получает все команды пользователя
     ]
 
     @property
     def db_url(self):
-        """Формирует строку подключения к PostgreSQL"""
+        """Формирует строку подключения к PostgreSQL (DB_URL, если задан, имеет приоритет)"""
+        if self.DB_URL:
+            return self.DB_URL
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
\ No newline at end of file
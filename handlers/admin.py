@@ -2,15 +2,24 @@ from aiogram import Router, types, F, Bot
 from aiogram.filters import Command
 from aiogram.enums import ParseMode
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.exceptions import TelegramBadRequest
 from sqlalchemy import select, update, func
 from utils.commands import set_bot_commands
 import sqlalchemy
 from datetime import date
 
-from utils.database import async_session
+from utils.database import async_session, pool_stats
+from utils.client_cache import client_cache
 from models.user import Client
 from config import Config
 from utils.generate_reports import generate_no_obligations_doc, generate_court_notice, generate_annual_financial_report
+from utils.generate_files import export_payments
+from services.portfolio_rollup import portfolio_totals
+from services.payment_acceptance import payment_lock_metrics
+from services.perf import perf_registry
+from services.court_notices import court_notice_batch
+from utils.documents import document_renderer, pdf_supported
+from services.report_cache import report_cache
 
 router = Router(name="admin_handlers")
 
@@ -51,7 +60,9 @@ async def admin_panel(message: types.Message, bot: Bot):
         types.InlineKeyboardButton(text="⚙ Изменить кредитный рейтинг", callback_data="admin_change_credit"),
         types.InlineKeyboardButton(text="📜 Документ об обязательствах", callback_data="admin_no_obligations"),
         types.InlineKeyboardButton(text="⚖ Повестка в суд", callback_data="admin_court_notice"),
-        types.InlineKeyboardButton(text="📅 Финансовый отчет", callback_data="admin_financial_report")
+        types.InlineKeyboardButton(text="⚖ Повестки по портфелю", callback_data="admin_court_batch"),
+        types.InlineKeyboardButton(text="📅 Финансовый отчет", callback_data="admin_financial_report"),
+        types.InlineKeyboardButton(text="📤 Выгрузка платежей", callback_data="admin_export_payments")
     )
     builder.adjust(2)  # Две кнопки в ряд
 
@@ -61,6 +72,31 @@ async def admin_panel(message: types.Message, bot: Bot):
         parse_mode=ParseMode.HTML
     )
 
+@router.message(Command("perf"))
+async def show_perf(message: types.Message):
+    """Замеры обработчиков: /perf - самые затратные по суммарному времени, /perf reset - сброс"""
+    if not await is_admin(message.from_user.id):
+        return await message.answer("❌ Доступ запрещен")
+
+    if message.text.split()[-1] == "reset":
+        perf_registry.reset()
+        return await message.answer("✅ Замеры обработчиков сброшены")
+
+    summary = perf_registry.summary()
+    if not summary:
+        return await message.answer("ℹ Замеров пока нет")
+
+    lines = ["⏱ <b>Обработчики</b> (среднее на вызов)\n"]
+    for row in summary:
+        lines.append(
+            f"<b>{row['handler']}</b>: {row['calls']} выз., {row['avg_ms']:.0f} мс (макс. {row['max_ms']:.0f}), "
+            f"БД {row['db_avg_ms']:.0f} мс, SQL {row['statements_avg']:.1f}, строк {row['rows_avg']:.1f}"
+            + (f", медленных {row['slow']}" if row['slow'] else "")
+            + (f", ошибок {row['errors']}" if row['errors'] else "")
+        )
+    lines.append(f"\nПорог медленного обработчика: {Config.SLOW_HANDLER_MS:.0f} мс")
+    await message.answer("\n".join(lines), parse_mode=ParseMode.HTML)
+
 # ---- Обработчики инлайн-кнопок ----
 
 @router.callback_query(F.data == "admin_stats")
@@ -69,12 +105,42 @@ async def show_stats(callback: types.CallbackQuery):
     async with async_session() as session:
         clients_count = await session.scalar(select(func.count()).select_from(Client))
         avg_score = await session.scalar(select(func.avg(Client.creditScore)))
+        portfolio = await portfolio_totals(session)
+
+    pool = pool_stats()
+    cache = client_cache.stats()
+    payments = payment_lock_metrics.stats()
+    documents = document_renderer.stats()
+    reports = report_cache.stats()
 
     await callback.message.edit_text(
         f"📈 <b>Статистика системы</b>\n\n"
         f"• Всего клиентов: <b>{clients_count}</b>\n"
         f"• Средний кредитный рейтинг: <b>{avg_score:.1f}</b>\n"
-        f"• Администраторов: <b>{len(Config.ADMINS)}</b>",
+        f"• Администраторов: <b>{len(Config.ADMINS)}</b>\n\n"
+        f"💼 <b>Портфель</b>\n"
+        f"• Выдано кредитов: <b>{portfolio['loans_issued']}</b> ({portfolio['issued_amount']:.2f} руб.)\n"
+        f"• Активных / погашенных: <b>{portfolio['loans_active']}</b> / <b>{portfolio['loans_closed']}</b>\n"
+        f"• Платежей: <b>{portfolio['payments_count']}</b> ({portfolio['payments_amount']:.2f} руб.)\n"
+        f"• Просрочено: <b>{portfolio['overdue_count']}</b> ({portfolio['overdue_amount']:.2f} руб.)\n\n"
+        f"🔌 <b>Пул соединений БД</b>\n"
+        f"• Занято: <b>{pool['checked_out']}</b> из {pool['size']} (+{max(pool['overflow'], 0)} сверх пула)\n"
+        f"• Ожидание: ср. <b>{pool['wait_avg_ms']:.1f}</b> мс, макс. <b>{pool['wait_max_ms']:.1f}</b> мс\n"
+        f"• Таймаутов: <b>{pool['timeouts']}</b>\n\n"
+        f"🔒 <b>Прием платежей</b>\n"
+        f"• Принято / повторов / отклонено: <b>{payments['accepted']}</b> / <b>{payments['duplicates']}</b> / <b>{payments['rejected']}</b>\n"
+        f"• Ожидание блокировки: ср. <b>{payments['wait_avg_ms']:.1f}</b> мс, макс. <b>{payments['wait_max_ms']:.1f}</b> мс\n"
+        f"• Удержание блокировки: ср. <b>{payments['hold_avg_ms']:.1f}</b> мс, макс. <b>{payments['hold_max_ms']:.1f}</b> мс\n\n"
+        f"🗂 <b>Кеш клиентов</b>\n"
+        f"• Записей: <b>{cache['size']}</b>\n"
+        f"• Попаданий / промахов: <b>{cache['hits']}</b> / <b>{cache['misses']}</b> ({cache['hit_rate']:.0%})\n\n"
+        f"📄 <b>Кеш документов</b>\n"
+        f"• Шаблонов / документов: <b>{documents['templates']}</b> / <b>{documents['size']}</b>\n"
+        f"• Попаданий / промахов: <b>{documents['hits']}</b> / <b>{documents['misses']}</b> ({documents['hit_rate']:.0%})\n\n"
+        f"📑 <b>Кеш отчетов</b>\n"
+        f"• Отчетов: <b>{reports['size']}</b>, пересобрано после изменений: <b>{reports['stale']}</b>\n"
+        f"• Попаданий / сборок / обновлений: <b>{reports['hits']}</b> / <b>{reports['misses']}</b> / <b>{reports['refreshes']}</b> ({reports['hit_rate']:.0%})\n"
+        f"• Сборка: ср. <b>{reports['build_avg_ms']:.1f}</b> мс, макс. <b>{reports['build_max_ms']:.1f}</b> мс",
         parse_mode=ParseMode.HTML
     )
 
@@ -136,6 +202,7 @@ async def process_credit_change(message: types.Message):
             .values(creditScore=new_score)
         )
         await session.commit()
+    client_cache.invalidate_client(int(client_id))
 
     await message.answer(f"✅ Кредитный рейтинг клиента {client_id} изменен на {new_score}")
 
@@ -160,6 +227,11 @@ async def process_no_obligations(message: types.Message):
         return await message.answer("❌ Кредит не найден или не погашен")
 
     await message.answer(doc_text, parse_mode=ParseMode.HTML)
+    if pdf_supported():
+        await message.answer_document(types.BufferedInputFile(
+            document_renderer.convert(doc_text, "pdf"),
+            filename=f"no_obligations_{message.text}.pdf"
+        ))
 
 @router.callback_query(F.data == "admin_court_notice")
 async def court_notice_start(callback: types.CallbackQuery):
@@ -183,6 +255,27 @@ async def process_court_notice(message: types.Message):
 
     await message.answer(notice_text, parse_mode=ParseMode.HTML)
 
+@router.callback_query(F.data == "admin_court_batch")
+async def court_notice_batch_start(callback: types.CallbackQuery):
+    """Повестки по всем кредитам с ≥3 просрочками, по которым повестка еще не формировалась"""
+    if not await is_admin(callback.from_user.id):
+        return await callback.answer("❌ Доступ запрещен", show_alert=True)
+
+    await callback.answer("⏳ Формирую повестки...")
+    async with court_notice_batch() as batch:
+        if not batch.document:
+            return await callback.message.answer("ℹ Новых кредитов с просрочкой 3 и более платежей нет")
+        await callback.message.answer_document(
+            batch.document,
+            caption=f"⚖ Повесток: {batch.notices}, просрочка по ним: {batch.overdue_amount:.2f} руб."
+        )
+
+
+def report_refresh_markup(year: int) -> types.InlineKeyboardMarkup:
+    """Кнопка пересборки отчета за год"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔄 Обновить", callback_data=f"admin_report_refresh:{year}")
+    return builder.as_markup()
 
 @router.callback_query(F.data == "admin_financial_report")
 async def financial_report_start(callback: types.CallbackQuery):
@@ -205,4 +298,65 @@ async def process_financial_report(message: types.Message):
     async with async_session() as session:
         report_text = await generate_annual_financial_report(year, session)
 
-    await message.answer(report_text, parse_mode=ParseMode.HTML)
\ No newline at end of file
+    await message.answer(report_text, parse_mode=ParseMode.HTML, reply_markup=report_refresh_markup(year))
+
+@router.callback_query(F.data.startswith("admin_report_refresh:"))
+async def refresh_financial_report(callback: types.CallbackQuery):
+    """Принудительная пересборка финансового отчета мимо кеша"""
+    if not await is_admin(callback.from_user.id):
+        return await callback.answer("❌ Доступ запрещен", show_alert=True)
+
+    year = int(callback.data.split(":")[1])
+    async with async_session() as session:
+        report_text = await generate_annual_financial_report(year, session, refresh=True)
+
+    try:
+        await callback.message.edit_text(report_text, parse_mode=ParseMode.HTML, reply_markup=report_refresh_markup(year))
+    except TelegramBadRequest:
+        # Текст не изменился - Telegram отказывается редактировать сообщение
+        pass
+    await callback.answer("🔄 Отчет пересобран")
+
+
+@router.callback_query(F.data == "admin_export_payments")
+async def export_payments_start(callback: types.CallbackQuery):
+    """Запрос параметров выгрузки платежей"""
+    if not await is_admin(callback.from_user.id):
+        return await callback.answer("❌ Доступ запрещен", show_alert=True)
+
+    await callback.message.answer(
+        "📤 Введите ID клиента или «все» и, при необходимости, формат (csv, gz, xlsx):\n"
+        "<i>Пример: 42 gz</i>",
+        parse_mode=ParseMode.HTML,
+        reply_markup=types.ForceReply(selective=True)
+    )
+
+@router.message(F.reply_to_message & F.reply_to_message.text.startswith("📤 Введите ID клиента"))
+async def process_export_payments(message: types.Message):
+    """Потоковая выгрузка платежей клиента или всего портфеля"""
+    if not await is_admin(message.from_user.id):
+        return await message.answer("❌ Доступ запрещен")
+
+    parts = message.text.lower().split()
+    target = parts[0] if parts else ""
+    file_format = parts[1] if len(parts) > 1 else "csv"
+
+    if target != "все" and not target.isdigit():
+        return await message.answer("❌ ID должен быть числом или «все»")
+    if file_format not in ("csv", "gz", "xlsx"):
+        return await message.answer("❌ Формат: csv, gz или xlsx")
+
+    client_id = int(target) if target.isdigit() else None
+
+    try:
+        async with async_session() as session:
+            async with export_payments(
+                session,
+                client_id=client_id,
+                file_format="xlsx" if file_format == "xlsx" else "csv",
+                compress=file_format == "gz"
+            ) as document:
+                await session.close()  # Не держим соединение на время загрузки файла в Telegram
+                await message.answer_document(document, caption="📤 Выгрузка платежей")
+    except RuntimeError as e:
+        await message.answer(f"❌ {e}")
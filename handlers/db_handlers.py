@@ -7,13 +7,15 @@ from aiogram.fsm.context import FSMContext
 from datetime import datetime, timedelta
 from decimal import Decimal, ROUND_DOWN
 from services.phone_validation import validate_phone_number
-from sqlalchemy import select, func, and_, delete
+from sqlalchemy import select, update, func, case, and_, delete
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import joinedload
 import logging
-import math
 
 from utils.database import async_session
+from utils.client_cache import client_cache
+from utils.loan_type_catalog import loan_type_catalog
+from utils.bulk import bulk_insert
 from models.user import Client, Loan, Payment, CreditHistory
 from models.base import LoanType, LoanStatus
 from config import Config
@@ -21,25 +23,19 @@ from states import *
 from utils.calculations import *
 from utils.auxiliary_funcs import *
 from utils.generate_files import *
+from services.penalty_accrual import accrue_penalties, overdue_summary
+from services.portfolio_rollup import record_loan_issued, record_loan_status, record_overdue
+from services.loan_ledger import record_issue
+from services.certificates import deliver_certificate
+from services.payment_acceptance import accept_payment, accept_early_repayment, PaymentRejected, message_key, callback_key
 
 router = Router(name="client_handlers")
 
-class ClientRegistrationForm:
-    """Класс для многошаговой регистрации"""
-    def __init__(self):
-        self.fullName = None
-        self.passport = None
-        self.phone = None
-        self.email = None
-
-# Временное хранилище для форм (в продакшене используйте Redis)
-temp_storage = {}
-
 @router.message(Command("register"))
-async def start_registration(message: types.Message):
+async def start_registration(message: types.Message, state: FSMContext):
     """Начало процесса регистрации"""
-    form = ClientRegistrationForm()
-    temp_storage[message.from_user.id] = form
+    await state.clear()
+    await state.set_state(RegistrationStates.full_name)
 
     await message.answer(
         "📝 Регистрация в кредитной системе\n\n"
@@ -157,8 +153,14 @@ async def process_new_phone(message: Message, state: FSMContext):
             if not client:
                 return
 
-            client.phone_numbers = [phone]
+            await session.execute(
+                update(Client)
+                .where(Client.clientID == client.clientID)
+                .values(phone_numbers=[phone])
+                .execution_options(synchronize_session=False)
+            )
             await session.commit()
+            client_cache.invalidate(message.from_user.id)
 
         await message.answer("✅ Номер телефона успешно обновлен!")
         await state.clear()
@@ -170,11 +172,11 @@ async def process_new_phone(message: Message, state: FSMContext):
         await message.answer("⚠️ Произошла ошибка. Попробуйте позже.")
         await state.clear()
 
-@router.message(F.text, lambda msg: msg.from_user.id in temp_storage and not temp_storage[msg.from_user.id].fullName)
-async def process_full_name(message: types.Message):
+@router.message(RegistrationStates.full_name, F.text)
+async def process_full_name(message: types.Message, state: FSMContext):
     """Обработка ФИО"""
-    form = temp_storage[message.from_user.id]
-    form.fullName = message.text
+    await state.update_data(full_name=message.text)
+    await state.set_state(RegistrationStates.passport)
 
     await message.answer(
         "🔐 Введите <b>серию и номер паспорта</b> (10 цифр):\n"
@@ -182,14 +184,14 @@ async def process_full_name(message: types.Message):
         parse_mode=ParseMode.HTML
     )
 
-@router.message(F.text, lambda msg: msg.from_user.id in temp_storage and not temp_storage[msg.from_user.id].passport)
-async def process_passport(message: types.Message):
+@router.message(RegistrationStates.passport, F.text)
+async def process_passport(message: types.Message, state: FSMContext):
     """Обработка паспортных данных"""
     if not message.text.isdigit() or len(message.text) != 10:
         return await message.answer("❌ Неверный формат паспорта. Введите 10 цифр.")
 
-    form = temp_storage[message.from_user.id]
-    form.passport = message.text
+    await state.update_data(passport=message.text)
+    await state.set_state(RegistrationStates.phone)
 
     await message.answer(
         "📱 Введите <b>номер телефона</b> (с кодом страны):\n"
@@ -197,12 +199,12 @@ async def process_passport(message: types.Message):
         parse_mode=ParseMode.HTML
     )
 
-@router.message(F.text, lambda msg: msg.from_user.id in temp_storage and not temp_storage[msg.from_user.id].phone)
-async def process_phone(message: types.Message):
+@router.message(RegistrationStates.phone, F.text)
+async def process_phone(message: types.Message, state: FSMContext):
     """Обработка телефона"""
     try:
-        form = temp_storage[message.from_user.id]
-        form.phone = Client.validate_phone(message.text)
+        await state.update_data(phone=Client.validate_phone(message.text))
+        await state.set_state(RegistrationStates.email)
 
         await message.answer(
             "📧 Введите <b>email</b> (необязательно):\n"
@@ -212,10 +214,11 @@ async def process_phone(message: types.Message):
     except ValueError as e:
         await message.answer(f"❌ Ошибка: {str(e)}")
 
-@router.message(F.text, lambda msg: msg.from_user.id in temp_storage and not temp_storage[msg.from_user.id].email)
-async def process_email(message: types.Message):
+@router.message(RegistrationStates.email, F.text)
+async def process_email(message: types.Message, state: FSMContext):
     """Обработка email и финальное сохранение"""
-    form = temp_storage.pop(message.from_user.id)
+    form = await state.get_data()
+    await state.clear()
     email = message.text if "@" in message.text else None
 
     async with async_session() as session:
@@ -224,7 +227,7 @@ async def process_email(message: types.Message):
             existing = await session.execute(
                 select(Client).where(
                     (Client.telegram_id == message.from_user.id) |
-                    (Client.passport == form.passport)
+                    (Client.passport == form['passport'])
                 )
             )
 
@@ -233,16 +236,17 @@ async def process_email(message: types.Message):
 
             # Создаем нового клиента
             client = Client(
-                fullName=form.fullName,
-                passport=form.passport,
+                fullName=form['full_name'],
+                passport=form['passport'],
                 telegram_id=message.from_user.id,
-                phone_numbers=[form.phone],
+                phone_numbers=[form['phone']],
                 email=email,
                 creditScore=300  # Начальный кредитный рейтинг
             )
 
             session.add(client)
             await session.commit()
+            client_cache.invalidate(message.from_user.id)
 
             await message.answer(
                 "✅ Регистрация завершена!\n\n"
@@ -412,68 +416,52 @@ async def start_loan_process(message: types.Message, state: FSMContext):
                 "Новый кредит не может быть оформлен."
             )
 
-        # Получаем доступные типы кредитов
-        loan_types = await session.execute(select(LoanType))
-        loan_types = loan_types.scalars().all()
-
-        if not loan_types:
-            return await message.answer("⚠ В настоящее время кредитные продукты недоступны")
-
-        # Создаем клавиатуру с типами кредитов
-        keyboard = types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text=f"{lt.name} ({lt.interest_rate}%)")]
-                for lt in loan_types
-            ],
-            resize_keyboard=True,
-            one_time_keyboard=True
-        )
+    # Типы кредитов и клавиатура - из справочника в памяти
+    await loan_type_catalog.ensure_fresh()
+    if not loan_type_catalog.keyboard:
+        return await message.answer("⚠ В настоящее время кредитные продукты недоступны")
 
-        await message.answer(
-            "💰 <b>Выберите тип кредита:</b>",
-            reply_markup=keyboard,
-            parse_mode=ParseMode.HTML
-        )
-        await state.set_state(LoanStates.choose_loan_type)
+    await message.answer(
+        "💰 <b>Выберите тип кредита:</b>",
+        reply_markup=loan_type_catalog.keyboard,
+        parse_mode=ParseMode.HTML
+    )
+    await state.set_state(LoanStates.choose_loan_type)
 
 @router.message(LoanStates.choose_loan_type)
 async def process_loan_type(message: types.Message, state: FSMContext):
     """Обработка выбора типа кредита"""
-    async with async_session() as session:
-        try:
-            # Получаем выбранный тип кредита
-            loan_type_name = message.text.split('(')[0].strip()
-            loan_type = await session.execute(
-                select(LoanType)
-                .where(LoanType.name == loan_type_name)
-            )
-            loan_type = loan_type.scalar()
+    try:
+        # Выбранный тип кредита - из справочника в памяти
+        await loan_type_catalog.ensure_fresh()
+        loan_type_name = message.text.split('(')[0].strip()
+        loan_type = loan_type_catalog.by_name(loan_type_name)
 
-            if not loan_type:
-                await message.answer("❌ Неверный тип кредита. Попробуйте еще раз.")
-                return
+        if not loan_type:
+            await message.answer("❌ Неверный тип кредита. Попробуйте еще раз.")
+            return
 
-            # Сохраняем данные в состоянии
-            await state.update_data({
-                'loan_type_id': loan_type.type_id,
-                'min_amount': loan_type.min_amount,
-                'max_amount': loan_type.max_amount,
-                'min_term': loan_type.min_term,
-                'max_term': loan_type.max_term,
-                'interest_rate': loan_type.interest_rate
-            })
-
-            # Запрашиваем сумму кредита
-            await message.answer(
-                f"💵 Введите сумму кредита (от {loan_type.min_amount} до {loan_type.max_amount} руб.):",
-                reply_markup=ReplyKeyboardRemove()
-            )
-            await state.set_state(LoanStates.enter_amount)
+        # Сохраняем данные в состоянии
+        await state.update_data({
+            'loan_type_id': loan_type.type_id,
+            'min_amount': loan_type.min_amount,
+            'max_amount': loan_type.max_amount,
+            'min_term': loan_type.min_term,
+            'max_term': loan_type.max_term,
+            'interest_rate': loan_type.interest_rate
+        })
+
+        # Запрашиваем сумму кредита
+        await message.answer(
+            f"💵 Введите сумму кредита (от {loan_type.min_amount} до {loan_type.max_amount} руб.):",
+            reply_markup=ReplyKeyboardRemove()
+        )
+        await state.set_state(LoanStates.enter_amount)
 
-        except Exception as e:
-            logging.error(f"Ошибка выбора типа кредита: {e}")
-            await message.answer("⚠ Произошла ошибка. Попробуйте позже.")
-            await state.clear()
+    except Exception as e:
+        logging.error(f"Ошибка выбора типа кредита: {e}")
+        await message.answer("⚠ Произошла ошибка. Попробуйте позже.")
+        await state.clear()
 
 @router.message(LoanStates.enter_amount)
 async def process_loan_amount(message: types.Message, state: FSMContext):
@@ -530,11 +518,12 @@ async def process_loan_term(message: types.Message, state: FSMContext):
 
         await state.update_data({'term': term})
 
-        # Рассчитываем примерный платеж
-        monthly_payment = calculate_monthly_payment(
+        # Рассчитываем точный график в памяти - без обращения к БД
+        schedule = build_schedule(
             data['amount'],
             term,
-            data['interest_rate']
+            data['interest_rate'],
+            datetime.utcnow().date()
         )
 
         # Показываем подтверждение
@@ -552,7 +541,10 @@ async def process_loan_term(message: types.Message, state: FSMContext):
             f"Сумма: {data['amount']} руб.\n"
             f"Срок: {term} мес.\n"
             f"Процентная ставка: {data['interest_rate']}%\n"
-            f"Примерный ежемесячный платеж: ~{monthly_payment:.2f} руб.\n\n"
+            f"Ежемесячный платеж: {schedule.monthly_payment:.2f} руб.\n"
+            f"Первый платеж: {schedule.first_date.strftime('%d.%m.%Y')}\n"
+            f"Переплата по процентам: {schedule.total_interest:.2f} руб.\n"
+            f"Всего к выплате: {schedule.total_amount:.2f} руб.\n\n"
             "Подтверждаете оформление кредита?",
             reply_markup=keyboard,
             parse_mode=ParseMode.HTML
@@ -594,38 +586,33 @@ async def confirm_loan(message: types.Message, state: FSMContext):
             session.add(new_loan)
             await session.flush()  # Получаем loan_id
 
-            # Генерируем график платежей
-
-            payments = await generate_payment_schedule(
-                loan_id=new_loan.loan_id,
-                amount=Decimal(data['amount']),
-                term=data['term'],
-                interest_rate=data['interest_rate'],
-                start_date=datetime.utcnow().date(),
-                session=session
+            # Рассчитываем график в памяти и сохраняем его одним шагом
+            schedule = build_schedule(
+                Decimal(data['amount']),
+                data['term'],
+                data['interest_rate'],
+                new_loan.issue_date.date()
             )
+            await save_schedule(session, new_loan.loan_id, schedule)
+            record_issue(session, new_loan, schedule.first_date)
 
-            # Добавляем платежи в сессию
-            if payments:
-                for payment in payments:
-                    session.add(payment)
-            else:
-                logging.error("Нет платежей для обработки")
-
-            # Обновляем кредитный рейтинг клиента
-            client.creditScore = min(1000, client.creditScore + 10)  # Небольшой бонус за взятие кредита
+            # Небольшой бонус к кредитному рейтингу за взятие кредита - в SQL: объект клиента
+            # из кеша может быть устаревшим и затер бы изменение рейтинга администратором
+            await session.execute(
+                update(Client)
+                .where(Client.clientID == client.clientID)
+                .values(creditScore=case((Client.creditScore + 10 > 1000, 1000), else_=Client.creditScore + 10))
+                .execution_options(synchronize_session=False)
+            )
 
+            record_loan_issued(session, new_loan)
             await session.commit()
+            client_cache.invalidate(message.from_user.id)
 
-            # Рассчитываем точный ежемесячный платеж
-            monthly_payment = calculate_monthly_payment(
-                Decimal(data['amount']),
-                data['term'],
-                data['interest_rate']
-            )
+            monthly_payment = schedule.monthly_payment
 
             # Создаем CSV файл с графиком платежей
-            csv_file = generate_payments_csv(payments, new_loan.loan_id)
+            csv_file = generate_schedule_csv(schedule, new_loan.loan_id)
 
 
             # Отправляем сообщение с деталями кредита
@@ -685,8 +672,6 @@ async def start_payment_process(message: types.Message, state: FSMContext):
         # Логируем количество найденных кредитов для отладки
         print(f"Found {len(loans)} active loans for client {client.clientID}")
 
-        await state.update_data(loans={loan.loan_id: loan for loan in loans})
-
         # Создаем кнопки для кредитов (максимум 10 чтобы не перегружать интерфейс)
         loan_buttons = [
             [types.KeyboardButton(text=f"Кредит #{l.loan_id} - {l.amount:,.2f}₽")]
@@ -715,89 +700,29 @@ async def choose_loan_for_payment(message: types.Message, state: FSMContext):
         loan_id = int(message.text.split('#')[1].split()[0])
 
         async with async_session() as session:
-            # Получаем данные по кредиту
-            loan = await session.get(Loan, loan_id)
-            if not loan:
+            today = date.today()
+            # Пеня начисляется на сами просроченные платежи тем же запросом, что и фоновая задача
+            await accrue_penalties(session, today, loan_id=loan_id)
+            await session.commit()
+
+            # Кредит и все его платежи - одним запросом
+            snapshot = await fetch_loan_snapshot(session, loan_id, today)
+            if not snapshot:
                 await message.answer("❌ Кредит не найден")
                 await state.clear()
                 return
 
-            # Получаем все платежи по кредиту из БД
-            payments = await session.scalars(
-                select(Payment)
-                .where(Payment.loan_id == loan_id)
-                .order_by(Payment.payment_date_plan)
-            )
-            payments = payments.all()
-
-            # Рассчитываем общую сумму оплаченных платежей
-            total_paid = sum(
-                Decimal(str(p.actual_amount))
-                for p in payments
-                if p.actual_amount is not None
-            )
-
-            # Обновляем остаток долга
-            loan.remaining_amount = loan.amount - total_paid
-
-            # Находим следующий платеж (первый неоплаченный)
-            next_payment = await session.scalar(
-                select(Payment)
-                .where(Payment.loan_id == loan_id)
-                .where(Payment.payment_date_fact.is_(None))
-                .order_by(Payment.payment_date_plan.asc())
-                .limit(1)
-            )
-
-            # Находим просроченные платежи
-            today = date.today()
-            overdue_payments = await session.scalars(
-                select(Payment)
-                .where(Payment.loan_id == loan_id)
-                .where(Payment.payment_date_plan < today)
-                .where(Payment.payment_date_fact.is_(None))
-                .order_by(Payment.payment_date_plan.asc())
-            )
-            overdue_payments = overdue_payments.all()
-
-            # Рассчитываем пени (если есть просрочки)
-            penalty_amount = Decimal('0')
-            if overdue_payments:
-                for payment in overdue_payments:
-                    days_overdue = (today - payment.payment_date_plan).days
-                    penalty_rate = Decimal('0.01')  # 1% в день
-                    penalty = Decimal(str(payment.planned_amount)) * penalty_rate * days_overdue
-                    penalty_amount += penalty
-
-                    # Добавляем запись о пени, если ее еще нет
-                    existing_penalty = await session.scalar(
-                        select(Payment)
-                        .where(Payment.loan_id == loan_id)
-                        .where(Payment.penalty_date == today)
-                        .where(Payment.payment_date_plan == payment.payment_date_plan)
-                    )
-
-                    if not existing_penalty:
-                        penalty_payment = Payment(
-                            loan_id=loan_id,
-                            payment_date_plan=payment.payment_date_plan,
-                            planned_amount=payment.planned_amount,
-                            payment_date_fact=None,
-                            actual_amount=0,
-                            penalty_date=today,
-                            penalty_amount=float(penalty)
-                        )
-                        session.add(penalty_payment)
-
-                await session.commit()
+            loan = snapshot.loan
+            next_payment = snapshot.next_payment
+            overdue_payments = snapshot.overdue
+            penalty_amount = snapshot_penalty(snapshot)
 
             # Сохраняем данные для следующего шага
             await state.update_data(
                 loan_id=loan_id,
-                current_loan=loan,
                 penalty_amount=float(penalty_amount),
                 next_payment_date=next_payment.payment_date_plan if next_payment else None,
-                next_payment_amount=Decimal(str(next_payment.planned_amount)) if next_payment else None
+                next_payment_amount=amount_due(next_payment) if next_payment else None
             )
 
             # Формируем информационное сообщение
@@ -805,13 +730,13 @@ async def choose_loan_for_payment(message: types.Message, state: FSMContext):
                 f"<b>Кредит #{loan_id}</b>",
                 f"🔹 Сумма: {loan.amount:.2f} руб.",
                 f"🔹 Срок: {loan.term} мес.",
-                f"🔹 Погашено: {total_paid:.2f} руб.",
+                f"🔹 Погашено: {loan.total_paid:.2f} руб.",
                 f"🔹 Остаток: {loan.remaining_amount:.2f} руб."
             ]
 
             if next_payment:
                 msg.append(f"🔹 След. платеж: {next_payment.payment_date_plan.strftime('%d.%m.%Y')}")
-                msg.append(f"🔹 Сумма платежа: {next_payment.planned_amount:.2f} руб.")
+                msg.append(f"🔹 Сумма платежа: {amount_due(next_payment):.2f} руб.")
 
             if overdue_payments:
                 days_overdue = (today - overdue_payments[0].payment_date_plan).days
@@ -834,6 +759,18 @@ async def choose_loan_for_payment(message: types.Message, state: FSMContext):
         await message.answer("⚠ Ошибка при обработке кредита")
         await state.clear()
 
+def payment_accepted_text(outcome) -> str:
+    """Ответ клиенту о зачисленном платеже"""
+    next_date = outcome.next_payment_date.strftime('%d.%m.%Y') if outcome.next_payment_date else 'нет'
+    return (
+        "✅ <b>Платеж успешно зачислен!</b>\n\n"
+        f"🔹 Номер кредита: #{outcome.loan_id}\n"
+        f"🔹 Сумма платежа: {outcome.amount:.2f} руб.\n"
+        f"🔹 Остаток долга: {outcome.remaining_amount:.2f} руб.\n"
+        f"🔹 След. платеж: {next_date}\n\n"
+        "Спасибо за своевременный платеж!"
+    )
+
 @router.message(PaymentStates.enter_amount, F.text.regexp(r'^\d+(\.\d{1,2})?$'))
 async def process_payment_amount(message: types.Message, state: FSMContext):
     '''Обработка суммы платежа с перерасчетом платежей если сумма больше, чем нужно'''
@@ -844,8 +781,8 @@ async def process_payment_amount(message: types.Message, state: FSMContext):
 
         data = await state.get_data()
         loan_id = data['loan_id']
-        current_date = date.today()
 
+        # Чтение без блокировок: только решить, нужен ли пересчет графика
         async with async_session() as session:
             # Получаем данные по кредиту
             loan = await session.get(Loan, loan_id)
@@ -868,7 +805,8 @@ async def process_payment_amount(message: types.Message, state: FSMContext):
                 await state.clear()
                 return
 
-            min_payment = Decimal(str(payment.planned_amount))
+            # Минимальный платеж - плановая сумма вместе с начисленной по платежу пеней
+            min_payment = amount_due(payment)
 
             # Проверяем превышение суммы долга
             if amount > loan.remaining_amount:
@@ -913,36 +851,19 @@ async def process_payment_amount(message: types.Message, state: FSMContext):
                 )
                 return
 
-            # Обновляем платеж
-            await update_payment_and_loan(session, payment, loan, amount, current_date, loan_id)
-
-            # Проверяем, если кредит полностью закрыт
-            if loan.remaining_amount <= 0:
-                # Завершаем кредит
-                loan.remaining_amount = Decimal('0')
-                loan.next_payment_date = None
-                loan.status = LoanStatus.CLOSED  # Используем значение из перечисления
-
-                # Удаляем все будущие неоплаченные платежи
-                await session.execute(
-                    delete(Payment)
-                    .where(Payment.loan_id == loan_id)
-                    .where(Payment.payment_date_fact.is_(None))
-                )
-                await session.commit()
-
-            # Формируем сообщение
-            response_msg = (
-                "✅ <b>Платеж успешно зачислен!</b>\n\n"
-                f"🔹 Номер кредита: #{loan_id}\n"
-                f"🔹 Сумма платежа: {amount:.2f} руб.\n"
-                f"🔹 Остаток долга: {loan.remaining_amount:.2f} руб.\n"
-                f"🔹 След. платеж: {loan.next_payment_date.strftime('%d.%m.%Y') if loan.next_payment_date else 'нет'}\n\n"
-                "Спасибо за своевременный платеж!"
-            )
-
-            await message.answer(response_msg, parse_mode=ParseMode.HTML)
+        # Зачисляем платеж под блокировкой кредита (повтор того же сообщения не зачисляется дважды)
+        try:
+            outcome = await accept_payment(message_key(message), loan_id, amount)
+        except PaymentRejected as e:
+            await message.answer(str(e))
             await state.clear()
+            return
+
+        await message.answer(payment_accepted_text(outcome), parse_mode=ParseMode.HTML)
+        await state.clear()
+        if outcome.closed:
+            async with async_session() as session:
+                await deliver_certificate(message.bot, session, outcome.loan_id)
 
     except ValueError as e:
         await message.answer(f"❌ Ошибка: {str(e)}\nПожалуйста, введите корректную сумму:")
@@ -957,107 +878,30 @@ async def confirm_recalculate(callback: types.CallbackQuery, state: FSMContext):
     '''Обработка подтверждения суммы с пересчетом платежей'''
     try:
         data = await state.get_data()
+        if 'proposed_amount' not in data:
+            # Повторное нажатие после завершения платежа
+            await callback.answer("Платеж уже обработан")
+            return
         amount = Decimal(data['proposed_amount'])
         loan_id = data['loan_id']
-        current_date = date.today()
-
-        async with async_session() as session:
-            # Получаем кредит с загруженным типом
-            loan = await session.get(Loan, loan_id, options=[joinedload(Loan.loan_type)])
-            if not loan:
-                await callback.message.answer("❌ Кредит не найден")
-                await state.clear()
-                return
-
-            # Проверяем наличие типа кредита и процентной ставки
-            if not loan.loan_type or not hasattr(loan.loan_type, 'interest_rate'):
-                await callback.message.answer("❌ Не удалось определить процентную ставку по кредиту")
-                await state.clear()
-                return
-
-            # Находим первый непогашенный платеж
-            payment = await session.scalar(
-                select(Payment)
-                .where(Payment.loan_id == loan_id)
-                .where(Payment.payment_date_fact.is_(None))
-                .order_by(Payment.payment_date_plan.asc())
-                .limit(1)
-            )
-
-            if not payment:
-                await callback.message.answer("ℹ Нет платежей для погашения")
-                await state.clear()
-                return
-
-            # 1. Отмечаем текущий платеж как оплаченный
-            payment.payment_date_fact = current_date
-            payment.actual_amount = amount
-
-            # 2. Вычисляем новый остаток
-            remaining_amount = loan.remaining_amount - amount
 
-            # 3. Удаляем только будущие неоплаченные платежи
-            await session.execute(
-                delete(Payment)
-                .where(Payment.loan_id == loan_id)
-                .where(Payment.payment_date_plan > payment.payment_date_plan)
-                .where(Payment.payment_date_fact.is_(None))
-            )
-
-            # 4. Вычисляем оставшийся срок
-            remaining_term = loan.term - (await session.scalar(
-                select(func.count(Payment.payment_id))
-                .where(
-                    (Payment.loan_id == loan_id) &
-                    (Payment.payment_date_fact.is_not(None))
-                )
-            ))
-
-            # 5. Определяем дату старта новых платежей — следующий месяц после текущего платежа
-            # Получаем последний плановый платеж
-            last_payment = await session.scalar(
-                select(Payment)
-                .where(Payment.loan_id == loan_id)
-                .order_by(Payment.payment_date_plan.desc())
-                .limit(1))
-            start_date = last_payment.payment_date_plan if last_payment else date.today()
-
-
-            # 6. Генерируем новый график платежей
-            new_payments = await generate_payment_schedule(
-                loan_id=loan_id,
-                amount=remaining_amount,
-                term=remaining_term,
-                interest_rate=loan.loan_type.interest_rate,
-                start_date=start_date,
-                session=session
-            )
-
-
-            # 7. Обновляем данные кредита
-            loan.remaining_amount = remaining_amount
-            loan.next_payment_date = new_payments[0].payment_date_plan if new_payments else None
-
-            # Завершаем кредит, если остаток 0
-            if loan.remaining_amount <= 0:
-                loan.status = LoanStatus.CLOSED  # Если такое поле есть
-                loan.next_payment_date = None
-
-            # 8. Коммитим изменения
-            await session.commit()
+        # Зачисление, удаление будущих платежей и новый график - одной транзакцией под блокировкой кредита
+        try:
+            outcome = await accept_payment(callback_key(callback), loan_id, amount, recalculate=True)
+        except PaymentRejected as e:
+            await callback.message.answer(str(e))
+            await state.clear()
+            return
 
-            # Формируем сообщение
-            response_msg = (
-                "✅ <b>Платеж успешно зачислен!</b>\n\n"
-                f"🔹 Номер кредита: #{loan_id}\n"
-                f"🔹 Сумма платежа: {amount:.2f} руб.\n"
-                f"🔹 Остаток долга: {remaining_amount:.2f} руб.\n"
-                f"🔹 След. платеж: {loan.next_payment_date.strftime('%d.%m.%Y') if loan.next_payment_date else 'нет'}\n\n"
-                "Спасибо за своевременный платеж!"
-            )
+        if outcome.duplicate:
+            await callback.answer("Платеж уже зачислен")
+            return
 
-            await callback.message.edit_text(response_msg, parse_mode=ParseMode.HTML)
-            await state.clear()
+        await callback.message.edit_text(payment_accepted_text(outcome), parse_mode=ParseMode.HTML)
+        await state.clear()
+        if outcome.closed:
+            async with async_session() as session:
+                await deliver_certificate(callback.bot, session, outcome.loan_id)
 
     except Exception as e:
         logging.error(f"Ошибка при подтверждении платежа: {e}", exc_info=True)
@@ -1195,8 +1039,8 @@ async def check_credit_status(message: Message, state: FSMContext):
             )
         )
         loans_list = active_or_overdue_loans.all()
-        # Получаем кредитный рейтинг клиента
-        credit_score = client.creditScore
+        # Кредитный рейтинг - из БД: по нему считается доступная сумма, а снимок из кеша может отставать
+        credit_score = await session.scalar(select(Client.creditScore).where(Client.clientID == client.clientID))
 
         # Получаем текущий статус кредита
         credit_status = get_credit_status(credit_score)
@@ -1246,8 +1090,6 @@ async def start_early_repayment_process(message: types.Message, state: FSMContex
         if not loans:
             return await message.answer("У вас нет активных кредитов для досрочного погашения")
 
-        await state.update_data(loans={loan.loan_id: loan for loan in loans})
-
         # Создаем кнопки для кредитов
         loan_buttons = [
             [types.KeyboardButton(text=f"Кредит #{l.loan_id} - {l.amount:,.2f}₽")]
@@ -1274,34 +1116,15 @@ async def choose_loan_for_early_repayment(message: types.Message, state: FSMCont
         loan_id = int(message.text.split('#')[1].split()[0])
 
         async with async_session() as session:
-            loan = await session.get(Loan, loan_id, options=[joinedload(Loan.loan_type)])
+            loan = await session.get(Loan, loan_id)
             if not loan:
                 await message.answer("❌ Кредит не найден")
                 await state.clear()
                 return
 
-            # Получаем все платежи
-            payments = await session.scalars(
-                select(Payment)
-                .where(Payment.loan_id == loan_id)
-                .order_by(Payment.payment_date_plan)
-            )
-            payments = payments.all()
-
-            # Рассчитываем общую сумму оплаченных платежей
-            total_paid = sum(
-                Decimal(str(p.actual_amount))
-                for p in payments
-                if p.actual_amount is not None
-            )
-
-            # Обновляем остаток долга
-            loan.remaining_amount = loan.amount - total_paid
-
             # Сохраняем данные
             await state.update_data(
                 loan_id=loan_id,
-                current_loan=loan,
                 remaining_amount=loan.remaining_amount
             )
 
@@ -1360,10 +1183,41 @@ async def choose_early_repayment_type(message: types.Message, state: FSMContext)
         await state.clear()
 
 
+def early_repayment_text(outcome, shorten_term: bool) -> str:
+    """Ответ клиенту о зачисленном досрочном погашении"""
+    if outcome.closed:
+        return (
+            "✅ <b>Кредит полностью погашен!</b>\n\n"
+            f"🔹 Номер кредита: #{outcome.loan_id}\n"
+            f"🔹 Сумма погашения: {outcome.amount:.2f} руб.\n"
+            "Поздравляем с полным погашением кредита!"
+        )
+    if outcome.schedule is None:
+        # Повтор уже принятого погашения - новый график не пересчитывается
+        return payment_accepted_text(outcome)
+
+    lines = [
+        "✅ <b>Досрочное погашение успешно зачислено!</b>\n",
+        f"🔹 Номер кредита: #{outcome.loan_id}",
+        f"🔹 Сумма погашения: {outcome.amount:.2f} руб.",
+        f"🔹 Остаток долга: {outcome.remaining_amount:.2f} руб."
+    ]
+    if shorten_term:
+        lines += [
+            "🔹 Срок кредита сокращен.",
+            f"🔹 Новый срок: {len(outcome.schedule)} платеж(а).",
+            f"🔹 Размер платежа: {outcome.schedule.monthly_payment:.2f} руб."
+        ]
+    else:
+        lines += [
+            f"🔹 Новый размер платежа: {outcome.schedule.monthly_payment:.2f} руб.",
+            f"🔹 Срок сохранен: {len(outcome.schedule)} мес."
+        ]
+    return "\n".join(lines)
+
 @router.message(EarlyRepaymentStates.enter_amount, F.text.regexp(r'^\d+(\.\d{1,2})?$'))
 async def process_early_repayment_amount(message: types.Message, state: FSMContext):
     """Обработка суммы досрочного погашения с пересчетом графика платежей"""
-    response_msg = None
     try:
         amount = Decimal(message.text)
         if amount <= 0:
@@ -1371,138 +1225,30 @@ async def process_early_repayment_amount(message: types.Message, state: FSMConte
 
         data = await state.get_data()
         loan_id = data['loan_id']
-        repayment_type = data['repayment_type']
-        current_date = date.today()
+        shorten_term = data['repayment_type'] == "Сократить срок кредита"
 
+        # Чтение без блокировок: только предупредить о сумме сверх остатка
         async with async_session() as session:
-            # Получаем кредит с типом (для процентной ставки)
-            loan = await session.get(Loan, loan_id, options=[joinedload(Loan.loan_type)])
-            if not loan:
-                await message.answer("❌ Кредит не найден")
-                await state.clear()
-                return
-
-            if amount > loan.remaining_amount:
-                amount = loan.remaining_amount
+            loan = await session.get(Loan, loan_id)
+            if loan and amount > loan.remaining_amount:
                 await message.answer(
-                    f"⚠ Сумма превышает остаток долга. Будет зачислено {amount:.2f} руб."
-                )
-
-            # Получаем все платежи по кредиту
-            payments = await session.scalars(
-                select(Payment)
-                .where(Payment.loan_id == loan_id)
-                .order_by(Payment.payment_date_plan.asc())
-            )
-            payments_list = list(payments)
-
-            # Добавляем запись о досрочном погашении
-            early_payment = Payment(
-                loan_id=loan_id,
-                payment_date_plan=current_date,
-                planned_amount=float(amount),
-                payment_date_fact=current_date,
-                actual_amount=float(amount),
-                is_early_payment=True
-            )
-            session.add(early_payment)
-
-            # Обновляем остаток по кредиту
-            loan.remaining_amount -= amount
-
-            # Удаляем все будущие неоплаченные платежи
-            await session.execute(
-                delete(Payment)
-                .where(Payment.loan_id == loan_id)
-                .where(Payment.payment_date_fact.is_(None))
-            )
-
-            if loan.remaining_amount <= 0:
-                loan.status = "CLOSED"
-                loan.next_payment_date = None
-                response_msg = (
-                    "✅ <b>Кредит полностью погашен!</b>\n\n"
-                    f"🔹 Номер кредита: #{loan_id}\n"
-                    f"🔹 Сумма погашения: {amount:.2f} руб.\n"
-                    "Поздравляем с полным погашением кредита!"
+                    f"⚠ Сумма превышает остаток долга. Будет зачислено {loan.remaining_amount:.2f} руб."
                 )
-            else:
-                # Получаем количество уже совершенных платежей
-                paid_payments_count = len([p for p in payments_list if p.payment_date_fact is not None])
-                remaining_term = loan.term - paid_payments_count
-
-                # Находим дату последнего совершенного платежа
-                last_paid_date = max(
-                    p.payment_date_plan
-                    for p in payments_list
-                    if p.payment_date_fact is not None
-                ) if any(p.payment_date_fact is not None for p in payments_list) else loan.issue_date
-
-                if repayment_type == "Сократить срок кредита":
-                    # Полностью пересчитываем график с новым сроком
-                    # Рассчитываем новый срок пропорционально остатку
-                    original_term = loan.term
-                    original_amount = Decimal(str(loan.amount))
-                    paid_ratio = (original_amount - loan.remaining_amount) / original_amount
-                    new_term = max(1, math.floor(remaining_term * (1 - paid_ratio)))
-
-                    # Генерируем новый график платежей с пересчетом процентов
-                    new_payments = await generate_payment_schedule(
-                        loan_id=loan_id,
-                        amount=loan.remaining_amount,
-                        term=new_term,
-                        interest_rate=loan.loan_type.interest_rate,
-                        start_date=last_paid_date,
-                        session=session
-                    )
 
-                    # Получаем новый размер платежа
-                    new_monthly_payment = Decimal(str(new_payments[0].planned_amount)) if new_payments else Decimal('0')
-
-                    response_msg = (
-                        "✅ <b>Досрочное погашение успешно зачислено!</b>\n\n"
-                        f"🔹 Номер кредита: #{loan_id}\n"
-                        f"🔹 Сумма погашения: {amount:.2f} руб.\n"
-                        f"🔹 Остаток долга: {loan.remaining_amount:.2f} руб.\n"
-                        f"🔹 Срок кредита сокращен.\n"
-                        f"🔹 Новый срок: {new_term} платеж(а).\n"
-                        f"🔹 Новый размер платежа: {new_monthly_payment:.2f} руб."
-                    )
-                else:
-                    # Уменьшение размера платежа с пересчетом по аннуитетной схеме
-                    new_payments = await generate_payment_schedule(
-                        loan_id=loan_id,
-                        amount=loan.remaining_amount,
-                        term=remaining_term,
-                        interest_rate=loan.loan_type.interest_rate,
-                        start_date=last_paid_date,
-                        session=session
-                    )
-
-                    new_monthly_payment = Decimal(str(new_payments[0].planned_amount)) if new_payments else Decimal('0')
-
-                    response_msg = (
-                        "✅ <b>Досрочное погашение успешно зачислено!</b>\n\n"
-                        f"🔹 Номер кредита: #{loan_id}\n"
-                        f"🔹 Сумма погашения: {amount:.2f} руб.\n"
-                        f"🔹 Остаток долга: {loan.remaining_amount:.2f} руб.\n"
-                        f"🔹 Новый размер платежа: {new_monthly_payment:.2f} руб.\n"
-                        f"🔹 Срок сохранен: {remaining_term} мес."
-                    )
-
-                # Обновляем дату следующего платежа
-                first_future_payment = await session.scalar(
-                    select(Payment)
-                    .where(Payment.loan_id == loan_id)
-                    .where(Payment.payment_date_fact.is_(None))
-                    .order_by(Payment.payment_date_plan.asc())
-                    .limit(1)
-                )
-                loan.next_payment_date = first_future_payment.payment_date_plan if first_future_payment else None
-
-            await session.commit()
-            await message.answer(response_msg, parse_mode=ParseMode.HTML)
+        # Зачисление и новый график - одной транзакцией под блокировкой кредита
+        # (повтор того же сообщения не зачисляется дважды)
+        try:
+            outcome = await accept_early_repayment(message_key(message), loan_id, amount, shorten_term)
+        except PaymentRejected as e:
+            await message.answer(str(e))
             await state.clear()
+            return
+
+        await message.answer(early_repayment_text(outcome, shorten_term), parse_mode=ParseMode.HTML)
+        await state.clear()
+        if outcome.closed and not outcome.duplicate:
+            async with async_session() as session:
+                await deliver_certificate(message.bot, session, outcome.loan_id)
 
     except ValueError as e:
         await message.answer(f"❌ Ошибка: {str(e)}\nПожалуйста, введите корректную сумму:")
@@ -1514,72 +1260,26 @@ async def process_early_repayment_amount(message: types.Message, state: FSMConte
 #ПЕРЕРАСЧЕТ С УЧЕТОМ ПЕННИ
 @router.message(Command("calculate_penny"))
 async def calculate_penny(message: types.Message):
+    """Начисление пени по просроченным платежам клиента (1% в сутки)"""
     try:
-        current_date = date.today()
-        penalties_applied = False
-
         async with async_session() as session:
             # Сначала находим клиента по telegram_id
             client = await check_client_registered(message, session)
             if not client:
                 return
 
-            # Ищем только кредиты этого клиента
-            result = await session.scalars(
-                select(Loan)
-                .where(
-                    (Loan.client_id == client.clientID) &
-                    (Loan.status.in_([LoanStatus.ACTIVE, LoanStatus.OVERDUE]))
-                )
-            )
-            loans = list(result)
-
-            if not loans:
-                await message.answer("ℹ У вас нет активных или просроченных кредитов.")
-                return
-
-            for loan in loans:
-                loan_overdue = False
-                total_penalty = Decimal('0.00')
-
-                payments = await session.scalars(
-                    select(Payment)
-                    .where(Payment.loan_id == loan.loan_id)
-                    .order_by(Payment.payment_date_plan)
-                )
-                payments_list = list(payments)
-
-                for payment in payments_list:
-                    if not payment.payment_date_fact and payment.payment_date_plan < current_date:
-                        # Платеж просрочен
-                        overdue_days = (current_date - payment.payment_date_plan).days
-                        penalty = (Decimal(payment.planned_amount) * Decimal('0.01') * overdue_days).quantize(Decimal('0.01'))
-
-                        payment.penalty_amount = float(penalty)
-                        payment.penalty_date = current_date
-
-                        loan_overdue = True
-                        penalties_applied = True
-                        total_penalty += penalty
-
-                if loan_overdue:
-                    loan.status = LoanStatus.OVERDUE
-                    loan.remaining_amount += total_penalty
-
-                    unpaid_payments = [p for p in payments_list if not p.payment_date_fact]
-
-                    if not unpaid_payments:
-                        continue
-
-                    new_monthly_payment = (Decimal(loan.remaining_amount) / len(unpaid_payments)).quantize(Decimal('0.01'))
-
-                    for payment in unpaid_payments:
-                        payment.planned_amount = float(new_monthly_payment)
-
+            # Начисление тем же набором запросов, что и фоновая задача, но только по этому клиенту
+            await accrue_penalties(session, client_id=client.clientID)
             await session.commit()
 
-        if penalties_applied:
-            await message.answer("✅ Перерасчет оставшихся платежей с учетом пени произведен!")
+            overdue_count, total_penalty = await overdue_summary(session, client.clientID)
+
+        if overdue_count:
+            await message.answer(
+                "✅ Перерасчет с учетом пени произведен!\n"
+                f"Просроченных платежей: {overdue_count}\n"
+                f"Начислено пени: {total_penalty:.2f} руб."
+            )
         else:
             await message.answer("✅ Все хорошо, просрочек по вашим кредитам нет.")
 
@@ -1614,6 +1314,12 @@ async def set_payment_late(message: types.Message):
 
             # Изменяем платеж
             one_month_ago = date.today() - relativedelta(months=1)
+            loan = await session.get(Loan, payment.loan_id)
+            if payment.penalty_date is not None:
+                # Пеня сбрасывается - платеж выходит из просрочки в сводке до следующего начисления,
+                # а начисленная пеня уходит из остатка долга
+                record_overdue(session, loan.loan_type_id, payment.payment_date_plan, payment.planned_amount, -1)
+                loan.remaining_amount = Decimal(str(loan.remaining_amount)) - Decimal(str(payment.penalty_amount or 0))
             payment.payment_date_plan = one_month_ago
             payment.payment_date_fact = None
             payment.actual_amount = 0.00
@@ -1621,8 +1327,8 @@ async def set_payment_late(message: types.Message):
             payment.penalty_amount = 0.00
 
             # Помечаем кредит как просроченный
-            loan = await session.get(Loan, payment.loan_id)
-            if loan and loan.status == LoanStatus.ACTIVE:
+            if loan.status == LoanStatus.ACTIVE:
+                record_loan_status(session, loan.issue_date, loan.loan_type_id, loan.status, LoanStatus.OVERDUE)
                 loan.status = LoanStatus.OVERDUE
 
             await session.commit()
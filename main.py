@@ -3,21 +3,35 @@ from aiogram import Bot, Dispatcher
 from config import Config
 from handlers import basic, db_handlers, admin
 from utils.commands import set_bot_commands
-from utils.database import init_db, async_session
-from utils.data_filler import add_default_loan_types
+from utils.database import init_db, engine
+from utils.loan_type_catalog import loan_type_catalog
+from utils.documents import document_renderer
+from utils.fsm_storage import build_fsm_storage
+from services.penalty_accrual import start_penalty_accrual, stop_penalty_accrual
+from services.reminders import start_reminders, stop_reminders
+from services.webhook import run_webhook
+from services.perf import setup_perf, install_sql_hooks, start_metrics_server
 from aiohttp import ClientSession
 
 async def on_startup(bot: Bot):
     await init_db()
-    async with async_session() as session:
-        await add_default_loan_types(session)
+    await loan_type_catalog.ensure_fresh()
+    document_renderer.load()
+    if Config.PENALTY_ACCRUAL_ENABLED:
+        start_penalty_accrual()
+    if Config.REMINDERS_ENABLED:
+        start_reminders(bot)
     logging.info("Bot startup completed")
 
+async def on_shutdown(bot: Bot):
+    await stop_penalty_accrual()
+    await stop_reminders()
+
 async def main():
     logging.basicConfig(level=logging.DEBUG)  # Установлен DEBUG для отладки
 
     bot = Bot(token=Config.BOT_TOKEN)
-    dp = Dispatcher()
+    dp = Dispatcher(storage=build_fsm_storage())
 
     # Установка команд бота
     await set_bot_commands(bot)
@@ -27,7 +41,21 @@ async def main():
         db_handlers.router,
         admin.router
     )
+    setup_perf(dp, basic.router, db_handlers.router, admin.router)
+    install_sql_hooks(engine)
     dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
+    if Config.BOT_MODE == "webhook":
+        try:
+            await run_webhook(dp, bot)
+        finally:
+            await dp.fsm.storage.close()
+            await bot.session.close()
+        return
+
+    # Метрики Prometheus в режиме polling - на отдельном порту
+    metrics_runner = await start_metrics_server()
 
     # Создаём ClientSession для aiogram
     async with ClientSession() as http_session:
@@ -35,6 +63,8 @@ async def main():
             await dp.start_polling(bot, http_session=http_session)
         finally:
             # Гарантируем завершение всех задач
+            if metrics_runner:
+                await metrics_runner.cleanup()
             await dp.fsm.storage.close()
             await bot.session.close()
 
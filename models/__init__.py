@@ -1,4 +1,5 @@
 from .base import Base
 from .user import Client
+from .service import FSMRecord, PortfolioMonthly, SchemaVersion, AcceptedPayment, CourtNotice, LoanCertificate, PaymentReminder
 
-__all__ = ["Base", "Client"]
\ No newline at end of file
+__all__ = ["Base", "Client", "FSMRecord", "PortfolioMonthly", "SchemaVersion", "AcceptedPayment", "CourtNotice", "LoanCertificate", "PaymentReminder"]
@@ -0,0 +1,170 @@
+from datetime import datetime
+from sqlalchemy import Column, String, Text, DateTime, Date, Integer, Numeric, Boolean, Index, text
+from .base import Base
+
+
+class FSMRecord(Base):
+    """
+    Состояние FSM пользователя (для SQLAlchemyStorage)
+    Таблица : fsm_states
+        key         ключ хранилища aiogram (бот, чат, пользователь)   [STR[255], PK]
+        state       текущее состояние                                [STR[255]]
+        data        данные состояния в JSON                          [TEXT]
+        updated_at  время последнего изменения                       [DATETIME]
+    """
+    __tablename__ = 'fsm_states'
+
+    key = Column(String(255), primary_key=True)
+    state = Column(String(255))
+    data = Column(Text, nullable=False, default='{}')
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class PortfolioMonthly(Base):
+    """
+    Помесячная сводка портфеля по типам кредитов (ведется services.portfolio_rollup)
+    Таблица : portfolio_monthly
+        month               первое число месяца                               [DATE, PK]
+        loan_type_id        тип кредита                                       [INT, PK]
+        loans_issued        выдано кредитов в месяце                          [INT]
+        issued_amount       сумма выданных кредитов                           [DECIMAL(15,2)]
+        loans_closed        из выданных в месяце - погашены                   [INT]
+        loans_active        из выданных в месяце - активны                    [INT]
+        payments_count      платежей, внесенных в месяце                      [INT]
+        payments_amount     сумма внесенных платежей                          [DECIMAL(15,2)]
+        overdue_count       неоплаченных платежей месяца с начисленной пеней  [INT]
+        overdue_amount      сумма просроченных платежей                       [DECIMAL(15,2)]
+        refreshed_at        время пересчета строки                            [DATETIME]
+    """
+    __tablename__ = 'portfolio_monthly'
+
+    month = Column(Date, primary_key=True)
+    loan_type_id = Column(Integer, primary_key=True)
+    loans_issued = Column(Integer, nullable=False, default=0)
+    issued_amount = Column(Numeric(15, 2), nullable=False, default=0)
+    loans_closed = Column(Integer, nullable=False, default=0)
+    loans_active = Column(Integer, nullable=False, default=0)
+    payments_count = Column(Integer, nullable=False, default=0)
+    payments_amount = Column(Numeric(15, 2), nullable=False, default=0)
+    overdue_count = Column(Integer, nullable=False, default=0)
+    overdue_amount = Column(Numeric(15, 2), nullable=False, default=0)
+    refreshed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class SchemaVersion(Base):
+    """
+    Примененные миграции схемы (utils.migrations)
+    Таблица : schema_version
+        version         номер миграции                  [INT, PK]
+        description     описание                        [STR[255]]
+        applied_at      время применения                [DATETIME]
+    """
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class AcceptedPayment(Base):
+    """
+    Принятые платежи по ключу идемпотентности (services.payment_acceptance)
+    Таблица : accepted_payments
+        idempotency_key     ключ обновления Telegram (чат и сообщение)     [STR[64], PK]
+        loan_id             кредит                                         [INT]
+        amount              зачисленная сумма                              [DECIMAL(15,2)]
+        remaining_amount    остаток долга после зачисления                 [DECIMAL(15,2)]
+        next_payment_date   дата следующего платежа                        [DATE]
+        closed              кредит закрыт этим платежом                    [BOOL]
+        accepted_at         время приема                                   [DATETIME]
+    """
+    __tablename__ = 'accepted_payments'
+
+    idempotency_key = Column(String(64), primary_key=True)
+    loan_id = Column(Integer, nullable=False)
+    amount = Column(Numeric(15, 2), nullable=False)
+    remaining_amount = Column(Numeric(15, 2), nullable=False)
+    next_payment_date = Column(Date)
+    closed = Column(Boolean, nullable=False, default=False)
+    accepted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class CourtNotice(Base):
+    """
+    Сформированные повестки в суд (пакетная генерация пропускает уже уведомленные кредиты)
+    Таблица : court_notices
+        loan_id             кредит                                         [INT, PK]
+        overdue_count       просроченных платежей на дату повестки         [INT]
+        overdue_amount      сумма просроченных платежей                    [DECIMAL(15,2)]
+        notice_date         дата повестки                                  [DATE]
+        created_at          время формирования                             [DATETIME]
+    """
+    __tablename__ = 'court_notices'
+
+    loan_id = Column(Integer, primary_key=True, autoincrement=False)
+    overdue_count = Column(Integer, nullable=False)
+    overdue_amount = Column(Numeric(15, 2), nullable=False)
+    notice_date = Column(Date, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class LoanCertificate(Base):
+    """
+    Справки об отсутствии обязательств по закрытым кредитам (services.certificates)
+    Таблица : loan_certificates
+        loan_id             кредит                                         [INT, PK]
+        client_id           клиент                                         [INT]
+        closed_on           дата закрытия кредита (дата справки)           [DATE]
+        document            текст справки (HTML Telegram; NULL - еще не сформирован)  [TEXT]
+        created_at          время формирования                             [DATETIME]
+        delivered_at        время отправки клиенту (NULL - не отправлена)  [DATETIME]
+        claimed_at          начало последней попытки отправки              [DATETIME]
+    """
+    __tablename__ = 'loan_certificates'
+
+    loan_id = Column(Integer, primary_key=True, autoincrement=False)
+    client_id = Column(Integer, nullable=False)
+    closed_on = Column(Date, nullable=False)
+    document = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    delivered_at = Column(DateTime)
+    claimed_at = Column(DateTime)
+
+
+class PaymentReminder(Base):
+    """
+    Напоминания клиентам о платежах (services.reminders)
+    Таблица : payment_reminders
+        payment_id          платеж                                         [INT, PK]
+        kind                due - скоро срок, overdue - просрочен          [STR[16], PK]
+        client_id           клиент                                         [INT]
+        loan_id             кредит                                         [INT]
+        due_date            плановая дата платежа                          [DATE]
+        amount              плановая сумма                                 [DECIMAL(15,2)]
+        remind_date         дата постановки в очередь                      [DATE]
+        attempts            попыток отправки                               [INT]
+        sent_at             время отправки (NULL - ждет отправки)          [DATETIME]
+        claimed_at          начало текущей попытки отправки                [DATETIME]
+        last_error          последняя ошибка Telegram                      [STR[255]]
+        created_at          время постановки в очередь                     [DATETIME]
+    """
+    __tablename__ = 'payment_reminders'
+    __table_args__ = (
+        # Клиенты с неотправленными напоминаниями (частичный индекс)
+        Index('ix_payment_reminders_pending', 'client_id',
+              postgresql_where=text('sent_at IS NULL'),
+              sqlite_where=text('sent_at IS NULL')),
+    )
+
+    payment_id = Column(Integer, primary_key=True, autoincrement=False)
+    kind = Column(String(16), primary_key=True)
+    client_id = Column(Integer, nullable=False)
+    loan_id = Column(Integer, nullable=False)
+    due_date = Column(Date, nullable=False)
+    amount = Column(Numeric(15, 2), nullable=False)
+    remind_date = Column(Date, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    sent_at = Column(DateTime)
+    claimed_at = Column(DateTime)
+    last_error = Column(String(255))
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -4,7 +4,7 @@ from sqlalchemy.orm import Mapped, mapped_column
 from .base import Base, LoanStatus
 import phonenumbers  # pip install phonenumbers
 from pydantic import EmailStr, BaseModel  # pip install pydantic[email]
-from sqlalchemy import Column, ForeignKey, Numeric, Enum, String
+from sqlalchemy import Column, ForeignKey, Numeric, Enum, String, Index, text
 from sqlalchemy.orm import relationship
 
 
@@ -136,6 +136,11 @@ class Loan(Base):
     ------------------------------------------------------------------------------
     remaining_amount    Оставшаяся сумма к выплате          NUM(15,2)
     ------------------------------------------------------------------------------
+    next_payment_date   Дата ближайшего неоплаченного платежа   DATE
+    ------------------------------------------------------------------------------
+
+    total_paid, remaining_amount и next_payment_date ведет services.loan_ledger
+    в той же транзакции, что и платеж, - пересчитывать их по payments не нужно.
 
     ОТНОШЕНИЯ
     clients     1 ---- inf    loans
@@ -143,12 +148,16 @@ class Loan(Base):
     loan_type   1   ---- inf    loans
     """
     __tablename__ = 'loans'
+    __table_args__ = (
+        # Кредиты клиента по статусу (список активных кредитов, выбор кредита для оплаты)
+        Index('ix_loans_client_status', 'client_id', 'status'),
+    )
 
     loan_id = Column(Integer, primary_key=True, autoincrement=True,
                    comment='Уникальный идентификатор кредита')
     client_id = Column(Integer, ForeignKey('clients.clientID', ondelete='CASCADE'),
-                     nullable=False, index=True,
-                     comment='Ссылка на клиента')
+                     nullable=False,
+                     comment='Ссылка на клиента')  # Индекс - ix_loans_client_status
     loan_type_id = Column(Integer, ForeignKey('loan_types.type_id'),
                        nullable=False, index=True,
                        comment='Ссылка на тип кредита')
@@ -164,6 +173,8 @@ class Loan(Base):
                       comment='Общая сумма выплаченных средств')
     remaining_amount = Column(Numeric(15, 2), nullable=False,
                        comment='Оставшаяся сумма к выплате')
+    next_payment_date = Column(Date, nullable=True,
+                       comment='Дата ближайшего неоплаченного платежа (NULL если нет)')
     # Связи
     client = relationship("Client", back_populates="loans")
     loan_type = relationship("LoanType")
@@ -207,6 +218,18 @@ class Payment(Base):
     loans   1----inf    payments
     """
     __tablename__ = 'payments'
+    __table_args__ = (
+        # Ближайший неоплаченный платеж по кредиту и неоплаченный график (частичный индекс)
+        Index('ix_payments_unpaid_by_loan', 'loan_id', 'payment_date_plan',
+              postgresql_where=text('payment_date_fact IS NULL'),
+              sqlite_where=text('payment_date_fact IS NULL')),
+        # Платежи за период (годовой отчет, сводка портфеля)
+        Index('ix_payments_date_fact', 'payment_date_fact'),
+        # Неоплаченные платежи по плановой дате (напоминания о платежах)
+        Index('ix_payments_unpaid_by_date', 'payment_date_plan',
+              postgresql_where=text('payment_date_fact IS NULL'),
+              sqlite_where=text('payment_date_fact IS NULL')),
+    )
 
     payment_id = Column(Integer, primary_key=True, autoincrement=True,
                       comment='Уникальный идентификатор платежа (PK)')
@@ -244,6 +267,49 @@ class Payment(Base):
         return 0.00
 
 
+class LoanLedgerEntry(Base):
+    """Журнал движения долга по кредиту (только добавление записей)
+    Основные поля:
+    ------------------------------------------------------------------------------
+    entry_id            Уникальный идентификатор записи     INT, PK, AInc
+    ------------------------------------------------------------------------------
+    loan_id             Ссылка на кредит                    INT, FK
+    ------------------------------------------------------------------------------
+    payment_id          Платеж, породивший запись           INT, FK, NULL
+    ------------------------------------------------------------------------------
+    entry_type          ISSUE / PAYMENT / EARLY_PAYMENT     STR(20)
+    ------------------------------------------------------------------------------
+    amount              Сумма операции                      NUM(15,2)
+    ------------------------------------------------------------------------------
+    balance_after       Остаток долга после операции        NUM(15,2)
+    ------------------------------------------------------------------------------
+    created_at          Время операции                      DATETIME
+    ------------------------------------------------------------------------------
+
+    ОТНОШЕНИЯ
+    loans   1----inf    loan_ledger
+    """
+    __tablename__ = 'loan_ledger'
+
+    entry_id = Column(Integer, primary_key=True, autoincrement=True,
+                    comment='Уникальный идентификатор записи')
+    loan_id = Column(Integer, ForeignKey('loans.loan_id', ondelete='CASCADE'), nullable=False, index=True,
+                   comment='Ссылка на кредит')
+    payment_id = Column(Integer, ForeignKey('payments.payment_id', ondelete='SET NULL'), nullable=True,
+                      comment='Платеж, породивший запись (NULL для выдачи)')
+    entry_type = Column(String(20), nullable=False,
+                      comment='Тип операции: ISSUE, PAYMENT, EARLY_PAYMENT')
+    amount = Column(Numeric(15, 2), nullable=False,
+                  comment='Сумма операции')
+    balance_after = Column(Numeric(15, 2), nullable=False,
+                         comment='Остаток долга после операции')
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False,
+                      comment='Время операции')
+
+    def __repr__(self):
+        return f"<LoanLedgerEntry {self.entry_id} (Loan: {self.loan_id}, {self.entry_type}: {self.amount})>"
+
+
 class CreditHistory(Base):
     """Модель кредитной истории
     Основные поля:
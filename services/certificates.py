@@ -0,0 +1,216 @@
+"""
+Справки об отсутствии обязательств по закрытым кредитам.
+
+Когда loan_ledger.apply_payment закрывает кредит, в той же транзакции в
+loan_certificates записывается только сам факт: кредит, клиент и дата
+закрытия. Текст справки формируется после коммита, вне блокировки кредита, -
+при первой отправке клиенту (deliver_certificate) или по запросу администратора.
+
+Отправка сначала захватывает справку (claimed_at), затем отправляет ее и
+только после успешной отправки ставит delivered_at. Если отправка не удалась
+или процесс упал посреди нее, захват истекает через CERTIFICATE_CLAIM_TIMEOUT,
+и справку повторно отправляет фоновый прогон (deliver_pending_certificates).
+Кредиты, закрытые до появления таблицы, дозаполняются пачками - один запрос
+с JOIN на пачку:
+
+    python -m services.certificates
+"""
+import argparse
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramAPIError
+from sqlalchemy import select, update, func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.base import LoanStatus
+from models.service import LoanCertificate
+from models.user import Client, Loan, Payment
+from utils.bulk import bulk_insert
+from utils.generate_reports import render_no_obligations_doc
+
+CERTIFICATE_BATCH_SIZE = 1000
+# Через сколько незавершенная отправка считается брошенной и справку можно отправить снова
+CERTIFICATE_CLAIM_TIMEOUT = timedelta(minutes=5)
+# Сколько после закрытия кредита фоновый прогон пытается доставить справку
+CERTIFICATE_RETRY_WINDOW = timedelta(days=1)
+
+
+async def issue_certificate(session: AsyncSession, loan: Loan, closed_on: date = None) -> LoanCertificate:
+    """
+    Справка по только что закрытому кредиту (коммит за вызывающим кодом).
+    Выполняется под блокировкой кредита, поэтому не читает клиента и не рендерит
+    текст - его формирует deliver_certificate после коммита.
+    """
+    certificate = await session.get(LoanCertificate, loan.loan_id)
+    if certificate:
+        return certificate
+
+    certificate = LoanCertificate(
+        loan_id=loan.loan_id,
+        client_id=loan.client_id,
+        closed_on=closed_on or date.today(),
+        document=None
+    )
+    session.add(certificate)
+    return certificate
+
+
+async def deliver_certificate(bot: Bot, session: AsyncSession, loan_id: int) -> bool:
+    """
+    Отправляет клиенту еще не отправленную справку по кредиту.
+    Справка захватывается (параллельный вызов ее не получит, пока не истечет
+    CERTIFICATE_CLAIM_TIMEOUT), формируется и отправляется вне транзакции и
+    помечается отправленной только после успешной отправки.
+
+    :return: True, если справка отправлена
+    """
+    claimed_at = datetime.utcnow()
+    claimed = (await session.execute(
+        update(LoanCertificate)
+        .where(LoanCertificate.loan_id == loan_id)
+        .where(LoanCertificate.delivered_at.is_(None))
+        .where(or_(
+            LoanCertificate.claimed_at.is_(None),
+            LoanCertificate.claimed_at < claimed_at - CERTIFICATE_CLAIM_TIMEOUT
+        ))
+        .values(claimed_at=claimed_at)
+        .returning(LoanCertificate.closed_on, LoanCertificate.document)
+        .execution_options(synchronize_session=False)
+    )).first()
+    if not claimed:
+        await session.rollback()
+        return False
+
+    row = (await session.execute(
+        select(Loan, Client).join(Client, Client.clientID == Loan.client_id).where(Loan.loan_id == loan_id)
+    )).first()
+    if not row:
+        await session.rollback()
+        return False
+    await session.commit()
+
+    loan, client = row
+
+    document = claimed.document or render_no_obligations_doc(loan, client, claimed.closed_on)
+    delivered_at = None
+    if client.telegram_id:
+        try:
+            await bot.send_message(client.telegram_id, document, parse_mode=ParseMode.HTML)
+            delivered_at = datetime.utcnow()
+        except TelegramAPIError as e:
+            logging.warning(f"Справка по кредиту {loan_id} не отправлена: {e}")
+
+    # Без отметки delivered_at захват истечет, и справку отправит deliver_pending_certificates
+    await session.execute(
+        update(LoanCertificate)
+        .where(LoanCertificate.loan_id == loan_id)
+        .where(LoanCertificate.claimed_at == claimed_at)
+        .values(document=document, delivered_at=delivered_at)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    return delivered_at is not None
+
+
+async def deliver_pending_certificates(bot: Bot, session: AsyncSession) -> int:
+    """
+    Повторно отправляет справки, отправка которых не завершилась: ошибка Telegram,
+    падение процесса после захвата или до него (справка еще не сформирована).
+    Справки, дозаполненные backfill_certificates, уже сформированы и не захватывались,
+    поэтому клиентам не отправляются.
+
+    :return: количество отправленных справок
+    """
+    now = datetime.utcnow()
+    loan_ids = (await session.scalars(
+        select(LoanCertificate.loan_id)
+        .join(Client, Client.clientID == LoanCertificate.client_id)
+        .where(LoanCertificate.delivered_at.is_(None))
+        .where(LoanCertificate.created_at >= now - CERTIFICATE_RETRY_WINDOW)
+        .where(or_(
+            LoanCertificate.claimed_at < now - CERTIFICATE_CLAIM_TIMEOUT,
+            and_(LoanCertificate.claimed_at.is_(None), LoanCertificate.document.is_(None),
+                 LoanCertificate.created_at < now - CERTIFICATE_CLAIM_TIMEOUT)
+        ))
+        .where(Client.telegram_id.is_not(None))
+        .order_by(LoanCertificate.loan_id)
+    )).all()
+    await session.rollback()
+
+    sent = 0
+    for loan_id in loan_ids:
+        sent += await deliver_certificate(bot, session, loan_id)
+    if loan_ids:
+        logging.info(f"Повторная отправка справок: {sent} из {len(loan_ids)}")
+    return sent
+
+
+async def backfill_certificates(session: AsyncSession, batch_size: int = CERTIFICATE_BATCH_SIZE) -> int:
+    """
+    Справки по всем закрытым кредитам без справки. Дата справки - последняя
+    оплата по кредиту. Исторические справки клиентам не отправляются.
+
+    :return: количество сформированных справок
+    """
+    last_payment = (
+        select(func.max(Payment.payment_date_fact))
+        .where(Payment.loan_id == Loan.loan_id)
+        .scalar_subquery()
+    )
+    created_at = datetime.utcnow()
+    last_loan_id = 0
+    written = 0
+    while True:
+        rows = (await session.execute(
+            select(Loan, Client, last_payment)
+            .join(Client, Client.clientID == Loan.client_id)
+            .outerjoin(LoanCertificate, LoanCertificate.loan_id == Loan.loan_id)
+            .where(Loan.status == LoanStatus.CLOSED)
+            .where(LoanCertificate.loan_id.is_(None))
+            .where(Loan.loan_id > last_loan_id)
+            .order_by(Loan.loan_id)
+            .limit(batch_size)
+        )).all()
+        if not rows:
+            return written
+
+        certificates = []
+        for loan, client, closed_on in rows:
+            closed_on = closed_on or loan.issue_date.date()
+            certificates.append({
+                'loan_id': loan.loan_id,
+                'client_id': client.clientID,
+                'closed_on': closed_on,
+                'document': render_no_obligations_doc(loan, client, closed_on),
+                'created_at': created_at,
+                'delivered_at': None,
+            })
+        written += await bulk_insert(session, LoanCertificate.__table__, certificates)
+        await session.commit()
+        session.expunge_all()
+        last_loan_id = rows[-1][0].loan_id
+        logging.info(f"Справок сформировано: {written}")
+
+
+async def _main():
+    from utils.database import async_session, engine, init_db
+
+    parser = argparse.ArgumentParser(description="Справки об отсутствии обязательств по закрытым кредитам")
+    parser.add_argument("--batch", type=int, default=CERTIFICATE_BATCH_SIZE, help="кредитов в одной пачке")
+    args = parser.parse_args()
+
+    try:
+        await init_db()
+        async with async_session() as session:
+            written = await backfill_certificates(session, args.batch)
+        print(f"Сформировано справок: {written}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
@@ -0,0 +1,165 @@
+"""
+Пакетная генерация повесток в суд по всему портфелю.
+
+Кредиты с COURT_NOTICE_MIN_OVERDUE и более просроченными платежами находятся
+одним сгруппированным запросом по ix_payments_unpaid_by_loan (HAVING count),
+кредиты из court_notices в него не попадают - повторный запуск формирует
+повестки только по новым должникам. Данные для повесток читаются пачками
+параллельно (своя сессия на пачку), повестки (PDF, если установлен
+reportlab, иначе текст) рендерятся и пишутся в zip-архив в потоках; после
+отправки архива кредиты отмечаются в court_notices.
+"""
+import asyncio
+import os
+import tempfile
+import zipfile
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import AsyncIterator, Optional
+from aiogram import types
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.base import LoanStatus
+from models.service import CourtNotice
+from models.user import Client, Loan, Payment
+from utils.bulk import bulk_insert
+from utils.database import async_session
+from utils.documents import pdf_supported
+from utils.generate_reports import render_court_notice, COURT_NOTICE_MIN_OVERDUE
+
+# Кредитов в одной пачке чтения и пачек одновременно (не больше размера пула соединений)
+NOTICE_CHUNK_SIZE = 500
+NOTICE_CONCURRENCY = 4
+
+# Повторный запуск в том же процессе ждет завершения предыдущего
+_batch_lock = asyncio.Lock()
+
+
+@dataclass(frozen=True, slots=True)
+class OverdueLoan:
+    """Кредит, подлежащий повестке: строка сгруппированного запроса"""
+    loan_id: int
+    overdue_count: int
+    overdue_amount: Decimal
+
+
+@dataclass(frozen=True, slots=True)
+class CourtNoticeBatch:
+    """Итог пакетной генерации"""
+    notices: int
+    overdue_amount: Decimal
+    document: Optional[types.FSInputFile]
+
+
+async def find_overdue_loans(session: AsyncSession, today: date, min_overdue: int = COURT_NOTICE_MIN_OVERDUE) -> list[OverdueLoan]:
+    """Незакрытые кредиты без повестки с min_overdue и более просроченными платежами"""
+    rows = await session.execute(
+        select(Payment.loan_id, func.count(), func.sum(Payment.planned_amount))
+        .join(Loan, Loan.loan_id == Payment.loan_id)
+        .outerjoin(CourtNotice, CourtNotice.loan_id == Payment.loan_id)
+        .where(Payment.payment_date_fact.is_(None))
+        .where(Payment.payment_date_plan < today)
+        .where(Loan.status != LoanStatus.CLOSED)
+        .where(CourtNotice.loan_id.is_(None))
+        .group_by(Payment.loan_id)
+        .having(func.count() >= min_overdue)
+        .order_by(Payment.loan_id)
+    )
+    return [OverdueLoan(loan_id, count, Decimal(str(amount))) for loan_id, count, amount in rows]
+
+
+async def _render_chunk(loan_ids: list[int], today: date, fmt: str,
+                        semaphore: asyncio.Semaphore) -> list[tuple[int, str | bytes]]:
+    """Повестки пачки кредитов: два запроса на пачку вместо трех на кредит"""
+    async with semaphore, async_session() as session:
+        loans = (await session.execute(
+            select(Loan, Client)
+            .join(Client, Client.clientID == Loan.client_id)
+            .where(Loan.loan_id.in_(loan_ids))
+        )).all()
+        payments = await session.scalars(
+            select(Payment)
+            .where(Payment.loan_id.in_(loan_ids))
+            .where(Payment.payment_date_fact.is_(None))
+            .where(Payment.payment_date_plan < today)
+            .order_by(Payment.loan_id, Payment.payment_date_plan)
+        )
+        overdue = defaultdict(list)
+        for payment in payments:
+            overdue[payment.loan_id].append(payment)
+
+    # PDF - заметная работа CPU, поэтому рендер пачки идет в отдельном потоке
+    return await asyncio.to_thread(lambda: [
+        (loan.loan_id, render_court_notice(loan, client, overdue[loan.loan_id], today, fmt, cache=False))
+        for loan, client in loans
+    ])
+
+
+def _write_archive(path: str, notices: list[tuple[int, str | bytes]], today: date, extension: str):
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for loan_id, notice in notices:
+            archive.writestr(f"court_notice_{loan_id}_{today.isoformat()}.{extension}", notice)
+
+
+@asynccontextmanager
+async def court_notice_batch(today: date = None, mark: bool = True) -> AsyncIterator[CourtNoticeBatch]:
+    """
+    Формирует zip-архив повесток по всем еще не уведомленным должникам.
+
+    Кредиты отмечаются в court_notices, когда тело контекста завершилось без
+    ошибки (архив отправлен); файл удаляется при выходе из контекста.
+
+    :param today: дата повесток (просрочка считается на нее)
+    :param mark: отметить кредиты как уведомленные
+    :return: итог; document - None, если новых должников нет
+    """
+    today = today or date.today()
+    async with _batch_lock:
+        async with async_session() as session:
+            overdue_loans = await find_overdue_loans(session, today)
+        if not overdue_loans:
+            yield CourtNoticeBatch(notices=0, overdue_amount=Decimal('0.00'), document=None)
+            return
+
+        fmt = "pdf" if pdf_supported() else "text"
+        semaphore = asyncio.Semaphore(NOTICE_CONCURRENCY)
+        loan_ids = [item.loan_id for item in overdue_loans]
+        chunks = await asyncio.gather(*(
+            _render_chunk(loan_ids[offset:offset + NOTICE_CHUNK_SIZE], today, fmt, semaphore)
+            for offset in range(0, len(loan_ids), NOTICE_CHUNK_SIZE)
+        ))
+        notices = [notice for chunk in chunks for notice in chunk]
+
+        filename = f"court_notices_{today.isoformat()}.zip"
+        fd, path = tempfile.mkstemp(suffix="_" + filename)
+        os.close(fd)
+        try:
+            await asyncio.to_thread(_write_archive, path, notices, today, "pdf" if fmt == "pdf" else "txt")
+            yield CourtNoticeBatch(
+                notices=len(notices),
+                overdue_amount=sum((item.overdue_amount for item in overdue_loans), Decimal('0.00')),
+                document=types.FSInputFile(path, filename=filename)
+            )
+
+            # Отмечаем только после успешной отправки архива вызывающим кодом
+            if mark:
+                rendered = {loan_id for loan_id, _ in notices}
+                created_at = datetime.utcnow()
+                async with async_session() as session:
+                    await bulk_insert(session, CourtNotice.__table__, [
+                        {
+                            'loan_id': item.loan_id,
+                            'overdue_count': item.overdue_count,
+                            'overdue_amount': item.overdue_amount,
+                            'notice_date': today,
+                            'created_at': created_at,
+                        }
+                        for item in overdue_loans if item.loan_id in rendered
+                    ])
+                    await session.commit()
+        finally:
+            os.remove(path)
@@ -0,0 +1,127 @@
+"""
+Журнал долга по кредиту (таблица loan_ledger) и сводные поля кредита.
+
+Каждая выдача и каждый платеж добавляют запись в loan_ledger с остатком
+после операции и в той же транзакции обновляют loans.total_paid,
+remaining_amount и next_payment_date. Поэтому положение по кредиту читается
+из самой строки loans (LoanPosition.of) - без суммирования payments.
+Коммит везде остается за вызывающим кодом.
+"""
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Optional
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.user import Loan, Payment, LoanLedgerEntry
+from models.base import LoanStatus
+from services.certificates import issue_certificate
+from services.portfolio_rollup import record_payment, record_loan_status
+
+ENTRY_ISSUE = 'ISSUE'
+ENTRY_PAYMENT = 'PAYMENT'
+ENTRY_EARLY_PAYMENT = 'EARLY_PAYMENT'
+
+
+@dataclass(frozen=True, slots=True)
+class LoanPosition:
+    """Положение по кредиту на момент чтения строки loans"""
+    loan_id: int
+    amount: Decimal
+    total_paid: Decimal
+    remaining_amount: Decimal
+    next_payment_date: Optional[date]
+    status: LoanStatus
+
+    @classmethod
+    def of(cls, loan: Loan) -> "LoanPosition":
+        return cls(
+            loan_id=loan.loan_id,
+            amount=Decimal(str(loan.amount)),
+            total_paid=Decimal(str(loan.total_paid or 0)),
+            remaining_amount=Decimal(str(loan.remaining_amount)),
+            next_payment_date=loan.next_payment_date,
+            status=loan.status
+        )
+
+
+async def next_unpaid_date(session: AsyncSession, loan_id: int) -> Optional[date]:
+    """Плановая дата ближайшего неоплаченного платежа (по ix_payments_unpaid_by_loan)"""
+    return await session.scalar(
+        select(func.min(Payment.payment_date_plan))
+        .where(Payment.loan_id == loan_id)
+        .where(Payment.payment_date_fact.is_(None))
+    )
+
+
+def record_issue(session: AsyncSession, loan: Loan, next_payment_date: Optional[date]) -> LoanLedgerEntry:
+    """Первая запись журнала по только что созданному (и сброшенному в БД) кредиту"""
+    amount = Decimal(str(loan.amount))
+    loan.total_paid = Decimal('0.00')
+    loan.remaining_amount = amount
+    loan.next_payment_date = next_payment_date
+
+    entry = LoanLedgerEntry(
+        loan_id=loan.loan_id,
+        entry_type=ENTRY_ISSUE,
+        amount=amount,
+        balance_after=amount,
+        created_at=loan.issue_date
+    )
+    session.add(entry)
+    return entry
+
+
+async def apply_payment(session: AsyncSession, loan: Loan, amount: Decimal, payment: Payment = None,
+                        entry_type: str = ENTRY_PAYMENT) -> LoanLedgerEntry:
+    """
+    Зачисляет платеж: обновляет сводные поля кредита, добавляет запись в журнал
+    и изменения сводки портфеля.
+    При нулевом остатке кредит закрывается и записывается справка об отсутствии
+    обязательств (services.certificates; текст формируется после коммита). Дату следующего платежа вызывающий
+    код выставляет сам (новый график или refresh_next_payment_date).
+
+    :param session: сессия БД
+    :param loan: кредит
+    :param amount: зачисленная сумма
+    :param payment: платеж, которым внесена сумма
+    :param entry_type: ENTRY_PAYMENT или ENTRY_EARLY_PAYMENT
+    """
+    amount = Decimal(str(amount))
+    if payment is not None and payment.payment_id is None:
+        await session.flush()  # Нужен payment_id нового платежа
+
+    if payment is not None:
+        record_payment(session, loan.loan_type_id, payment)
+
+    loan.total_paid = Decimal(str(loan.total_paid or 0)) + amount
+    remaining = Decimal(str(loan.remaining_amount)) - amount
+    closed = remaining <= 0
+    if closed:
+        remaining = Decimal('0.00')
+        record_loan_status(session, loan.issue_date, loan.loan_type_id, loan.status, LoanStatus.CLOSED)
+        loan.status = LoanStatus.CLOSED
+        loan.next_payment_date = None
+    loan.remaining_amount = remaining
+    if closed:
+        await issue_certificate(session, loan)
+
+    entry = LoanLedgerEntry(
+        loan_id=loan.loan_id,
+        payment_id=payment.payment_id if payment is not None else None,
+        entry_type=entry_type,
+        amount=amount,
+        balance_after=remaining
+    )
+    session.add(entry)
+    return entry
+
+
+async def refresh_next_payment_date(session: AsyncSession, loan: Loan) -> Optional[date]:
+    """Выставляет next_payment_date по графику (для закрытого кредита - None)"""
+    if loan.status == LoanStatus.CLOSED:
+        loan.next_payment_date = None
+    else:
+        loan.next_payment_date = await next_unpaid_date(session, loan.loan_id)
+    return loan.next_payment_date
@@ -0,0 +1,347 @@
+"""
+Прием платежей по кредиту: блокировка строки кредита и идемпотентность.
+
+Платеж зачисляется одной короткой транзакцией: SELECT ... FOR UPDATE по
+кредиту, проверка ключа идемпотентности, отметка платежа, журнал долга,
+пересчет графика (если нужно), изменения сводки портфеля и запись в accepted_payments.
+Параллельные платежи по одному кредиту выполняются по очереди, а повтор того
+же обновления Telegram (двойное нажатие кнопки, повторная доставка webhook)
+возвращает результат первого приема, ничего не меняя. Так же принимается
+досрочное погашение (accept_early_repayment).
+
+SQLite не поддерживает FOR UPDATE, поэтому там транзакция приема начинается
+с BEGIN IMMEDIATE - блокировки записи всей БД.
+
+Ключ - чат и сообщение: у двойного нажатия инлайн-кнопки id колбэков
+разные, а сообщение с кнопкой одно.
+"""
+import time
+from dataclasses import dataclass, replace
+from datetime import date
+from decimal import Decimal
+from typing import Awaitable, Callable, Optional
+from aiogram import types
+from sqlalchemy import select, delete, func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.user import Loan, Payment
+from models.base import LoanStatus
+from models.service import AcceptedPayment
+from services.loan_ledger import apply_payment, refresh_next_payment_date, ENTRY_EARLY_PAYMENT
+from services.portfolio_rollup import record_removed_payments
+from utils.calculations import save_schedule, amount_due
+from utils.database import async_session
+from utils.loan_type_catalog import loan_type_catalog
+from utils.schedule_engine import build_schedule, build_shortened_schedule, PaymentSchedule
+
+
+class PaymentRejected(Exception):
+    """Платеж не может быть принят; текст исключения - ответ пользователю"""
+
+
+@dataclass(frozen=True, slots=True)
+class PaymentOutcome:
+    """
+    Результат приема платежа (duplicate - повтор уже принятого).
+    schedule - новый график после досрочного погашения (у повтора не восстанавливается).
+    """
+    loan_id: int
+    amount: Decimal
+    remaining_amount: Decimal
+    next_payment_date: Optional[date]
+    closed: bool
+    duplicate: bool = False
+    schedule: Optional[PaymentSchedule] = None
+
+    @classmethod
+    def from_record(cls, record: AcceptedPayment, duplicate: bool) -> "PaymentOutcome":
+        return cls(
+            loan_id=record.loan_id,
+            amount=Decimal(str(record.amount)),
+            remaining_amount=Decimal(str(record.remaining_amount)),
+            next_payment_date=record.next_payment_date,
+            closed=record.closed,
+            duplicate=duplicate
+        )
+
+
+class LockMetrics:
+    """Ожидание и удержание блокировки кредита при приеме платежей"""
+    def __init__(self):
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+
+    def record(self, wait: float, hold: float):
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.hold_total += hold
+        self.hold_max = max(self.hold_max, hold)
+
+    def stats(self) -> dict:
+        locks = self.accepted + self.duplicates + self.rejected
+        return {
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "wait_avg_ms": self.wait_total / locks * 1000 if locks else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+            "hold_avg_ms": self.hold_total / locks * 1000 if locks else 0.0,
+            "hold_max_ms": self.hold_max * 1000,
+        }
+
+
+payment_lock_metrics = LockMetrics()
+
+
+def message_key(message: types.Message) -> str:
+    """Ключ идемпотентности платежа, введенного сообщением"""
+    return f"msg:{message.chat.id}:{message.message_id}"
+
+
+def callback_key(callback: types.CallbackQuery) -> str:
+    """Ключ идемпотентности платежа, подтвержденного инлайн-кнопкой"""
+    return f"cb:{callback.message.chat.id}:{callback.message.message_id}"
+
+
+async def _recalculate_schedule(session: AsyncSession, loan: Loan, payment: Payment):
+    """Заменяет будущие неоплаченные платежи графиком на остаток долга"""
+    loan_type = loan_type_catalog.get(loan.loan_type_id)
+    if not loan_type:
+        raise PaymentRejected("❌ Не удалось определить процентную ставку по кредиту")
+
+    removed = await session.execute(
+        delete(Payment)
+        .where(Payment.loan_id == loan.loan_id)
+        .where(Payment.payment_date_plan > payment.payment_date_plan)
+        .where(Payment.payment_date_fact.is_(None))
+        .returning(Payment.payment_date_plan, Payment.planned_amount, Payment.penalty_date)
+    )
+    record_removed_payments(session, loan.loan_type_id, removed)
+
+    paid_count, last_plan_date = (await session.execute(
+        select(
+            func.count(Payment.payment_id).filter(Payment.payment_date_fact.is_not(None)),
+            func.max(Payment.payment_date_plan)
+        )
+        .where(Payment.loan_id == loan.loan_id)
+    )).one()
+
+    # Новые платежи - с месяца, следующего за последним плановым
+    schedule = build_schedule(
+        loan.remaining_amount,
+        loan.term - paid_count,
+        loan_type.interest_rate,
+        last_plan_date or date.today()
+    )
+    await save_schedule(session, loan.loan_id, schedule)
+    loan.next_payment_date = schedule.first_date
+
+
+async def _accept_locked(session: AsyncSession, key: str, loan: Optional[Loan], amount: Decimal,
+                         recalculate: bool, today: date) -> PaymentOutcome:
+    """Зачисление под блокировкой строки кредита"""
+    accepted = await session.get(AcceptedPayment, key)
+    if accepted:
+        return PaymentOutcome.from_record(accepted, duplicate=True)
+
+    if not loan:
+        raise PaymentRejected("❌ Кредит не найден")
+    if loan.status == LoanStatus.CLOSED:
+        raise PaymentRejected("ℹ Кредит уже погашен")
+
+    payment = await session.scalar(
+        select(Payment)
+        .where(Payment.loan_id == loan.loan_id)
+        .where(Payment.payment_date_fact.is_(None))
+        .order_by(Payment.payment_date_plan.asc())
+        .limit(1)
+    )
+    if not payment:
+        raise PaymentRejected("ℹ Нет платежей для погашения")
+
+    amount = min(amount, Decimal(str(loan.remaining_amount)))
+    min_payment = amount_due(payment)
+    if not recalculate and round(amount, 2) < round(min_payment, 2):
+        raise PaymentRejected(
+            f"❌ Сумма платежа ({amount:.2f} руб.) меньше минимального платежа ({min_payment:.2f} руб.)"
+        )
+
+    payment.payment_date_fact = today
+    payment.actual_amount = amount
+    await apply_payment(session, loan, amount, payment)
+
+    if loan.status == LoanStatus.CLOSED:
+        # Погашен полностью - оставшийся график больше не нужен
+        removed = await session.execute(
+            delete(Payment)
+            .where(Payment.loan_id == loan.loan_id)
+            .where(Payment.payment_date_fact.is_(None))
+            .returning(Payment.payment_date_plan, Payment.planned_amount, Payment.penalty_date)
+        )
+        record_removed_payments(session, loan.loan_type_id, removed)
+    elif recalculate:
+        await _recalculate_schedule(session, loan, payment)
+    else:
+        await refresh_next_payment_date(session, loan)
+
+    return _record_accepted(session, key, loan, amount)
+
+
+def _record_accepted(session: AsyncSession, key: str, loan: Loan, amount: Decimal) -> PaymentOutcome:
+    """Запоминает результат приема под ключом идемпотентности"""
+    record = AcceptedPayment(
+        idempotency_key=key,
+        loan_id=loan.loan_id,
+        amount=amount,
+        remaining_amount=loan.remaining_amount,
+        next_payment_date=loan.next_payment_date,
+        closed=loan.status == LoanStatus.CLOSED
+    )
+    session.add(record)
+    return PaymentOutcome.from_record(record, duplicate=False)
+
+
+async def _accept_early_locked(session: AsyncSession, key: str, loan: Optional[Loan], amount: Decimal,
+                               shorten_term: bool, today: date) -> PaymentOutcome:
+    """Досрочное погашение под блокировкой строки кредита"""
+    accepted = await session.get(AcceptedPayment, key)
+    if accepted:
+        return PaymentOutcome.from_record(accepted, duplicate=True)
+
+    if not loan:
+        raise PaymentRejected("❌ Кредит не найден")
+    if loan.status == LoanStatus.CLOSED:
+        raise PaymentRejected("ℹ Кредит уже погашен")
+    loan_type = loan_type_catalog.get(loan.loan_type_id)
+    if not loan_type:
+        raise PaymentRejected("❌ Не удалось определить процентную ставку по кредиту")
+
+    # График до погашения: сколько платежей внесено, дата последнего и текущий размер платежа
+    paid_count, last_paid_date = (await session.execute(
+        select(
+            func.count(Payment.payment_id),
+            func.max(Payment.payment_date_plan)
+        )
+        .where(Payment.loan_id == loan.loan_id)
+        .where(Payment.payment_date_fact.is_not(None))
+    )).one()
+    current_payment = await session.scalar(
+        select(Payment.planned_amount)
+        .where(Payment.loan_id == loan.loan_id)
+        .where(Payment.payment_date_fact.is_(None))
+        .order_by(Payment.payment_date_plan.asc())
+        .limit(1)
+    )
+
+    amount = min(amount, Decimal(str(loan.remaining_amount)))
+    early_payment = Payment(
+        loan_id=loan.loan_id,
+        payment_date_plan=today,
+        planned_amount=amount,
+        payment_date_fact=today,
+        actual_amount=amount,
+        is_early_payment=True
+    )
+    session.add(early_payment)
+    await apply_payment(session, loan, amount, early_payment, ENTRY_EARLY_PAYMENT)
+
+    # Прежний график больше не действует
+    removed = await session.execute(
+        delete(Payment)
+        .where(Payment.loan_id == loan.loan_id)
+        .where(Payment.payment_date_fact.is_(None))
+        .returning(Payment.payment_date_plan, Payment.planned_amount, Payment.penalty_date)
+    )
+    record_removed_payments(session, loan.loan_type_id, removed)
+
+    if loan.status == LoanStatus.CLOSED:
+        return _record_accepted(session, key, loan, amount)
+
+    start_date = last_paid_date or loan.issue_date.date()
+    if shorten_term and current_payment:
+        # Платеж сохраняется, срок сокращается: прежняя сумма, пока не закроем остаток
+        schedule = build_shortened_schedule(loan.remaining_amount, current_payment, loan_type.interest_rate, start_date)
+    else:
+        # Срок сохраняется, платеж уменьшается
+        schedule = build_schedule(loan.remaining_amount, max(loan.term - paid_count, 1),
+                                  loan_type.interest_rate, start_date)
+    await save_schedule(session, loan.loan_id, schedule)
+    loan.next_payment_date = schedule.first_date
+    return replace(_record_accepted(session, key, loan, amount), schedule=schedule)
+
+
+async def _accept(loan_id: int,
+                  accept: Callable[[AsyncSession, Optional[Loan]], Awaitable[PaymentOutcome]]) -> PaymentOutcome:
+    """Выполняет accept(session, loan) в транзакции под блокировкой строки кредита (с учетом в метриках)"""
+    async with async_session() as session:
+        started = time.perf_counter()
+        locked = None
+        outcome = None
+        try:
+            async with session.begin():
+                if session.bind.dialect.name == "sqlite":
+                    # FOR UPDATE в SQLite игнорируется - блокировка записи берется сразу, а не при первом UPDATE
+                    await session.execute(text("BEGIN IMMEDIATE"))
+                loan = await session.scalar(select(Loan).where(Loan.loan_id == loan_id).with_for_update())
+                locked = time.perf_counter()
+                outcome = await accept(session, loan)
+        finally:
+            if locked is not None:
+                payment_lock_metrics.record(locked - started, time.perf_counter() - locked)
+                if outcome is None:
+                    payment_lock_metrics.rejected += 1
+                elif outcome.duplicate:
+                    payment_lock_metrics.duplicates += 1
+                else:
+                    payment_lock_metrics.accepted += 1
+    return outcome
+
+
+async def accept_payment(key: str, loan_id: int, amount: Decimal, recalculate: bool = False,
+                         today: date = None) -> PaymentOutcome:
+    """
+    Принимает платеж по ближайшему неоплаченному платежу кредита.
+
+    :param key: ключ идемпотентности (message_key / callback_key)
+    :param loan_id: кредит
+    :param amount: внесенная сумма (больше остатка - зачисляется остаток)
+    :param recalculate: пересчитать график на остаток (сумма больше планового платежа)
+    :param today: дата платежа
+    :raises PaymentRejected: кредит не найден или закрыт, нечего погашать, сумма меньше платежа
+    """
+    today = today or date.today()
+    if recalculate:
+        # Справочник обновляется до транзакции, чтобы не держать блокировку на его чтении
+        await loan_type_catalog.ensure_fresh()
+
+    return await _accept(
+        loan_id,
+        lambda session, loan: _accept_locked(session, key, loan, Decimal(str(amount)), recalculate, today)
+    )
+
+
+async def accept_early_repayment(key: str, loan_id: int, amount: Decimal, shorten_term: bool = False,
+                                 today: date = None) -> PaymentOutcome:
+    """
+    Принимает досрочное погашение: сумма зачисляется отдельным платежом, неоплаченный
+    график заменяется новым на остаток долга.
+
+    :param key: ключ идемпотентности (message_key)
+    :param loan_id: кредит
+    :param amount: внесенная сумма (больше остатка - зачисляется остаток)
+    :param shorten_term: сохранить размер платежа и сократить срок (иначе - сохранить срок)
+    :param today: дата погашения
+    :raises PaymentRejected: кредит не найден или закрыт, нет процентной ставки
+    """
+    today = today or date.today()
+    await loan_type_catalog.ensure_fresh()
+
+    return await _accept(
+        loan_id,
+        lambda session, loan: _accept_early_locked(session, key, loan, Decimal(str(amount)), shorten_term, today)
+    )
@@ -0,0 +1,212 @@
+"""
+Начисление пени по всему портфелю несколькими SQL-запросами.
+
+Пеня - 1% в сутки от суммы просроченного платежа - пересчитывается как
+абсолютная величина (сумма * 1% * дни просрочки) и помечается датой
+начисления, поэтому повторный запуск в тот же день ничего не меняет.
+Прирост пени прибавляется к остатку долга по кредиту, а сама пеня вносится
+вместе с просроченным платежом (utils.calculations.amount_due). Плановые суммы
+графика не меняются: по ним считаются сводка портфеля и судебные уведомления.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Optional
+from sqlalchemy import update, select, exists, func, literal, literal_column, and_, or_, Date, Integer, cast
+from sqlalchemy.orm import aliased
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Config
+from models.user import Loan, Payment
+from models.base import LoanStatus
+from utils.database import async_session
+from services.portfolio_rollup import record_overdue, record_loan_status
+
+PENALTY_RATE = Decimal('0.01')  # 1% в сутки
+
+_accrual_task: Optional[asyncio.Task] = None
+
+
+@dataclass(frozen=True, slots=True)
+class AccrualResult:
+    """Итог прогона начисления пени"""
+    accrual_date: date
+    payments_updated: int
+    loans_marked_overdue: int
+
+
+def overdue_days(session: AsyncSession, today: date):
+    """SQL-выражение: количество дней просрочки планового платежа на дату today"""
+    if session.bind.dialect.name == "sqlite":
+        return cast(func.julianday(today) - func.julianday(Payment.payment_date_plan), Integer)
+    return literal(today, Date) - Payment.payment_date_plan
+
+
+async def accrue_penalties(
+    session: AsyncSession,
+    today: date = None,
+    client_id: int = None,
+    loan_id: int = None
+) -> AccrualResult:
+    """
+    Начисляет пени по просроченным платежам, прибавляет прирост пени к остатку долга
+    и переводит кредиты в OVERDUE, изменения сводки портфеля записываются при коммите.
+    Коммит остается за вызывающим кодом.
+
+    :param session: сессия БД
+    :param today: дата начисления (по умолчанию сегодня)
+    :param client_id: ограничить начисление кредитами одного клиента
+    :param loan_id: ограничить начисление одним кредитом
+    :return: количество обновленных платежей и кредитов
+    """
+    today = today or date.today()
+    open_statuses = [LoanStatus.ACTIVE, LoanStatus.OVERDUE]
+
+    def scoped(stmt):
+        if client_id is not None:
+            stmt = stmt.where(Loan.client_id == client_id)
+        if loan_id is not None:
+            stmt = stmt.where(Loan.loan_id == loan_id)
+        return stmt
+
+    # Неоплаченные просроченные платежи кредита, по которым пеня за today еще не начислена
+    def accruable(first_accrual: bool = None):
+        if first_accrual is None:
+            stamped = or_(Payment.penalty_date.is_(None), Payment.penalty_date < today)
+        elif first_accrual:
+            stamped = Payment.penalty_date.is_(None)
+        else:
+            stamped = Payment.penalty_date < today
+        return and_(
+            Payment.loan_id == Loan.loan_id,
+            Payment.payment_date_fact.is_(None),
+            Payment.payment_date_plan < today,
+            stamped
+        )
+
+    penalty = func.round(Payment.planned_amount * PENALTY_RATE * overdue_days(session, today), 2)
+
+    # Прирост пени - к остатку долга, до перезаписи пени на платежах (по ним считается прирост)
+    increment = (
+        select(func.coalesce(func.sum(penalty - func.coalesce(Payment.penalty_amount, 0)), 0))
+        .where(accruable())
+        .correlate(Loan)
+        .scalar_subquery()
+    )
+    await session.execute(scoped(
+        update(Loan)
+        .where(Loan.status.in_(open_statuses))
+        .where(exists().where(accruable()).correlate(Loan))
+        .values(remaining_amount=Loan.remaining_amount + increment)
+        .execution_options(synchronize_session=False)
+    ))
+
+    # UPDATE payments ... FROM loans: только неоплаченные, просроченные и еще не начисленные сегодня
+    def payments_stmt(first_accrual: bool):
+        stmt = (
+            update(Payment)
+            .where(Loan.status.in_(open_statuses))
+            .where(accruable(first_accrual))
+            .values(penalty_amount=penalty, penalty_date=today)
+            .execution_options(synchronize_session=False)
+        )
+        return scoped(stmt)
+
+    # Платежи, впервые попадающие в просрочку, возвращаются для сводки портфеля. Тип кредита -
+    # подзапросом: SQLite не дает ссылаться в RETURNING на таблицы из FROM, а SQLAlchemy
+    # убирает в RETURNING имена таблиц - поэтому ссылка на платеж записана явно
+    loan = aliased(Loan)
+    loan_type_id = (
+        select(loan.loan_type_id)
+        .where(loan.loan_id == literal_column(f"{Payment.__tablename__}.loan_id"))
+        .scalar_subquery()
+    )
+    first_accrued = (await session.execute(
+        payments_stmt(first_accrual=True)
+        .returning(loan_type_id, Payment.payment_date_plan, Payment.planned_amount)
+    )).all()
+    repeated = (await session.execute(payments_stmt(first_accrual=False))).rowcount
+    for type_id, plan_date, amount in first_accrued:
+        record_overdue(session, type_id, plan_date, amount)
+
+    has_overdue = (
+        exists()
+        .where(Payment.loan_id == Loan.loan_id)
+        .where(Payment.payment_date_fact.is_(None))
+        .where(Payment.payment_date_plan < today)
+    )
+    loans_stmt = (
+        update(Loan)
+        .where(Loan.status == LoanStatus.ACTIVE)
+        .where(has_overdue)
+        .values(status=LoanStatus.OVERDUE)
+        .returning(Loan.issue_date, Loan.loan_type_id)
+        .execution_options(synchronize_session=False)
+    )
+    marked = (await session.execute(scoped(loans_stmt))).all()
+    for issue_date, type_id in marked:
+        record_loan_status(session, issue_date, type_id, LoanStatus.ACTIVE, LoanStatus.OVERDUE)
+
+    return AccrualResult(today, len(first_accrued) + repeated, len(marked))
+
+
+async def overdue_summary(session: AsyncSession, client_id: int, today: date = None) -> tuple[int, Decimal]:
+    """Количество просроченных платежей клиента и сумма начисленной по ним пени"""
+    today = today or date.today()
+    count, total = (await session.execute(
+        select(func.count(Payment.payment_id), func.coalesce(func.sum(Payment.penalty_amount), 0))
+        .join(Loan, Payment.loan_id == Loan.loan_id)
+        .where(Loan.client_id == client_id)
+        .where(Payment.payment_date_fact.is_(None))
+        .where(Payment.payment_date_plan < today)
+    )).one()
+    return count, Decimal(str(total))
+
+
+async def run_penalty_accrual(today: date = None) -> AccrualResult:
+    """Один прогон начисления по всему портфелю в отдельной транзакции"""
+    async with async_session() as session:
+        result = await accrue_penalties(session, today)
+        await session.commit()
+
+    logging.info(
+        f"Начисление пени за {result.accrual_date}: платежей {result.payments_updated}, "
+        f"кредитов переведено в просрочку {result.loans_marked_overdue}"
+    )
+    return result
+
+
+async def _accrual_loop(interval: float):
+    while True:
+        try:
+            await run_penalty_accrual()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка фонового начисления пени: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+def start_penalty_accrual(interval: float = None) -> asyncio.Task:
+    """Запускает фоновое начисление пени (вызывается из on_startup)"""
+    global _accrual_task
+    if _accrual_task is None or _accrual_task.done():
+        _accrual_task = asyncio.create_task(
+            _accrual_loop(interval or Config.PENALTY_ACCRUAL_INTERVAL),
+            name="penalty_accrual"
+        )
+    return _accrual_task
+
+
+async def stop_penalty_accrual():
+    """Останавливает фоновое начисление пени"""
+    global _accrual_task
+    if _accrual_task is not None:
+        _accrual_task.cancel()
+        try:
+            await _accrual_task
+        except asyncio.CancelledError:
+            pass
+        _accrual_task = None
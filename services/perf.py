@@ -0,0 +1,224 @@
+"""
+Замеры обработчиков: время, время в БД, число SQL-запросов и строк.
+
+Внешний middleware на dp.update открывает замер обновления, внутренний
+middleware роутеров подписывает его именем сработавшего обработчика
+(confirm_loan, calculate_penny, ...), а хуки before/after_cursor_execute
+движка добавляют к текущему замеру каждый SQL-запрос. Замер передается через
+contextvar, поэтому параллельные обновления не смешиваются.
+
+Итоги доступны админской командой /perf и в формате Prometheus на
+METRICS_PATH (webhook-сервер или отдельный порт METRICS_PORT в режиме polling).
+Обработчики дольше SLOW_HANDLER_MS пишутся в лог.
+"""
+import contextvars
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+from aiogram import BaseMiddleware, Dispatcher, Router
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config import Config
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNHANDLED = "unhandled"
+
+
+@dataclass(slots=True)
+class HandlerCall:
+    """Замер одного обновления"""
+    name: str = UNHANDLED
+    started: float = field(default_factory=time.perf_counter)
+    db_time: float = 0.0
+    statements: int = 0
+    rows: int = 0
+
+
+current_call: contextvars.ContextVar[Optional[HandlerCall]] = contextvars.ContextVar("perf_call", default=None)
+
+
+class HandlerStats:
+    """Накопленные показатели одного обработчика"""
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.wall_total = 0.0
+        self.wall_max = 0.0
+        self.db_total = 0.0
+        self.statements = 0
+        self.rows = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def record(self, call: HandlerCall, wall: float, failed: bool, slow: bool):
+        self.calls += 1
+        self.errors += failed
+        self.slow += slow
+        self.wall_total += wall
+        self.wall_max = max(self.wall_max, wall)
+        self.db_total += call.db_time
+        self.statements += call.statements
+        self.rows += call.rows
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if wall <= bound:
+                self.buckets[index] += 1
+
+
+class PerfRegistry:
+    """Показатели по именам обработчиков"""
+    def __init__(self, slow_threshold_ms: float):
+        self.slow_threshold = slow_threshold_ms / 1000
+        self.handlers: dict[str, HandlerStats] = {}
+
+    def record(self, call: HandlerCall, failed: bool = False):
+        wall = time.perf_counter() - call.started
+        slow = wall >= self.slow_threshold
+        self.handlers.setdefault(call.name, HandlerStats()).record(call, wall, failed, slow)
+        if slow:
+            logging.warning(
+                f"Медленный обработчик {call.name}: {wall * 1000:.0f} мс, "
+                f"БД {call.db_time * 1000:.0f} мс, запросов {call.statements}, строк {call.rows}"
+            )
+
+    def reset(self):
+        self.handlers.clear()
+
+    def summary(self, limit: int = 15) -> list[dict]:
+        """Обработчики по убыванию суммарного времени (средние - на один вызов)"""
+        rows = []
+        for name, stats in sorted(self.handlers.items(), key=lambda item: item[1].wall_total, reverse=True)[:limit]:
+            rows.append({
+                "handler": name,
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "slow": stats.slow,
+                "avg_ms": stats.wall_total / stats.calls * 1000,
+                "max_ms": stats.wall_max * 1000,
+                "db_avg_ms": stats.db_total / stats.calls * 1000,
+                "statements_avg": stats.statements / stats.calls,
+                "rows_avg": stats.rows / stats.calls,
+            })
+        return rows
+
+    def prometheus(self) -> str:
+        """Показатели в текстовом формате Prometheus"""
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, values):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in values:
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+        handlers = sorted(self.handlers.items())
+        metric("bot_handler_calls_total", "counter", "Handled updates",
+               ((f'handler="{name}"', stats.calls) for name, stats in handlers))
+        metric("bot_handler_errors_total", "counter", "Updates that raised an exception",
+               ((f'handler="{name}"', stats.errors) for name, stats in handlers))
+        metric("bot_handler_slow_total", "counter", "Updates slower than SLOW_HANDLER_MS",
+               ((f'handler="{name}"', stats.slow) for name, stats in handlers))
+        metric("bot_handler_db_seconds_total", "counter", "Time spent in SQL statements",
+               ((f'handler="{name}"', f"{stats.db_total:.6f}") for name, stats in handlers))
+        metric("bot_handler_sql_statements_total", "counter", "Executed SQL statements",
+               ((f'handler="{name}"', stats.statements) for name, stats in handlers))
+        metric("bot_handler_sql_rows_total", "counter", "Rows returned or affected by SQL statements",
+               ((f'handler="{name}"', stats.rows) for name, stats in handlers))
+
+        lines.append("# HELP bot_handler_duration_seconds Update handling time")
+        lines.append("# TYPE bot_handler_duration_seconds histogram")
+        for name, stats in handlers:
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                lines.append(f'bot_handler_duration_seconds_bucket{{handler="{name}",le="{bound}"}} {count}')
+            lines.append(f'bot_handler_duration_seconds_bucket{{handler="{name}",le="+Inf"}} {stats.calls}')
+            lines.append(f'bot_handler_duration_seconds_sum{{handler="{name}"}} {stats.wall_total:.6f}')
+            lines.append(f'bot_handler_duration_seconds_count{{handler="{name}"}} {stats.calls}')
+        return "\n".join(lines) + "\n"
+
+
+perf_registry = PerfRegistry(Config.SLOW_HANDLER_MS)
+
+
+# ---- Middleware ----
+
+class UpdatePerfMiddleware(BaseMiddleware):
+    """Внешний middleware dp.update: замер всего обновления"""
+    async def __call__(self, handler: Callable[[Any, dict], Awaitable[Any]], event: Any, data: dict) -> Any:
+        call = HandlerCall()
+        token = current_call.set(call)
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            current_call.reset(token)
+            perf_registry.record(call, failed)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: подписывает замер именем сработавшего обработчика"""
+    async def __call__(self, handler: Callable[[Any, dict], Awaitable[Any]], event: Any, data: dict) -> Any:
+        call = current_call.get()
+        handler_object = data.get("handler")
+        if call is not None and handler_object is not None:
+            call.name = getattr(handler_object.callback, "__name__", call.name)
+        return await handler(event, data)
+
+
+def setup_perf(dispatcher: Dispatcher, *routers: Router):
+    """Подключает замеры к диспетчеру и к сообщениям и колбэкам роутеров"""
+    dispatcher.update.outer_middleware(UpdatePerfMiddleware())
+    naming = HandlerNameMiddleware()
+    for router in routers:
+        router.message.middleware(naming)
+        router.callback_query.middleware(naming)
+
+
+# ---- SQL ----
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_call.get() is not None:
+        context.perf_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    call = current_call.get()
+    started = getattr(context, "perf_started", None)
+    if call is None or started is None:
+        return
+    call.db_time += time.perf_counter() - started
+    call.statements += 1
+    # rowcount по DB-API: затронутые строки, для SELECT - если драйвер знает
+    # (asyncpg знает, SQLite - нет и отдает -1: такие запросы не считаются)
+    if cursor.rowcount > 0:
+        call.rows += cursor.rowcount
+
+
+def install_sql_hooks(engine: AsyncEngine):
+    """Хуки движка, добавляющие каждый SQL-запрос к замеру текущего обновления"""
+    if not event.contains(engine.sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ---- Prometheus ----
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=perf_registry.prometheus(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server() -> Optional[web.AppRunner]:
+    """Отдельный HTTP-сервер для METRICS_PATH (режим polling); None, если METRICS_PORT не задан"""
+    if not Config.METRICS_PORT:
+        return None
+    app = web.Application()
+    app.router.add_get(Config.METRICS_PATH, metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, Config.METRICS_HOST, Config.METRICS_PORT).start()
+    logging.info(f"Метрики: {Config.METRICS_HOST}:{Config.METRICS_PORT}{Config.METRICS_PATH}")
+    return runner
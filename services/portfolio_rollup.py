@@ -0,0 +1,327 @@
+"""
+Помесячная сводка портфеля (таблица portfolio_monthly).
+
+Отчеты читают готовые строки (за год - не больше 12 на тип кредита) вместо
+сканирования loans и payments. Выдача кредита, платеж, смена статуса кредита
+и начисление пени не пересчитывают месяцы, а копят изменения показателей
+(функции record_*) в session.info. Перед коммитом изменения записываются
+одним INSERT ... ON CONFLICT DO UPDATE (показатель = показатель + изменение),
+поэтому стоимость записи не зависит от размера портфеля, а строки сводки
+блокируются только на время коммита.
+
+Просроченные платежи в сводке - неоплаченные платежи с начисленной пеней
+(penalty_date), то есть просрочка на дату последнего начисления.
+
+Полный пересчет месяцев - только для перестройки (после загрузки данных в
+обход бота) и ручной сверки:
+
+    python -m services.portfolio_rollup --rebuild
+    python -m services.portfolio_rollup --month 2025-03 --month 2025-04
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterable
+from sqlalchemy import select, delete, func, and_, or_, text, event, DateTime
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models.user import Loan, Payment
+from models.base import LoanStatus
+from models.service import PortfolioMonthly
+from utils.bulk import bulk_insert
+
+REBUILD_CHUNK_MONTHS = 12
+ROLLUP_DELTA_KEY = "portfolio_delta"  # session.info: изменения показателей по (месяц, тип кредита)
+
+ROLLUP_METRICS = (
+    'loans_issued', 'issued_amount', 'loans_closed', 'loans_active',
+    'payments_count', 'payments_amount', 'overdue_count', 'overdue_amount'
+)
+
+
+def _metric(name: str, value=0):
+    return Decimal(str(value)).quantize(Decimal('0.01')) if name.endswith('_amount') else int(value)
+
+
+def month_start(value) -> date:
+    """Первое число месяца для даты или даты-времени"""
+    return date(value.year, value.month, 1)
+
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _in_months(column, months: list[date]):
+    """Условие "дата в одном из месяцев" диапазонами - работает по индексу"""
+    as_datetime = isinstance(column.type, DateTime)
+    ranges = []
+    for month in months:
+        start, end = month, next_month(month)
+        if as_datetime:
+            start, end = datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.min.time())
+        ranges.append(and_(column >= start, column < end))
+    return or_(*ranges)
+
+
+def _grouped(column):
+    return func.extract('year', column), func.extract('month', column)
+
+
+def _upsert(dialect_name: str):
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert
+
+
+def _add_delta(session: AsyncSession | Session, month, loan_type_id: int, **values):
+    rows = session.info.setdefault(ROLLUP_DELTA_KEY, {})
+    row = rows.setdefault((month_start(month), loan_type_id), {})
+    for name, value in values.items():
+        row[name] = row.get(name, 0) + _metric(name, value)
+
+
+def _status_counts(status: LoanStatus, sign: int) -> dict:
+    return {
+        'loans_active': sign if status == LoanStatus.ACTIVE else 0,
+        'loans_closed': sign if status == LoanStatus.CLOSED else 0,
+    }
+
+
+def record_loan_issued(session: AsyncSession, loan: Loan):
+    """Выданный кредит: месяц выдачи, сумма и статус"""
+    _add_delta(session, loan.issue_date, loan.loan_type_id,
+               loans_issued=1, issued_amount=loan.amount, **_status_counts(loan.status, 1))
+
+
+def record_loan_status(session: AsyncSession, issue_date, loan_type_id: int,
+                       old_status: LoanStatus, new_status: LoanStatus):
+    """Смена статуса кредита (закрытие, перевод в просрочку)"""
+    if old_status == new_status:
+        return
+    new, old = _status_counts(new_status, 1), _status_counts(old_status, -1)
+    _add_delta(session, issue_date, loan_type_id, **{name: new[name] + old[name] for name in new})
+
+
+def record_overdue(session: AsyncSession, loan_type_id: int, plan_date: date, amount, count: int = 1):
+    """Платеж стал (count=1) или перестал быть (count=-1) просроченным с начисленной пеней"""
+    _add_delta(session, plan_date, loan_type_id,
+               overdue_count=count, overdue_amount=Decimal(str(amount)) * count)
+
+
+def record_payment(session: AsyncSession, loan_type_id: int, payment: Payment):
+    """Внесенный платеж; просроченный (с пеней) платеж уходит из просрочки"""
+    _add_delta(session, payment.payment_date_fact, loan_type_id,
+               payments_count=1, payments_amount=payment.actual_amount)
+    if payment.penalty_date is not None:
+        record_overdue(session, loan_type_id, payment.payment_date_plan, payment.planned_amount, -1)
+
+
+def record_removed_payments(session: AsyncSession, loan_type_id: int, rows: Iterable):
+    """Удаленные неоплаченные платежи (строки RETURNING payment_date_plan, planned_amount, penalty_date)"""
+    for plan_date, amount, penalty_date in rows:
+        if penalty_date is not None:
+            record_overdue(session, loan_type_id, plan_date, amount, -1)
+
+
+@event.listens_for(Session, "before_commit")
+def _write_rollup_delta(session: Session):
+    """Накопленные изменения сводки - одним upsert последним запросом транзакции"""
+    rows = session.info.pop(ROLLUP_DELTA_KEY, None)
+    changed = sorted((key, values) for key, values in (rows or {}).items() if any(values.values()))
+    if not changed:
+        return
+
+    refreshed_at = datetime.utcnow()
+    table = PortfolioMonthly.__table__
+    stmt = _upsert(session.get_bind().dialect.name)(table).values([
+        {
+            'month': month,
+            'loan_type_id': loan_type_id,
+            **{name: values.get(name, _metric(name)) for name in ROLLUP_METRICS},
+            'refreshed_at': refreshed_at,
+        }
+        for (month, loan_type_id), values in changed
+    ])
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[table.c.month, table.c.loan_type_id],
+        set_={
+            **{name: table.c[name] + stmt.excluded[name] for name in ROLLUP_METRICS},
+            'refreshed_at': stmt.excluded.refreshed_at,
+        }
+    ))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rollup_delta(session: Session):
+    session.info.pop(ROLLUP_DELTA_KEY, None)
+
+
+async def refresh_portfolio_months(session: AsyncSession, months: Iterable[date]) -> int:
+    """
+    Полностью пересчитывает строки сводки за указанные месяцы (все типы кредитов) -
+    для перестройки и ручной сверки; обычные записи меняют сводку через record_*.
+    Коммит остается за вызывающим кодом.
+
+    :param session: сессия БД
+    :param months: месяцы (первые числа)
+    :return: количество записанных строк
+    """
+    months = sorted({month_start(month) for month in months})
+    if not months:
+        return 0
+    if session.bind.dialect.name == "postgresql":
+        # Изменения от платежей ждут окончания пересчета: иначе DELETE + INSERT
+        # затрет изменение, записанное между подсчетом и вставкой
+        await session.execute(text("LOCK TABLE portfolio_monthly IN SHARE ROW EXCLUSIVE MODE"))
+    rows: dict[tuple[date, int], dict] = {}
+
+    def row(year, month, loan_type_id) -> dict:
+        key = (date(int(year), int(month), 1), loan_type_id)
+        if key not in rows:
+            rows[key] = {'month': key[0], 'loan_type_id': loan_type_id, **{name: _metric(name) for name in ROLLUP_METRICS}}
+        return rows[key]
+
+    issue_year, issue_month = _grouped(Loan.issue_date)
+    issued = await session.execute(
+        select(
+            issue_year, issue_month, Loan.loan_type_id,
+            func.count(),
+            func.coalesce(func.sum(Loan.amount), 0),
+            func.count().filter(Loan.status == LoanStatus.CLOSED),
+            func.count().filter(Loan.status == LoanStatus.ACTIVE)
+        )
+        .where(_in_months(Loan.issue_date, months))
+        .group_by(issue_year, issue_month, Loan.loan_type_id)
+    )
+    for year, month, loan_type_id, count, amount, closed, active in issued:
+        data = row(year, month, loan_type_id)
+        data.update(loans_issued=count, issued_amount=Decimal(str(amount)), loans_closed=closed, loans_active=active)
+
+    fact_year, fact_month = _grouped(Payment.payment_date_fact)
+    paid = await session.execute(
+        select(fact_year, fact_month, Loan.loan_type_id, func.count(), func.coalesce(func.sum(Payment.actual_amount), 0))
+        .join(Loan, Payment.loan_id == Loan.loan_id)
+        .where(_in_months(Payment.payment_date_fact, months))
+        .where(Payment.actual_amount.is_not(None))
+        .group_by(fact_year, fact_month, Loan.loan_type_id)
+    )
+    for year, month, loan_type_id, count, amount in paid:
+        row(year, month, loan_type_id).update(payments_count=count, payments_amount=Decimal(str(amount)))
+
+    plan_year, plan_month = _grouped(Payment.payment_date_plan)
+    overdue = await session.execute(
+        select(plan_year, plan_month, Loan.loan_type_id, func.count(), func.coalesce(func.sum(Payment.planned_amount), 0))
+        .join(Loan, Payment.loan_id == Loan.loan_id)
+        .where(_in_months(Payment.payment_date_plan, months))
+        .where(Payment.payment_date_fact.is_(None))
+        .where(Payment.penalty_date.is_not(None))
+        .group_by(plan_year, plan_month, Loan.loan_type_id)
+    )
+    for year, month, loan_type_id, count, amount in overdue:
+        row(year, month, loan_type_id).update(overdue_count=count, overdue_amount=Decimal(str(amount)))
+
+    await session.execute(delete(PortfolioMonthly).where(PortfolioMonthly.month.in_(months)))
+    refreshed_at = datetime.utcnow()
+    for data in rows.values():
+        data['refreshed_at'] = refreshed_at
+    await bulk_insert(session, PortfolioMonthly.__table__, list(rows.values()))
+    return len(rows)
+
+
+async def rebuild_portfolio_rollup(session: AsyncSession, today: date = None) -> int:
+    """Полная перестройка сводки: от первого кредита или платежа до текущего месяца (или последней оплаты)"""
+    today = today or date.today()
+    await session.execute(delete(PortfolioMonthly))
+
+    loan_bounds = (await session.execute(select(func.min(Loan.issue_date), func.max(Loan.issue_date)))).one()
+    payment_bounds = (await session.execute(
+        select(func.min(Payment.payment_date_plan), func.max(Payment.payment_date_fact))
+    )).one()
+    dates = [value for value in (*loan_bounds, *payment_bounds) if value is not None]
+    if not dates:
+        return 0
+
+    month = min(month_start(value) for value in dates)
+    last = max(month_start(value) for value in (*dates, today))
+    written = 0
+    while month <= last:
+        chunk = []
+        while month <= last and len(chunk) < REBUILD_CHUNK_MONTHS:
+            chunk.append(month)
+            month = next_month(month)
+        written += await refresh_portfolio_months(session, chunk)
+    return written
+
+
+async def portfolio_year(session: AsyncSession, year: int) -> dict[int, dict]:
+    """Показатели по месяцам года (суммы по всем типам кредитов)"""
+    result = {month: {name: _metric(name) for name in ROLLUP_METRICS} for month in range(1, 13)}
+    rows = await session.execute(
+        select(PortfolioMonthly.month, *(func.sum(getattr(PortfolioMonthly, name)) for name in ROLLUP_METRICS))
+        .where(PortfolioMonthly.month >= date(year, 1, 1))
+        .where(PortfolioMonthly.month < date(year + 1, 1, 1))
+        .group_by(PortfolioMonthly.month)
+    )
+    for month, *values in rows:
+        result[month.month] = {name: _metric(name, value) for name, value in zip(ROLLUP_METRICS, values)}
+    return result
+
+
+async def portfolio_year_version(session: AsyncSession, year: int) -> str:
+    """
+    Версия сводки за год: хеш времени изменения ее строк. Любая запись в сводку
+    (из любого процесса) меняет refreshed_at своей строки, а значит и версию.
+    """
+    rows = await session.execute(
+        select(PortfolioMonthly.month, PortfolioMonthly.loan_type_id, PortfolioMonthly.refreshed_at)
+        .where(PortfolioMonthly.month >= date(year, 1, 1))
+        .where(PortfolioMonthly.month < date(year + 1, 1, 1))
+        .order_by(PortfolioMonthly.month, PortfolioMonthly.loan_type_id)
+    )
+    return hashlib.sha256(repr(rows.all()).encode()).hexdigest()
+
+
+async def portfolio_totals(session: AsyncSession) -> dict:
+    """Итоги по всему портфелю и время последнего пересчета"""
+    values = (await session.execute(
+        select(
+            *(func.coalesce(func.sum(getattr(PortfolioMonthly, name)), 0) for name in ROLLUP_METRICS),
+            func.max(PortfolioMonthly.refreshed_at)
+        )
+    )).one()
+    totals = {name: _metric(name, value) for name, value in zip(ROLLUP_METRICS, values)}
+    totals['refreshed_at'] = values[-1]
+    return totals
+
+
+async def _main():
+    from utils.database import async_session, engine
+
+    parser = argparse.ArgumentParser(description="Пересчет сводки портфеля portfolio_monthly")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--rebuild", action="store_true", help="полная перестройка")
+    group.add_argument("--month", action="append", help="пересчитать месяц ГГГГ-ММ (можно несколько раз)")
+    args = parser.parse_args()
+
+    try:
+        async with async_session() as session:
+            if args.rebuild:
+                written = await rebuild_portfolio_rollup(session)
+            else:
+                months = [datetime.strptime(value, "%Y-%m").date() for value in args.month]
+                written = await refresh_portfolio_months(session, months)
+            await session.commit()
+        print(f"Записано строк сводки: {written}")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,401 @@
+"""
+Напоминания клиентам о платежах: за REMINDER_DAYS_BEFORE дней до срока и о просрочке.
+
+Прогон ставит в очередь платежи одним запросом INSERT ... SELECT по частичному
+индексу ix_payments_unpaid_by_date: неоплаченные платежи с плановой датой не
+позже today + REMINDER_DAYS_BEFORE, по которым еще нет напоминания того же вида
+(due - скоро срок, overdue - просрочен). Напоминания клиента собираются в одно
+сообщение и отправляются несколькими обработчиками через общий ограничитель:
+не больше REMINDER_RATE сообщений в секунду на бота и одно сообщение в
+REMINDER_CHAT_INTERVAL секунд в чат. На TelegramRetryAfter отправка всех
+обработчиков приостанавливается на указанное время, на сетевые ошибки -
+повтор с растущей паузой.
+
+Ограничитель живет в процессе, поэтому рассылает один экземпляр бота: на
+PostgreSQL прогон берет pg_try_advisory_lock, и остальные экземпляры, пока
+блокировка занята, прогон пропускают. Так REMINDER_RATE - лимит бота, а не
+каждого процесса.
+
+Перед отправкой напоминания захватываются (claimed_at) и коммитятся, после
+успешной отправки им ставится sent_at, при ошибке захват снимается. Если бот
+упал посреди отправки, захват истекает через REMINDER_LEASE секунд и следующий
+прогон отправит напоминание снова (в худшем случае клиент получит его дважды,
+но не потеряет). Недоставленные напоминания уходят при следующем прогоне, а
+оставшиеся от прошлых дней удаляются и ставятся в очередь заново, если платеж
+все еще не оплачен.
+"""
+import asyncio
+import logging
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import AsyncIterator, Optional
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramRetryAfter, TelegramNetworkError, TelegramServerError,
+    TelegramForbiddenError, TelegramBadRequest
+)
+from sqlalchemy import (
+    select, insert, update, delete, exists, case, literal, and_, or_, func, Date, DateTime, Integer
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Config
+from models.base import LoanStatus
+from models.service import PaymentReminder
+from models.user import Client, Loan, Payment
+from services.certificates import deliver_pending_certificates
+from utils.database import async_session, engine
+from utils.documents import document_renderer, format_date, format_money
+
+REMINDER_DUE = "due"
+REMINDER_OVERDUE = "overdue"
+
+# Строк платежей в одном сообщении (итог считается по всем)
+REMINDER_MAX_LINES = 20
+# Повторов отправки одного сообщения в пределах прогона
+SEND_RETRIES = 5
+# Ключ pg_try_advisory_lock: напоминания рассылает один экземпляр бота
+REMINDER_LOCK_KEY = 7_310_615
+
+_reminder_task: Optional[asyncio.Task] = None
+_run_lock = asyncio.Lock()
+
+
+@dataclass(frozen=True, slots=True)
+class Recipient:
+    """Клиент с неотправленными напоминаниями"""
+    client_id: int
+    telegram_id: int
+    name: str
+
+
+@dataclass(frozen=True, slots=True)
+class ReminderResult:
+    """Итог прогона напоминаний"""
+    run_date: date
+    scheduled: int
+    sent: int
+    failed: int
+
+
+class SendRateLimiter:
+    """Ограничение частоты отправки: общее на бота и на каждый чат"""
+    def __init__(self, rate: float, chat_interval: float):
+        self.interval = 1 / rate
+        self.chat_interval = chat_interval
+        self._next_slot = 0.0
+        self._next_chat: dict[int, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, chat_id: int):
+        """Ждет, пока в чат и в бота можно отправить следующее сообщение"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        chat_slot = max(now, self._next_chat.get(chat_id, 0.0))
+        self._next_chat[chat_id] = chat_slot + self.chat_interval
+        if len(self._next_chat) > 10000:
+            self._next_chat = {chat: slot for chat, slot in self._next_chat.items() if slot > now}
+        if chat_slot > now:
+            await asyncio.sleep(chat_slot - now)
+
+        async with self._lock:
+            now = loop.time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds: float):
+        """Откладывает все отправки (ответ Telegram retry_after)"""
+        self._next_slot = max(self._next_slot, asyncio.get_running_loop().time() + seconds)
+
+
+send_limiter = SendRateLimiter(Config.REMINDER_RATE, Config.REMINDER_CHAT_INTERVAL)
+
+
+async def schedule_reminders(session: AsyncSession, today: date,
+                             days_before: int = None) -> int:
+    """
+    Ставит в очередь напоминания по платежам, срок которых наступает в течение
+    days_before дней или уже прошел (коммит за вызывающим кодом).
+
+    :return: количество новых напоминаний
+    """
+    days_before = Config.REMINDER_DAYS_BEFORE if days_before is None else days_before
+    kind = case((Payment.payment_date_plan < today, literal(REMINDER_OVERDUE)), else_=literal(REMINDER_DUE))
+    due_payments = (
+        select(
+            Payment.payment_id, kind, Loan.client_id, Payment.loan_id, Payment.payment_date_plan,
+            Payment.planned_amount, literal(today, Date), literal(0, Integer), literal(datetime.utcnow(), DateTime)
+        )
+        .join(Loan, Loan.loan_id == Payment.loan_id)
+        .join(Client, Client.clientID == Loan.client_id)
+        .outerjoin(PaymentReminder, and_(PaymentReminder.payment_id == Payment.payment_id, PaymentReminder.kind == kind))
+        .where(Payment.payment_date_fact.is_(None))
+        .where(Payment.payment_date_plan <= today + timedelta(days=days_before))
+        .where(Loan.status.in_([LoanStatus.ACTIVE, LoanStatus.OVERDUE]))
+        .where(Client.telegram_id.is_not(None))
+        .where(PaymentReminder.payment_id.is_(None))
+    )
+    result = await session.execute(
+        insert(PaymentReminder).from_select(
+            ['payment_id', 'kind', 'client_id', 'loan_id', 'due_date', 'amount', 'remind_date', 'attempts', 'created_at'],
+            due_payments
+        )
+    )
+    return result.rowcount
+
+
+async def expire_reminders(session: AsyncSession, today: date) -> int:
+    """Удаляет неотправленные напоминания прошлых дней (следующий прогон поставит актуальные)"""
+    result = await session.execute(
+        delete(PaymentReminder)
+        .where(PaymentReminder.sent_at.is_(None))
+        .where(PaymentReminder.attempts < Config.REMINDER_MAX_ATTEMPTS)
+        .where(PaymentReminder.remind_date < today)
+    )
+    return result.rowcount
+
+
+def _lease_expired(now: datetime):
+    """Напоминание свободно: не захвачено или захват старше REMINDER_LEASE (отправка прервана)"""
+    return or_(
+        PaymentReminder.claimed_at.is_(None),
+        PaymentReminder.claimed_at < now - timedelta(seconds=Config.REMINDER_LEASE)
+    )
+
+
+async def pending_recipients(session: AsyncSession) -> list[Recipient]:
+    """Клиенты с неотправленными напоминаниями (ix_payment_reminders_pending)"""
+    rows = await session.execute(
+        select(PaymentReminder.client_id, Client.telegram_id, Client.fullName)
+        .join(Client, Client.clientID == PaymentReminder.client_id)
+        .where(PaymentReminder.sent_at.is_(None))
+        .where(PaymentReminder.attempts < Config.REMINDER_MAX_ATTEMPTS)
+        .where(_lease_expired(datetime.utcnow()))
+        .where(Client.telegram_id.is_not(None))
+        .distinct()
+    )
+    return [Recipient(client_id, telegram_id, name) for client_id, telegram_id, name in rows]
+
+
+def render_reminder(name: str, reminders, today: date) -> str:
+    """Сообщение клиенту по его напоминаниям (строки kind, loan_id, due_date, amount)"""
+    reminders = sorted(reminders, key=lambda row: (row.due_date, row.loan_id))
+    payments = []
+    for row in reminders[:REMINDER_MAX_LINES]:
+        if row.kind == REMINDER_OVERDUE:
+            status = "просрочен"
+        elif row.due_date == today:
+            status = "сегодня"
+        else:
+            status = f"через {(row.due_date - today).days} дн."
+        payments.append({
+            'date': format_date(row.due_date),
+            'loan_id': row.loan_id,
+            'amount': format_money(row.amount),
+            'status': status,
+        })
+    return document_renderer.render(
+        "payment_reminder", cache=False,
+        client_name=name,
+        payments=payments,
+        count=len(reminders),
+        total=format_money(sum((row.amount for row in reminders), Decimal('0.00')))
+    )
+
+
+async def _claim(client_id: int, claimed_at: datetime) -> list:
+    """Захватывает свободные неотправленные напоминания клиента по еще не оплаченным платежам"""
+    async with async_session() as session:
+        rows = (await session.execute(
+            update(PaymentReminder)
+            .where(PaymentReminder.client_id == client_id)
+            .where(PaymentReminder.sent_at.is_(None))
+            .where(PaymentReminder.attempts < Config.REMINDER_MAX_ATTEMPTS)
+            .where(_lease_expired(claimed_at))
+            .where(
+                exists()
+                .where(Payment.payment_id == PaymentReminder.payment_id)
+                .where(Payment.payment_date_fact.is_(None))
+            )
+            .values(claimed_at=claimed_at, attempts=PaymentReminder.attempts + 1)
+            .returning(PaymentReminder.kind, PaymentReminder.loan_id, PaymentReminder.due_date, PaymentReminder.amount)
+            .execution_options(synchronize_session=False)
+        )).all()
+        await session.commit()
+    return rows
+
+
+async def _finish(client_id: int, claimed_at: datetime, **values):
+    """Завершает захват claimed_at: отметка об отправке или снятие захвата"""
+    async with async_session() as session:
+        await session.execute(
+            update(PaymentReminder)
+            .where(PaymentReminder.client_id == client_id)
+            .where(PaymentReminder.claimed_at == claimed_at)
+            .values(claimed_at=None, **values)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+
+
+async def _release(client_id: int, claimed_at: datetime, error: TelegramAPIError, permanent: bool):
+    """Снимает захват; при постоянной ошибке (бот заблокирован) напоминания больше не отправляются"""
+    values = {'last_error': str(error)[:255]}
+    if permanent:
+        values['attempts'] = Config.REMINDER_MAX_ATTEMPTS
+    await _finish(client_id, claimed_at, **values)
+
+
+async def deliver_reminder(bot: Bot, recipient: Recipient, today: date) -> Optional[bool]:
+    """
+    Отправляет клиенту одно сообщение по всем его неотправленным напоминаниям.
+
+    :return: True - отправлено, False - ошибка, None - отправлять нечего
+    """
+    claimed_at = datetime.utcnow()
+    reminders = await _claim(recipient.client_id, claimed_at)
+    if not reminders:
+        return None
+
+    text = render_reminder(recipient.name, reminders, today)
+    error, permanent = None, False
+    for attempt in range(SEND_RETRIES + 1):
+        await send_limiter.wait(recipient.telegram_id)
+        try:
+            await bot.send_message(recipient.telegram_id, text, parse_mode=ParseMode.HTML)
+        except TelegramRetryAfter as e:
+            error = e
+            send_limiter.pause(e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            error = e
+            await asyncio.sleep(min(2 ** attempt, 30))
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            error, permanent = e, True
+            break
+        except TelegramAPIError as e:
+            error = e
+            break
+        else:
+            await _finish(recipient.client_id, claimed_at, sent_at=datetime.utcnow())
+            return True
+
+    logging.warning(f"Напоминание клиенту {recipient.client_id} не отправлено: {error}")
+    await _release(recipient.client_id, claimed_at, error, permanent)
+    return False
+
+
+async def deliver_reminders(bot: Bot, recipients: list[Recipient], today: date,
+                            workers: int = None) -> Counter:
+    """Раздает клиентов обработчикам очереди; возвращает счетчик исходов deliver_reminder"""
+    queue: asyncio.Queue[Recipient] = asyncio.Queue()
+    for recipient in recipients:
+        queue.put_nowait(recipient)
+    outcomes = Counter()
+
+    async def worker():
+        while not queue.empty():
+            recipient = queue.get_nowait()
+            try:
+                outcomes[await deliver_reminder(bot, recipient, today)] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                outcomes[False] += 1
+                logging.error(f"Ошибка отправки напоминания клиенту {recipient.client_id}: {e}", exc_info=True)
+
+    workers = min(workers or Config.REMINDER_WORKERS, len(recipients))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return outcomes
+
+
+@asynccontextmanager
+async def _sender_lock() -> AsyncIterator[bool]:
+    """
+    Право рассылать в этом прогоне: на PostgreSQL - pg_try_advisory_lock на
+    отдельном соединении до конца прогона (при падении бота снимается вместе
+    с соединением); SQLite - один процесс, блокировка не нужна.
+    """
+    if engine.dialect.name != "postgresql":
+        yield True
+        return
+    async with engine.connect() as conn:
+        acquired = await conn.scalar(select(func.pg_try_advisory_lock(REMINDER_LOCK_KEY)))
+        await conn.commit()
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                await conn.scalar(select(func.pg_advisory_unlock(REMINDER_LOCK_KEY)))
+                await conn.commit()
+
+
+async def run_reminders(bot: Bot, today: date = None) -> ReminderResult:
+    """Один прогон: постановка в очередь и отправка всех неотправленных напоминаний"""
+    today = today or date.today()
+    async with _run_lock, _sender_lock() as acquired:
+        if not acquired:
+            logging.info("Напоминания рассылает другой экземпляр бота, прогон пропущен")
+            return ReminderResult(today, 0, 0, 0)
+
+        async with async_session() as session:
+            await expire_reminders(session, today)
+            scheduled = await schedule_reminders(session, today)
+            await session.commit()
+            recipients = await pending_recipients(session)
+
+        outcomes = await deliver_reminders(bot, recipients, today)
+
+    result = ReminderResult(today, scheduled, outcomes[True], outcomes[False])
+    logging.info(
+        f"Напоминания за {result.run_date}: поставлено в очередь {result.scheduled}, "
+        f"отправлено {result.sent}, с ошибкой {result.failed}"
+    )
+    return result
+
+
+async def _reminder_loop(bot: Bot, interval: float):
+    while True:
+        try:
+            await run_reminders(bot)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка фоновой отправки напоминаний: {e}", exc_info=True)
+        try:
+            # Тот же прогон досылает справки, отправка которых не завершилась
+            async with async_session() as session:
+                await deliver_pending_certificates(bot, session)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Ошибка повторной отправки справок: {e}", exc_info=True)
+        await asyncio.sleep(interval)
+
+
+def start_reminders(bot: Bot, interval: float = None) -> asyncio.Task:
+    """Запускает фоновую отправку напоминаний (вызывается из on_startup)"""
+    global _reminder_task
+    if _reminder_task is None or _reminder_task.done():
+        _reminder_task = asyncio.create_task(
+            _reminder_loop(bot, interval or Config.REMINDER_INTERVAL),
+            name="payment_reminders"
+        )
+    return _reminder_task
+
+
+async def stop_reminders():
+    """Останавливает фоновую отправку напоминаний"""
+    global _reminder_task
+    if _reminder_task is not None:
+        _reminder_task.cancel()
+        try:
+            await _reminder_task
+        except asyncio.CancelledError:
+            pass
+        _reminder_task = None
@@ -0,0 +1,93 @@
+"""
+Кеш готовых отчетов по (тип отчета, год).
+
+Отчеты строятся по сводке portfolio_monthly, поэтому отчет устаревает
+только вместе со строками сводки своего года. Отчет хранится вместе с
+версией сводки, по которой он собран (portfolio_year_version - хеш времени
+изменения строк года), и перед выдачей версия сверяется с БД. Так изменения
+из других воркеров, CLI и генератора данных тоже сбрасывают отчет, а
+отчеты за прошлые годы остаются в кеше, пока их сводку не изменит запись
+задним числом (например, оплата старой просрочки).
+
+Дата формирования в кешируемый текст не входит - ее добавляет вызывающий код.
+"""
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable
+
+REPORT_ANNUAL = "annual"
+
+
+@dataclass(frozen=True, slots=True)
+class CachedReport:
+    """Готовый отчет, версия сводки и время его сборки"""
+    text: str
+    version: str
+    built_at: datetime
+    build_ms: float
+
+
+class ReportCache:
+    """Отчеты по (тип, год) с учетом сборок, попаданий и устаревших версий"""
+    def __init__(self):
+        self.reports: dict[tuple[str, int], CachedReport] = {}
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.stale = 0
+        self.build_total = 0.0
+        self.build_max = 0.0
+
+    async def get(self, report_type: str, year: int, version: str, build: Callable[[], Awaitable[str]],
+                  refresh: bool = False) -> CachedReport:
+        """
+        Отчет из кеша или новая сборка.
+
+        :param report_type: тип отчета (REPORT_ANNUAL, ...)
+        :param year: год отчета
+        :param version: текущая версия данных отчета (читается до сборки)
+        :param build: сборка текста отчета
+        :param refresh: пересобрать, даже если отчет есть в кеше
+        """
+        key = (report_type, year)
+        report = self.reports.get(key)
+        if report and report.version == version and not refresh:
+            self.hits += 1
+            return report
+
+        if refresh:
+            self.refreshes += 1
+        elif report:
+            self.stale += 1
+        else:
+            self.misses += 1
+        started = time.perf_counter()
+        text = await build()
+        elapsed = time.perf_counter() - started
+        self.build_total += elapsed
+        self.build_max = max(self.build_max, elapsed)
+
+        # Версия прочитана до сборки: если сводка изменилась во время сборки,
+        # следующий запрос увидит новую версию и пересоберет отчет
+        report = self.reports[key] = CachedReport(
+            text=text, version=version, built_at=datetime.now(), build_ms=elapsed * 1000
+        )
+        return report
+
+    def stats(self) -> dict:
+        builds = self.misses + self.stale + self.refreshes
+        requests = self.hits + builds
+        return {
+            "size": len(self.reports),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "stale": self.stale,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "build_avg_ms": self.build_total / builds * 1000 if builds else 0.0,
+            "build_max_ms": self.build_max * 1000,
+        }
+
+
+report_cache = ReportCache()
@@ -0,0 +1,140 @@
+"""
+Прием обновлений через webhook (aiohttp) как альтернатива long polling.
+
+Каждое обновление обрабатывается в отдельной задаче, но одновременно - не
+больше max_concurrency: при заполнении лимита запрос Telegram ждет
+свободного слота, что дает естественное обратное давление. При остановке
+сервер перестает принимать запросы и дожидается уже принятых обновлений.
+"""
+import asyncio
+import logging
+import signal
+from hmac import compare_digest
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+from pydantic import ValidationError
+
+from config import Config
+from services.perf import metrics_handler
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class BoundedUpdateHandler:
+    """Обработчик webhook-запросов с ограничением числа одновременных обновлений"""
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str = None,
+                 max_concurrency: int = 64, **data):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self.data = data
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        """Количество обновлений в обработке"""
+        return len(self._tasks)
+
+    def verify_secret(self, request: web.Request) -> bool:
+        if not self.secret_token:
+            return True
+        return compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not self.verify_secret(request):
+            return web.Response(status=401, text="Unauthorized")
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except (ValueError, ValidationError):
+            return web.Response(status=400, text="Bad update")
+
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dispatcher.feed_update(self.bot, update, **self.data)
+        except Exception as e:
+            logging.error(f"Ошибка обработки обновления {update.update_id}: {e}", exc_info=True)
+        finally:
+            self._semaphore.release()
+
+    async def drain(self, timeout: float):
+        """Дожидается обработки принятых обновлений (не дольше timeout)"""
+        if not self._tasks:
+            return
+        logging.info(f"Ожидание завершения {len(self._tasks)} обновлений")
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning(f"Прервано необработанных обновлений: {len(pending)}")
+
+    def register(self, app: web.Application, path: str, drain_timeout: float):
+        app.router.add_post(path, self.handle)
+
+        async def on_shutdown(_: web.Application):
+            await self.drain(drain_timeout)
+
+        app.on_shutdown.append(on_shutdown)
+
+
+def build_webhook_app(dispatcher: Dispatcher, bot: Bot) -> web.Application:
+    """aiohttp-приложение с обработчиком webhook и хуками startup/shutdown диспетчера"""
+    app = web.Application()
+    handler = BoundedUpdateHandler(
+        dispatcher,
+        bot,
+        secret_token=Config.WEBHOOK_SECRET,
+        max_concurrency=Config.WEBHOOK_MAX_CONCURRENCY
+    )
+    # Дренаж регистрируется раньше setup_application, чтобы выполниться до dp.shutdown
+    handler.register(app, Config.WEBHOOK_PATH, Config.WEBHOOK_DRAIN_TIMEOUT)
+    app.router.add_get(Config.METRICS_PATH, metrics_handler)
+    setup_application(app, dispatcher, bot=bot)
+    app["update_handler"] = handler
+    return app
+
+
+async def set_webhook(bot: Bot, dispatcher: Dispatcher):
+    """Регистрирует webhook в Telegram, если задан публичный адрес"""
+    if not Config.WEBHOOK_BASE_URL:
+        logging.info("WEBHOOK_BASE_URL не задан - webhook в Telegram не регистрируется")
+        return
+    await bot.set_webhook(
+        url=Config.WEBHOOK_BASE_URL.rstrip("/") + Config.WEBHOOK_PATH,
+        secret_token=Config.WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types()
+    )
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot):
+    """Запускает aiohttp-сервер и работает до SIGINT/SIGTERM"""
+    dispatcher.startup.register(set_webhook)
+    app = build_webhook_app(dispatcher, bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, Config.WEBHOOK_HOST, Config.WEBHOOK_PORT)
+    await site.start()
+    logging.info(f"Webhook слушает {Config.WEBHOOK_HOST}:{Config.WEBHOOK_PORT}{Config.WEBHOOK_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
@@ -1,5 +1,11 @@
 from aiogram.fsm.state import StatesGroup, State
 
+class RegistrationStates(StatesGroup):
+    full_name = State()
+    passport = State()
+    phone = State()
+    email = State()
+
 class FormStates(StatesGroup):
     waiting_for_phone = State()
     waiting_for_email = State()
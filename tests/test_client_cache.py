@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import update, inspect
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+import utils.auxiliary_funcs as auxiliary_funcs
+import utils.client_cache as client_cache_module
+from models.user import Client
+from utils.calculations import calculate_max_loan_amount
+from utils.client_cache import ClientCache
+from utils.migrations import migrate
+
+
+class Clock:
+    """Подменяет time.monotonic в модуле кеша"""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(client_cache_module, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def make_client(client_id: int, telegram_id: int, score: int = 500) -> Client:
+    return Client(clientID=client_id, fullName=f"Клиент {client_id}", passport=f"0000 {client_id:06d}",
+                  telegram_id=telegram_id, phone_numbers=["+79160000000"], email=None,
+                  registration_date=datetime(2026, 1, 1), creditScore=score)
+
+
+def test_hit_returns_detached_copy(clock):
+    cache = ClientCache(max_size=10, ttl=60)
+    original = make_client(1, 101)
+    cache.put(original)
+
+    cached = cache.get(101)
+    assert cached is not original
+    assert (cached.clientID, cached.fullName, cached.creditScore) == (1, "Клиент 1", 500)
+    assert inspect(cached).detached
+
+    # Изменение копии не меняет снимок
+    cached.phone_numbers.append("+79990000000")
+    assert cache.get(101).phone_numbers == ["+79160000000"]
+    assert cache.stats()["hits"] == 2
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = ClientCache(max_size=10, ttl=60)
+    cache.put(make_client(1, 101))
+
+    clock.now += 59
+    assert cache.get(101) is not None
+    clock.now += 2
+    assert cache.get(101) is None
+    assert cache.stats()["size"] == 0
+    assert cache.stats()["misses"] == 1
+
+    # Истекшая запись удалена вместе с обратным индексом
+    cache.invalidate_client(1)
+    cache.put(make_client(1, 101))
+    assert cache.get(101) is not None
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ClientCache(max_size=2, ttl=60)
+    cache.put(make_client(1, 101))
+    cache.put(make_client(2, 102))
+    assert cache.get(101) is not None  # 101 становится последним использованным
+
+    cache.put(make_client(3, 103))
+    assert cache.get(102) is None
+    assert cache.get(101) is not None and cache.get(103) is not None
+    assert cache.stats()["evictions"] == 1
+
+    # Вытесненный клиент не числится в индексе по clientID
+    cache.invalidate_client(2)
+    assert cache.stats()["size"] == 2
+
+
+def test_invalidate_client_by_internal_id(clock):
+    cache = ClientCache(max_size=10, ttl=60)
+    cache.put(make_client(1, 101))
+    cache.put(make_client(2, 102))
+
+    cache.invalidate_client(1)
+    assert cache.get(101) is None
+    assert cache.get(102) is not None
+    cache.invalidate_client(404)  # неизвестный клиент - ничего не делает
+    assert cache.stats()["size"] == 1
+
+    # Клиент без telegram_id не кешируется
+    cache.put(make_client(5, None))
+    assert cache.stats()["size"] == 1
+
+
+def test_cached_client_does_not_shadow_database_row(tmp_path, monkeypatch):
+    """После попадания в кеш session.get(Client) в том же обработчике читает рейтинг из БД, а не из снимка"""
+    cache = ClientCache(max_size=10, ttl=60)
+    monkeypatch.setattr(auxiliary_funcs, "client_cache", cache)
+    message = SimpleNamespace(from_user=SimpleNamespace(id=101))
+
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'clients.db'}")
+        try:
+            await migrate(engine)
+            sessions = async_sessionmaker(engine, expire_on_commit=False)
+            async with sessions() as session:
+                client = make_client(1, 101, score=300)
+                session.add(client)
+                await session.commit()
+                cache.put(client)
+
+            # Рейтинг изменился в другом процессе, запись кеша еще жива
+            async with sessions() as session:
+                await session.execute(update(Client).where(Client.clientID == 1).values(creditScore=850))
+                await session.commit()
+
+            async with sessions() as session:
+                cached = await auxiliary_funcs.check_client_registered(message, session)
+                assert cached.creditScore == 300 and cache.stats()["hits"] == 1
+                assert await calculate_max_loan_amount(cached.clientID, session) == 1000000
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
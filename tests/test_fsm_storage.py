@@ -0,0 +1,122 @@
+import asyncio
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from config import Config
+from models.service import FSMRecord
+from states import PaymentStates
+from utils.fsm_storage import SQLAlchemyStorage, build_fsm_storage, dumps, loads
+from utils.migrations import migrate
+
+KEY = StorageKey(bot_id=42, chat_id=100, user_id=100)
+OTHER_KEY = StorageKey(bot_id=42, chat_id=200, user_id=200)
+
+# Данные в том виде, в каком их кладут обработчики платежей и кредитов
+PAYMENT_DATA = {
+    "loan_id": 7,
+    "penalty_amount": 12.5,
+    "next_payment_date": date(2026, 3, 15),
+    "next_payment_amount": Decimal("9021.10"),
+    "proposed_amount": Decimal("30000.00"),
+    "confirmed_at": datetime(2026, 2, 10, 14, 30, 5, 123456),
+    "history": [{"amount": Decimal("0.01"), "date": date(2026, 1, 31)}],
+    "comment": "Платеж по графику",
+}
+
+
+def test_json_round_trip_keeps_types():
+    restored = loads(dumps(PAYMENT_DATA))
+    assert restored == PAYMENT_DATA
+    assert type(restored["next_payment_date"]) is date
+    assert type(restored["confirmed_at"]) is datetime
+    # Decimal не проходит через float: копейки и незначащие нули сохраняются
+    assert str(restored["next_payment_amount"]) == "9021.10"
+    assert isinstance(restored["history"][0]["amount"], Decimal)
+
+
+def test_json_rejects_unknown_types():
+    with pytest.raises(TypeError):
+        dumps({"value": {1, 2}})
+
+
+@pytest.fixture
+def run(tmp_path):
+    """Запускает scenario(storage, sessions) на SQLite-базе, собранной миграциями (как FSM_STORAGE=db без FSM_DB_URL)"""
+    def runner(scenario):
+        async def main():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'fsm.db'}")
+            try:
+                await migrate(engine)
+                sessions = async_sessionmaker(engine, expire_on_commit=False)
+                await scenario(SQLAlchemyStorage(sessions), sessions)
+            finally:
+                await engine.dispose()
+        asyncio.run(main())
+    return runner
+
+
+async def _rows(sessions) -> int:
+    async with sessions() as session:
+        return await session.scalar(select(func.count()).select_from(FSMRecord))
+
+
+def test_data_survives_the_database(run):
+    async def scenario(storage, sessions):
+        assert await storage.get_data(KEY) == {}
+        await storage.set_data(KEY, PAYMENT_DATA)
+        restored = await storage.get_data(KEY)
+        assert restored == PAYMENT_DATA
+        assert isinstance(restored["proposed_amount"], Decimal)
+
+    run(scenario)
+
+
+def test_upsert_replaces_state_and_data(run):
+    async def scenario(storage, sessions):
+        await storage.set_state(KEY, PaymentStates.choose_loan)
+        await storage.set_data(KEY, {"loan_id": 1, "proposed_amount": Decimal("100.00")})
+
+        await storage.set_state(KEY, PaymentStates.enter_amount)
+        await storage.set_data(KEY, {"loan_id": 2})
+
+        # Одна строка на ключ; данные заменены целиком, состояние и данные пишутся независимо
+        assert await _rows(sessions) == 1
+        assert await storage.get_state(KEY) == PaymentStates.enter_amount.state
+        assert await storage.get_data(KEY) == {"loan_id": 2}
+
+        await storage.set_state(KEY, None)
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {"loan_id": 2}
+
+        await storage.set_state(OTHER_KEY, PaymentStates.choose_loan)
+        assert await _rows(sessions) == 2
+        assert await storage.get_data(OTHER_KEY) == {}
+
+    run(scenario)
+
+
+def test_separate_database_from_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "FSM_STORAGE", "db")
+    monkeypatch.setattr(Config, "FSM_DB_URL", f"sqlite+aiosqlite:///{tmp_path / 'fsm_separate.db'}")
+
+    async def main():
+        storage = build_fsm_storage()
+        try:
+            # Таблица создается при первом обращении
+            await storage.set_state(KEY, PaymentStates.enter_amount)
+            await storage.update_data(KEY, {"next_payment_date": date(2026, 3, 15)})
+            await storage.update_data(KEY, {"proposed_amount": Decimal("5.50")})
+            assert await storage.get_state(KEY) == PaymentStates.enter_amount.state
+            assert await storage.get_data(KEY) == {
+                "next_payment_date": date(2026, 3, 15),
+                "proposed_amount": Decimal("5.50"),
+            }
+        finally:
+            await storage.close()
+
+    asyncio.run(main())
@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from utils.index_check import HOT_QUERIES, check_indexes
+from utils.migrations import migrate
+
+
+async def _check_fresh_schema(url: str):
+    engine = create_async_engine(url)
+    try:
+        await migrate(engine)
+        async with engine.connect() as connection:
+            async with connection.begin():
+                return await check_indexes(connection)
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture
+def sqlite_results(tmp_path):
+    """Планы горячих запросов на SQLite-схеме, собранной миграциями с нуля"""
+    return asyncio.run(_check_fresh_schema(f"sqlite+aiosqlite:///{tmp_path / 'index_check.db'}"))
+
+
+def test_hot_queries_use_indexes(sqlite_results):
+    assert len(sqlite_results) == len(HOT_QUERIES)
+    for title, index_name, used, plan in sqlite_results:
+        assert used, f"{title}: ожидался {index_name}, план:\n{plan}"
+        assert not any(line.startswith("SCAN") for line in plan.splitlines()), f"{title}: полный проход\n{plan}"
@@ -0,0 +1,162 @@
+import asyncio
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+import services.payment_acceptance as payment_acceptance
+from models.base import LoanStatus
+from models.service import AcceptedPayment
+from models.user import Client, Loan, Payment, LoanLedgerEntry
+from services.loan_ledger import ENTRY_PAYMENT, ENTRY_EARLY_PAYMENT
+from services.payment_acceptance import accept_payment, accept_early_repayment
+from utils.calculations import save_schedule
+from utils.loan_type_catalog import loan_type_catalog
+from utils.migrations import migrate
+from utils.schedule_engine import build_schedule
+
+AMOUNT = Decimal('100000.00')
+TERM = 12
+LOAN_TYPE_ID = 2  # Потребительский стандарт, 14.9%
+ISSUED = datetime(2026, 1, 15)
+TODAY = date(2026, 2, 10)
+
+
+async def _seed(sessions) -> tuple[int, Decimal]:
+    async with sessions() as session:
+        await loan_type_catalog.load(session)
+        client = Client(fullName="Тест Тестович", passport="1234 567890", telegram_id=None,
+                        phone_numbers=["+79160000000"], creditScore=700)
+        session.add(client)
+        await session.flush()
+        loan = Loan(client_id=client.clientID, loan_type_id=LOAN_TYPE_ID, issue_date=ISSUED, amount=AMOUNT,
+                    term=TERM, status=LoanStatus.ACTIVE, total_paid=Decimal('0.00'), remaining_amount=AMOUNT)
+        session.add(loan)
+        await session.flush()
+        schedule = build_schedule(AMOUNT, TERM, loan_type_catalog.get(LOAN_TYPE_ID).interest_rate, ISSUED.date())
+        await save_schedule(session, loan.loan_id, schedule)
+        loan.next_payment_date = schedule.first_date
+        await session.commit()
+        return loan.loan_id, schedule.monthly_payment
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    """Запускает сценарий на чистой SQLite-базе с одним кредитом: scenario(sessions, loan_id, monthly_payment)"""
+    def runner(scenario):
+        async def main():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'acceptance.db'}")
+            try:
+                await migrate(engine)
+                sessions = async_sessionmaker(engine, expire_on_commit=False)
+                monkeypatch.setattr(payment_acceptance, "async_session", sessions)
+                await scenario(sessions, *await _seed(sessions))
+            finally:
+                await engine.dispose()
+        asyncio.run(main())
+    return runner
+
+
+async def _state(sessions, loan_id: int):
+    async with sessions() as session:
+        loan = await session.get(Loan, loan_id)
+        paid = (await session.scalars(
+            select(Payment).where(Payment.loan_id == loan_id, Payment.payment_date_fact.is_not(None))
+            .order_by(Payment.payment_date_plan)
+        )).all()
+        unpaid = await session.scalar(
+            select(func.count()).where(Payment.loan_id == loan_id, Payment.payment_date_fact.is_(None))
+        )
+        ledger = (await session.scalars(
+            select(LoanLedgerEntry).where(LoanLedgerEntry.loan_id == loan_id).order_by(LoanLedgerEntry.entry_id)
+        )).all()
+        accepted = await session.scalar(select(func.count()).select_from(AcceptedPayment))
+        return loan, paid, unpaid, ledger, accepted
+
+
+def test_repeated_message_key_is_not_charged_twice(run):
+    async def scenario(sessions, loan_id, monthly_payment):
+        key = "msg:100:1"
+        first = await accept_payment(key, loan_id, monthly_payment, today=TODAY)
+        # Повторная доставка того же обновления, даже с другой суммой
+        repeated = await accept_payment(key, loan_id, monthly_payment * 2, today=TODAY)
+
+        assert not first.duplicate
+        assert repeated.duplicate
+        assert (repeated.amount, repeated.remaining_amount, repeated.next_payment_date) == \
+               (first.amount, first.remaining_amount, first.next_payment_date)
+
+        loan, paid, unpaid, ledger, accepted = await _state(sessions, loan_id)
+        assert len(paid) == 1 and unpaid == TERM - 1
+        assert loan.total_paid == monthly_payment
+        assert loan.remaining_amount == AMOUNT - monthly_payment
+        assert [entry.entry_type for entry in ledger] == [ENTRY_PAYMENT]
+        assert accepted == 1
+
+    run(scenario)
+
+
+def test_repeated_callback_key_does_not_recalculate_twice(run):
+    async def scenario(sessions, loan_id, monthly_payment):
+        key = "cb:100:2"
+        amount = monthly_payment * 3
+        first = await accept_payment(key, loan_id, amount, recalculate=True, today=TODAY)
+        _, _, unpaid_after_first, _, _ = await _state(sessions, loan_id)
+        repeated = await accept_payment(key, loan_id, amount, recalculate=True, today=TODAY)
+
+        assert repeated.duplicate and repeated.remaining_amount == first.remaining_amount
+        loan, paid, unpaid, ledger, accepted = await _state(sessions, loan_id)
+        assert len(paid) == 1 and unpaid == unpaid_after_first
+        assert loan.total_paid == amount
+        assert len(ledger) == 1 and accepted == 1
+
+    run(scenario)
+
+
+def test_concurrent_payments_on_one_loan_are_serialized(run):
+    async def scenario(sessions, loan_id, monthly_payment):
+        outcomes = await asyncio.gather(*(
+            accept_payment(f"msg:100:{message_id}", loan_id, monthly_payment, today=TODAY)
+            for message_id in range(10, 14)
+        ))
+        assert not any(outcome.duplicate for outcome in outcomes)
+
+        loan, paid, unpaid, ledger, accepted = await _state(sessions, loan_id)
+        # Каждый прием видел результат предыдущего: разные платежи графика и цепочка остатков без пропусков
+        assert len(paid) == 4 and unpaid == TERM - 4
+        assert len({payment.payment_id for payment in paid}) == 4
+        assert loan.total_paid == monthly_payment * 4
+        assert loan.remaining_amount == AMOUNT - monthly_payment * 4
+        assert [entry.balance_after for entry in ledger] == [AMOUNT - monthly_payment * k for k in range(1, 5)]
+        assert sorted(outcome.remaining_amount for outcome in outcomes) == \
+               sorted(entry.balance_after for entry in ledger)
+        assert accepted == 4
+
+    run(scenario)
+
+
+def test_early_repayment_goes_through_acceptance(run):
+    async def scenario(sessions, loan_id, monthly_payment):
+        key = "msg:100:3"
+        amount = Decimal('20000.00')
+        first = await accept_early_repayment(key, loan_id, amount, shorten_term=True, today=TODAY)
+        repeated = await accept_early_repayment(key, loan_id, amount, shorten_term=True, today=TODAY)
+
+        # Срок сокращен, платеж сохранен
+        assert first.schedule is not None
+        assert len(first.schedule) < TERM
+        assert first.schedule.monthly_payment == monthly_payment
+        assert repeated.duplicate and repeated.schedule is None
+        assert repeated.remaining_amount == first.remaining_amount
+
+        loan, paid, unpaid, ledger, accepted = await _state(sessions, loan_id)
+        assert [payment.is_early_payment for payment in paid] == [True]
+        assert unpaid == len(first.schedule)
+        assert loan.total_paid == amount
+        assert loan.next_payment_date == first.schedule.first_date
+        assert [entry.entry_type for entry in ledger] == [ENTRY_EARLY_PAYMENT]
+        assert accepted == 1
+
+    run(scenario)
@@ -0,0 +1,91 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from dateutil.relativedelta import relativedelta
+
+from utils.schedule_engine import amortize, build_schedule, PaymentSchedule
+
+# (сумма, срок, годовая ставка, дата выдачи) - типы кредитов из utils.data_filler
+REFERENCE_LOANS = [
+    (Decimal('5000'), 3, 19.9, date(2025, 1, 15)),
+    (Decimal('100000'), 12, 19.9, date(2025, 3, 1)),
+    (Decimal('250000.55'), 36, 14.9, date(2024, 11, 20)),
+    (Decimal('2000000'), 60, 12.5, date(2025, 6, 10)),
+    (Decimal('333333.33'), 84, 8.9, date(2023, 2, 28)),
+    (Decimal('5000000'), 84, 10.9, date(2025, 12, 5)),
+]
+
+
+def float_payment(amount: Decimal, term: int, interest_rate: float) -> Decimal:
+    """Ежемесячный платеж по прежней формуле (float), округленный до копейки"""
+    monthly_rate = interest_rate / 100 / 12
+    annuity_coeff = (monthly_rate * (1 + monthly_rate) ** term) / ((1 + monthly_rate) ** term - 1)
+    return (amount * Decimal(annuity_coeff)).quantize(Decimal('0.01'))
+
+
+def float_dates(start_date: date, term: int) -> list[date]:
+    """Даты платежей по прежнему циклу: каждый следующий - через месяц от предыдущего"""
+    dates = []
+    payment_date = start_date + relativedelta(months=1)
+    for _ in range(term):
+        dates.append(payment_date)
+        payment_date += relativedelta(months=1)
+    return dates
+
+
+@pytest.fixture(scope="module")
+def schedules() -> list[PaymentSchedule]:
+    return [build_schedule(*loan) for loan in REFERENCE_LOANS]
+
+
+def test_rows_sum_to_principal_plus_interest(schedules):
+    for (amount, term, _, _), schedule in zip(REFERENCE_LOANS, schedules):
+        assert len(schedule) == term
+        assert sum(row.principal for row in schedule) == amount
+        assert schedule.total_amount == amount + schedule.total_interest
+        for row in schedule:
+            assert row.planned_amount == row.principal + row.interest
+
+
+def test_last_row_absorbs_remainder(schedules):
+    for schedule in schedules:
+        *regular, last = schedule.rows
+        assert all(row.planned_amount == schedule.monthly_payment for row in regular)
+        assert last.principal == regular[-1].balance
+        assert last.balance == Decimal('0.00')
+        # Остаток от округления - копейки, а не долг
+        assert abs(last.planned_amount - schedule.monthly_payment) <= Decimal('0.01') * len(schedule)
+
+
+def test_matches_float_path(schedules):
+    for (amount, term, interest_rate, start_date), schedule in zip(REFERENCE_LOANS, schedules):
+        assert schedule.monthly_payment == float_payment(amount, term, interest_rate)
+        if start_date.day <= 28:
+            assert [row.payment_date_plan for row in schedule] == float_dates(start_date, term)
+
+
+def test_month_end_dates_do_not_drift():
+    schedule = build_schedule(Decimal('10000'), 4, 10, date(2025, 1, 31))
+    assert [row.payment_date_plan for row in schedule] == [
+        date(2025, 2, 28), date(2025, 3, 31), date(2025, 4, 30), date(2025, 5, 31)
+    ]
+
+
+def test_batch_matches_single_schedules(schedules):
+    batch = amortize(*zip(*REFERENCE_LOANS))
+    assert len(batch) == len(REFERENCE_LOANS)
+    for index, schedule in enumerate(schedules):
+        assert PaymentSchedule.from_batch(batch, index) == schedule
+        assert batch.monthly_payment(index) == schedule.monthly_payment
+
+
+def test_zero_rate_splits_principal_evenly():
+    schedule = build_schedule(Decimal('1000'), 3, 0, date(2025, 1, 10))
+    assert [row.planned_amount for row in schedule] == [Decimal('333.33'), Decimal('333.33'), Decimal('333.34')]
+    assert schedule.total_interest == Decimal('0.00')
+
+
+def test_rejects_mismatched_inputs():
+    with pytest.raises(ValueError):
+        amortize([Decimal('1000')], [12, 24], [10], [date(2025, 1, 1)])
@@ -0,0 +1,136 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+
+from services.webhook import BoundedUpdateHandler, SECRET_HEADER
+
+SECRET = "webhook-secret"
+PATH = "/webhook"
+
+
+def message_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 1, "type": "private"},
+            "text": f"update {update_id}",
+        },
+    }
+
+
+class Recorder:
+    """Диспетчер, который записывает обработанные обновления и ждет release перед завершением"""
+    def __init__(self):
+        self.dispatcher = Dispatcher()
+        self.started: list[int] = []
+        self.processed: list[int] = []
+        self.release = asyncio.Event()
+        self.dispatcher.message.register(self.on_message)
+
+    async def on_message(self, message: Message):
+        self.started.append(message.message_id)
+        await self.release.wait()
+        self.processed.append(message.message_id)
+
+
+async def _with_client(scenario, max_concurrency: int = 8):
+    recorder = Recorder()
+    bot = Bot("42:TEST")
+    handler = BoundedUpdateHandler(recorder.dispatcher, bot, secret_token=SECRET, max_concurrency=max_concurrency)
+    app = web.Application()
+    handler.register(app, PATH, drain_timeout=5)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        return await scenario(client, handler, recorder)
+    finally:
+        recorder.release.set()
+        await client.close()
+        await bot.session.close()
+
+
+def post(client: TestClient, body, secret: str = SECRET):
+    kwargs = {"json": body} if not isinstance(body, str) else {"data": body}
+    return client.post(PATH, headers={SECRET_HEADER: secret}, **kwargs)
+
+
+async def _wait_for(condition, timeout: float = 2):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+def test_wrong_secret_is_rejected():
+    async def scenario(client, handler, recorder):
+        response = await post(client, message_update(1), secret="wrong")
+        assert response.status == 401
+        assert handler.in_flight == 0
+        assert recorder.started == []
+
+    asyncio.run(_with_client(scenario))
+
+
+def test_malformed_body_is_rejected():
+    async def scenario(client, handler, recorder):
+        for body in ("not json", {"message": {"text": "без update_id"}}):
+            response = await post(client, body)
+            assert response.status == 400
+        assert handler.in_flight == 0
+        assert recorder.started == []
+
+    asyncio.run(_with_client(scenario))
+
+
+def test_valid_update_is_dispatched():
+    async def scenario(client, handler, recorder):
+        recorder.release.set()
+        response = await post(client, message_update(1))
+        assert response.status == 200
+        await _wait_for(lambda: recorder.processed == [1])
+        await _wait_for(lambda: handler.in_flight == 0)
+
+    asyncio.run(_with_client(scenario))
+
+
+def test_concurrency_limit_holds_requests_until_a_slot_frees():
+    async def scenario(client, handler, recorder):
+        first = await post(client, message_update(1))
+        assert first.status == 200
+        await _wait_for(lambda: recorder.started == [1])
+
+        # Слот занят первым обновлением - второй запрос ждет и не отвечает Telegram
+        second = asyncio.create_task(post(client, message_update(2)))
+        await asyncio.sleep(0.1)
+        assert not second.done()
+        assert handler.in_flight == 1
+
+        recorder.release.set()
+        assert (await second).status == 200
+        await handler.drain(timeout=2)
+        assert recorder.processed == [1, 2]
+        assert handler.in_flight == 0
+
+    asyncio.run(_with_client(scenario, max_concurrency=1))
+
+
+def test_drain_cancels_updates_after_timeout():
+    async def scenario(client, handler, recorder):
+        for update_id in (1, 2):
+            assert (await post(client, message_update(update_id))).status == 200
+        await _wait_for(lambda: len(recorder.started) == 2)
+
+        await handler.drain(timeout=0.05)
+        await _wait_for(lambda: handler.in_flight == 0)
+        assert recorder.processed == []
+
+        # Отмененные обновления вернули слоты семафора
+        recorder.release.set()
+        assert (await post(client, message_update(3))).status == 200
+        await _wait_for(lambda: recorder.processed == [3])
+
+    asyncio.run(_with_client(scenario, max_concurrency=2))
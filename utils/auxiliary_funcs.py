@@ -7,6 +7,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from models.user import Loan, Payment, Client
 from models.base import LoanStatus
+from utils.client_cache import client_cache
 from typing import Optional
 from aiogram import types
 
@@ -54,46 +55,21 @@ async def get_client_by_telegram(session, telegram_id: int) -> Optional[Client]:
     )
 
 async def check_client_registered(message: types.Message, session) -> Optional[Client]:
-    """Проверяет регистрацию клиента и возвращает его, если он зарегистрирован"""
+    """
+    Проверяет регистрацию клиента и возвращает его, если он зарегистрирован.
+    Из кеша возвращается отсоединенная копия (только для чтения, см. utils.client_cache).
+    """
+    client = client_cache.get(message.from_user.id)
+    if client:
+        return client
+
     client = await get_client_by_telegram(session, message.from_user.id)
     if not client:
         await message.answer("ℹ Вы не зарегистрированы. Используйте /register")
         return None
+    client_cache.put(client)
     return client
 
-async def update_payment_and_loan(session, payment, loan, amount, payment_date, loan_id):
-    """Обновляет платеж и данные кредита"""
-    try:
-        # Обновляем данные платежа
-        payment.payment_date_fact = payment_date
-        payment.actual_amount = float(amount)
-
-        # Обновляем остаток по кредиту
-        loan.remaining_amount -= Decimal(str(amount))
-
-        # Находим следующий платеж
-        next_payment = await session.scalar(
-            select(Payment)
-            .where(Payment.loan_id == loan_id)
-            .where(Payment.payment_date_fact.is_(None))
-            .order_by(Payment.payment_date_plan.asc())
-            .limit(1)
-        )
-
-        # Обновляем дату следующего платежа
-        loan.next_payment_date = next_payment.payment_date_plan if next_payment else None
-
-        # Если кредит полностью погашен
-        if loan.remaining_amount <= 0:
-            loan.status = "CLOSE"
-            loan.next_payment_date = None
-
-        await session.commit()
-
-    except Exception as e:
-        logging.error(f"Ошибка при обновлении платежа и кредита: {e}", exc_info=True)
-        raise
-
 async def show_payment_schedule(message: Message, loan_id: int, session: AsyncSession):
     """Выводит график платежей по кредиту"""
     try:
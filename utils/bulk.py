@@ -0,0 +1,57 @@
+"""
+Массовая вставка строк: один INSERT ... VALUES (...), (...) на пачку
+или COPY через asyncpg для больших объемов.
+"""
+from typing import Sequence
+from sqlalchemy import Table, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Ограничение PostgreSQL - 32767 параметров на запрос
+MAX_PARAMS_PER_STATEMENT = 30000
+
+# С какого количества строк выгоднее COPY, чем multi-VALUES
+COPY_MIN_ROWS = 500
+
+
+async def copy_records(session: AsyncSession, table: Table, columns: Sequence[str], records: Sequence[tuple]) -> int:
+    """
+    Загрузка кортежей через asyncpg copy_records_to_table в транзакции сессии.
+    Значения по умолчанию SQLAlchemy (default=...) при COPY не применяются -
+    все колонки кроме серверных должны быть переданы явно.
+    """
+    connection = await session.connection()
+    raw = await connection.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        table.name,
+        records=records,
+        columns=list(columns),
+        schema_name=table.schema
+    )
+    return len(records)
+
+
+async def bulk_insert(session: AsyncSession, table: Table, rows: Sequence[dict], use_copy: bool | None = None) -> int:
+    """
+    Вставляет строки минимальным числом обращений к БД.
+
+    :param session: сессия БД (коммит за вызывающим кодом)
+    :param table: таблица (Model.__table__)
+    :param rows: словари с одинаковым набором ключей
+    :param use_copy: принудительно включить/выключить COPY; по умолчанию - для
+                     asyncpg при количестве строк от COPY_MIN_ROWS
+    :return: количество вставленных строк
+    """
+    if not rows:
+        return 0
+
+    columns = list(rows[0])
+    if use_copy is None:
+        use_copy = session.bind.dialect.driver == "asyncpg" and len(rows) >= COPY_MIN_ROWS
+
+    if use_copy:
+        return await copy_records(session, table, columns, [tuple(row[c] for c in columns) for row in rows])
+
+    chunk_size = max(1, MAX_PARAMS_PER_STATEMENT // len(columns))
+    for start in range(0, len(rows), chunk_size):
+        await session.execute(insert(table).values(list(rows[start:start + chunk_size])))
+    return len(rows)
@@ -1,10 +1,15 @@
 from models.user import Client, Loan, Payment, CreditHistory
 from models.base import LoanType, LoanStatus
+from dataclasses import dataclass
 from datetime import date,datetime, timedelta
-from decimal import Decimal,getcontext
+from decimal import Decimal
 from sqlalchemy import select
 from dateutil.relativedelta import relativedelta
 from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from utils.bulk import bulk_insert
+from utils.loan_type_catalog import loan_type_catalog
+from utils.schedule_engine import annuity_payment, build_schedule, PaymentSchedule
 
 
 async def calculate_max_loan_amount(client_id: int, session) -> Decimal:
@@ -21,88 +26,42 @@ async def calculate_max_loan_amount(client_id: int, session) -> Decimal:
         return Decimal('50000')
 
 def calculate_monthly_payment(amount: Decimal, term: int, interest_rate: float) -> Decimal:
-    """Рассчитывает ежемесячный платеж"""
-    getcontext().prec = 10
-    monthly_rate = interest_rate / 100 / 12
-    annuity_coeff = ((monthly_rate * (1 + monthly_rate)**term)/((1 + monthly_rate)**term - 1))
-    return amount * Decimal(annuity_coeff)
-
-async def generate_payment_schedule(
-    loan_id: int,
-    amount: Decimal,
-    term: int,
-    interest_rate: float,
-    start_date: date = None,
-    session: AsyncSession = None
-) -> list[Payment]:
+    """Рассчитывает ежемесячный платеж (с точностью до копейки)"""
+    return annuity_payment(amount, term, interest_rate)
+
+def schedule_to_rows(schedule: PaymentSchedule, loan_id: int) -> list[dict]:
+    """Строки таблицы payments для массовой вставки графика"""
+    return [
+        {
+            'loan_id': loan_id,
+            'payment_date_plan': row.payment_date_plan,
+            'planned_amount': row.planned_amount,
+            'payment_date_fact': None,
+            'actual_amount': None,
+            'penalty_date': None,
+            'penalty_amount': None,
+            'is_early_payment': False
+        }
+        for row in schedule
+    ]
+
+async def save_schedule(session: AsyncSession, loan_id: int, schedule: PaymentSchedule) -> int:
     """
-    Генерация графика платежей по аннуитетному кредиту с корректной начальной датой.
+    Сохраняет рассчитанный график платежей одним INSERT (или COPY для больших графиков),
+    без создания ORM-объектов. Коммит остается за вызывающим кодом.
 
-    :param loan_id: ID кредита
-    :param amount: Сумма кредита
-    :param term: Срок в месяцах
-    :param interest_rate: Годовая процентная ставка
-    :param start_date: (опционально) дата начала нового графика
     :param session: сессия БД
-    :return: список новых платежей
+    :param loan_id: ID кредита
+    :param schedule: график из build_schedule / build_shortened_schedule
+    :return: количество сохраненных платежей
     """
-    getcontext().prec = 10
-    monthly_rate = Decimal(interest_rate) / Decimal(100) / Decimal(12)
-    monthly_payment = calculate_monthly_payment(amount, term, interest_rate)
-
-    # Определим start_date: от последнего платежа или сегодняшнего дня
-    if not start_date:
-        # Ищем последний плановый платеж
-        last_payment = await session.scalar(
-            select(Payment)
-            .where(Payment.loan_id == loan_id)
-            .order_by(Payment.payment_date_plan.desc())
-            .limit(1)
-        )
-        if last_payment:
-            start_date = last_payment.payment_date_plan
-        else:
-            # Фолбэк — сегодня
-            start_date = date.today()
-
-    # Начнём с даты следующего месяца после start_date
-    payment_date = start_date + relativedelta(months=1)
-    remaining_balance = amount
-    payments = []
-
-    for month in range(1, term + 1):
-        interest_payment = remaining_balance * monthly_rate
-        principal_payment = monthly_payment - interest_payment
-        remaining_balance -= principal_payment
-
-        # Корректировка последнего платежа
-        if month == term:
-            principal_payment += remaining_balance
-            remaining_balance = Decimal(0)
-
-        payment = Payment(
-            loan_id=loan_id,
-            payment_date_plan=payment_date,
-            planned_amount=float(monthly_payment),
-            payment_date_fact=None,
-            actual_amount=None,
-            penalty_date=None,
-            penalty_amount=None
-        )
-
-        payments.append(payment)
-        session.add(payment)
-
-        # Следующая дата
-        payment_date += relativedelta(months=1)
-
-    await session.commit()
-    return payments
+    return await bulk_insert(session, Payment.__table__, schedule_to_rows(schedule, loan_id))
 
 async def calculate_next_payment_details(loan: Loan, session: AsyncSession) -> tuple[date, Decimal]:
     """Рассчитывает дату и сумму следующего платежа"""
-    # Получаем тип кредита, чтобы взять процентную ставку
-    loan_type = await session.get(LoanType, loan.loan_type_id)
+    # Тип кредита (для процентной ставки) - из справочника в памяти
+    await loan_type_catalog.ensure_fresh()
+    loan_type = loan_type_catalog.get(loan.loan_type_id)
     if not loan_type:
         raise ValueError("Тип кредита не найден")
 
@@ -163,55 +122,63 @@ async def calculate_next_payment_date_after_payment(loan: Loan, session: AsyncSe
     # Если все платежи завершены, возвращаем None
     return None
 
-async def generate_shortened_schedule(
-    loan: Loan,
-    monthly_payment: Decimal,
-    start_date: date,
-    session: AsyncSession
-) -> list[Payment]:
+@dataclass(frozen=True, slots=True)
+class LoanPaymentSnapshot:
     """
-    Генерация нового графика платежей после досрочного погашения
-    с сохранением размера платежа и сокращением срока кредита.
-    
-    :param loan: Объект кредита
-    :param monthly_payment: Размер ежемесячного платежа
-    :param start_date: Дата начала новых платежей
-    :param session: Сессия БД
-    :return: Список новых платежей
+    Состояние платежей по кредиту, собранное за один упорядоченный проход.
+        loan                кредит
+        payments            все платежи по дате плана
+        next_payment        первый неоплаченный платеж
+        overdue             неоплаченные платежи с плановой датой раньше today
     """
-    getcontext().prec = 10
-    monthly_rate = Decimal(loan.loan_type.interest_rate) / Decimal(100) / Decimal(12)
-    
+    loan: Loan
+    payments: tuple
+    next_payment: Optional[Payment]
+    overdue: tuple
+
+async def fetch_loan_snapshot(session: AsyncSession, loan_id: int, today: date) -> Optional[LoanPaymentSnapshot]:
+    """Загружает кредит и все его платежи одним запросом (LEFT JOIN) и раскладывает их"""
+    rows = await session.execute(
+        select(Loan, Payment)
+        .outerjoin(Payment, Payment.loan_id == Loan.loan_id)
+        .where(Loan.loan_id == loan_id)
+        .order_by(Payment.payment_date_plan.asc(), Payment.payment_id.asc())
+    )
+
+    loan = None
     payments = []
-    remaining_balance = loan.remaining_amount
-    payment_date = start_date + relativedelta(months=1)
-
-    while remaining_balance > 0:
-        interest_payment = remaining_balance * monthly_rate
-        principal_payment = monthly_payment - interest_payment
-
-        if principal_payment <= 0:
-            raise ValueError("Размер ежемесячного платежа слишком мал для погашения кредита.")
-
-        if principal_payment >= remaining_balance:
-            principal_payment = remaining_balance
-            monthly_total_payment = principal_payment + interest_payment
-        else:
-            monthly_total_payment = monthly_payment
-
-        payment = Payment(
-            loan_id=loan.loan_id,
-            payment_date_plan=payment_date,
-            planned_amount=float(monthly_total_payment),
-            payment_date_fact=None,
-            actual_amount=None
-        )
+    overdue = []
+    next_payment = None
+
+    for row_loan, payment in rows:
+        loan = row_loan
+        if payment is None:
+            continue
         payments.append(payment)
 
-        remaining_balance -= principal_payment
-        payment_date += relativedelta(months=1)
+        if payment.payment_date_fact is None:
+            if next_payment is None:
+                next_payment = payment
+            if payment.payment_date_plan < today:
+                overdue.append(payment)
 
-    session.add_all(payments)
-    await session.flush()  # Только фиксируем в сессии, коммит позже с другими изменениями
+    if loan is None:
+        return None
 
-    return payments
+    return LoanPaymentSnapshot(
+        loan=loan,
+        payments=tuple(payments),
+        next_payment=next_payment,
+        overdue=tuple(overdue)
+    )
+
+def amount_due(payment: Payment) -> Decimal:
+    """Сумма к внесению по неоплаченному платежу: плановая сумма и начисленная по нему пеня"""
+    return Decimal(str(payment.planned_amount)) + Decimal(str(payment.penalty_amount or 0))
+
+def snapshot_penalty(snapshot: LoanPaymentSnapshot) -> Decimal:
+    """
+    Сумма пени, начисленной по просроченным платежам снимка.
+    Пеня хранится на самих платежах (penalty_amount) - ее записывает services.penalty_accrual.
+    """
+    return sum((Decimal(str(payment.penalty_amount or 0)) for payment in snapshot.overdue), Decimal('0'))
@@ -0,0 +1,98 @@
+"""
+Кеш "telegram_id -> клиент" для check_client_registered.
+
+Хранятся снимки колонок Client (без связей). При попадании возвращается
+отсоединенная копия - в сессию она не попадает, поэтому session.get(Client)
+в том же обработчике по-прежнему читает строку из БД. Снимок может отставать
+от БД на CLIENT_CACHE_TTL, поэтому объект только читается: решения по
+рейтингу принимаются по данным из БД, изменения клиента пишутся через UPDATE
+(рейтинг - выражением в SQL), после чего запись кеша сбрасывается.
+"""
+import time
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy.orm import make_transient_to_detached
+
+from config import Config
+from models.user import Client
+
+
+class ClientCache:
+    """LRU-кеш снимков клиентов с ограничением времени жизни записи"""
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+        self._telegram_by_client: dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _snapshot(client: Client) -> dict:
+        snapshot = {attr.key: getattr(client, attr.key) for attr in Client.__mapper__.column_attrs}
+        snapshot['phone_numbers'] = list(snapshot['phone_numbers'] or [])
+        return snapshot
+
+    def _pop(self, telegram_id: int):
+        entry = self._entries.pop(telegram_id, None)
+        if entry:
+            self._telegram_by_client.pop(entry[1]['clientID'], None)
+
+    def get(self, telegram_id: int) -> Optional[Client]:
+        """Возвращает отсоединенную копию клиента или None при промахе"""
+        entry = self._entries.get(telegram_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._pop(telegram_id)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+
+        client = Client(**entry[1])
+        client.phone_numbers = list(client.phone_numbers)
+        make_transient_to_detached(client)
+        return client
+
+    def put(self, client: Client):
+        """Сохраняет снимок клиента (после загрузки из БД)"""
+        if client.telegram_id is None:
+            return
+        self._pop(client.telegram_id)
+        self._entries[client.telegram_id] = (time.monotonic() + self.ttl, self._snapshot(client))
+        self._telegram_by_client[client.clientID] = client.telegram_id
+
+        while len(self._entries) > self.max_size:
+            _, (_, snapshot) = self._entries.popitem(last=False)
+            self._telegram_by_client.pop(snapshot['clientID'], None)
+            self.evictions += 1
+
+    def invalidate(self, telegram_id: int):
+        """Сбрасывает запись по telegram_id (регистрация, смена контактов)"""
+        self._pop(telegram_id)
+
+    def invalidate_client(self, client_id: int):
+        """Сбрасывает запись по внутреннему ID клиента (изменения из админки)"""
+        telegram_id = self._telegram_by_client.get(client_id)
+        if telegram_id is not None:
+            self._pop(telegram_id)
+
+    def clear(self):
+        self._entries.clear()
+        self._telegram_by_client.clear()
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+client_cache = ClientCache(Config.CLIENT_CACHE_SIZE, Config.CLIENT_CACHE_TTL)
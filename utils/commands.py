@@ -19,8 +19,9 @@ async def set_bot_commands(bot, user_id=None):  # Переименовали ф
     ]
 
     if user_id in Config.ADMINS:
-        commands.append(
-            BotCommand(command="admin", description="Админ-панель")
-        )
+        commands.extend([
+            BotCommand(command="admin", description="Админ-панель"),
+            BotCommand(command="perf", description="Замеры обработчиков")
+        ])
 
     await bot.set_my_commands(commands)
\ No newline at end of file
@@ -2,8 +2,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from models.base import LoanType  
 
-async def add_default_loan_types(session: AsyncSession):
-    """Заполнение таблицы стандартными типами кредитов."""
+async def add_default_loan_types(session: AsyncSession) -> int:
+    """
+    Заполнение таблицы стандартными типами кредитов (коммит за вызывающим кодом).
+    Возвращает количество добавленных типов: если оно не нулевое, после коммита
+    нужно сбросить справочник (loan_type_catalog.invalidate()).
+    """
     default_loan_types = [
         {
             "type_id": 1,
@@ -57,12 +61,16 @@ async def add_default_loan_types(session: AsyncSession):
         }
     ]
 
-    existing_types = await session.execute(select(LoanType.name))
-    existing_names = {name[0] for name in existing_types}
+    existing_types = (await session.execute(select(LoanType.type_id, LoanType.name))).all()
+    existing_ids = {type_id for type_id, _ in existing_types}
+    existing_names = {name for _, name in existing_types}
 
+    added = 0
     for loan_type_data in default_loan_types:
-        if loan_type_data["name"] not in existing_names:
+        if loan_type_data["type_id"] not in existing_ids and loan_type_data["name"] not in existing_names:
             loan_type = LoanType(**loan_type_data)
             session.add(loan_type)
-    
-    await session.commit()
\ No newline at end of file
+            added += 1
+
+    await session.flush()
+    return added
\ No newline at end of file
@@ -0,0 +1,406 @@
+"""
+Генератор синтетического портфеля для нагрузочных замеров и проверки отчетов.
+
+Создает клиентов, кредиты с реалистичным распределением типов, сумм и сроков,
+графики платежей с заданными долями кредитов, оплачиваемых вовремя, с
+опозданиями и с пропусками, записи журнала долга и кредитной истории.
+Строки загружаются пачками через COPY (asyncpg; на других драйверах -
+массовым INSERT), идентификаторы выдаются генератором, после загрузки
+сдвигаются последовательности и перестраивается сводка портфеля.
+
+Доли --on-time/--late/--missed - это профили кредитов:
+    on-time     все наступившие платежи внесены в срок
+    late        примерно половина наступивших платежей внесена с опозданием до 30 дней (с пеней)
+    missed      после нескольких платежей клиент перестает платить
+Пеня по неоплаченным платежам не начисляется - портфель выглядит так, будто
+начисление еще не запускалось (его первый прогон и есть замер).
+
+Запускать на отдельной БД при остановленном боте:
+
+    python -m utils.data_generator --clients 100000
+    python -m utils.data_generator --clients 20000 --loans-per-client 2 --missed 0.15 --seed 42
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import select, func, text, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.base import LoanType, LoanStatus, BankName
+from models.user import Client, Loan, Payment, LoanLedgerEntry, CreditHistory
+from services.loan_ledger import ENTRY_ISSUE, ENTRY_PAYMENT
+from services.penalty_accrual import PENALTY_RATE
+from services.portfolio_rollup import rebuild_portfolio_rollup
+from utils.bulk import bulk_insert, copy_records
+from utils.data_filler import add_default_loan_types
+from utils.loan_type_catalog import loan_type_catalog
+from utils.schedule_engine import amortize, from_cents, to_cents
+
+CLIENT_COLUMNS = ('clientID', 'fullName', 'passport', 'telegram_id', 'phone_numbers', 'email',
+                  'registration_date', 'creditScore')
+LOAN_COLUMNS = ('loan_id', 'client_id', 'loan_type_id', 'issue_date', 'amount', 'term', 'status',
+                'total_paid', 'remaining_amount', 'next_payment_date')
+PAYMENT_COLUMNS = ('payment_id', 'loan_id', 'payment_date_plan', 'planned_amount', 'payment_date_fact',
+                   'actual_amount', 'penalty_date', 'penalty_amount', 'is_early_payment')
+LEDGER_COLUMNS = ('entry_id', 'loan_id', 'payment_id', 'entry_type', 'amount', 'balance_after', 'created_at')
+HISTORY_COLUMNS = ('LoanHistID', 'loanID', 'bankID', 'fullname', 'passport', 'status', 'issue_date',
+                   'amount', 'term', 'interest_rate')
+
+# Порядок загрузки - по внешним ключам
+TABLES = (
+    (Client.__table__, CLIENT_COLUMNS),
+    (Loan.__table__, LOAN_COLUMNS),
+    (Payment.__table__, PAYMENT_COLUMNS),
+    (LoanLedgerEntry.__table__, LEDGER_COLUMNS),
+    (CreditHistory.__table__, HISTORY_COLUMNS),
+)
+
+# Колонки с идентификаторами, которые выдает генератор (таблица -> колонка)
+ID_COLUMNS = {
+    'clients': 'clientID',
+    'loans': 'loan_id',
+    'payments': 'payment_id',
+    'loan_ledger': 'entry_id',
+    'credit_history': 'LoanHistID',
+}
+
+DEFAULT_BANKS = ("Сбербанк", "ВТБ", "Альфа-Банк", "Т-Банк", "Газпромбанк")
+LAST_NAMES = ("Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов",
+              "Новиков", "Федоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семенов", "Егоров")
+FIRST_NAMES = ("Александр", "Дмитрий", "Максим", "Сергей", "Андрей", "Алексей", "Артем", "Илья",
+               "Кирилл", "Михаил", "Никита", "Матвей", "Роман", "Егор", "Арсений", "Иван")
+MIDDLE_NAMES = ("Александрович", "Дмитриевич", "Сергеевич", "Андреевич", "Алексеевич", "Иванович",
+                "Михайлович", "Николаевич", "Петрович", "Владимирович")
+TERMS = (3, 6, 9, 12, 18, 24, 36, 48, 60, 72, 84)
+
+
+@dataclass(frozen=True, slots=True)
+class GeneratorOptions:
+    clients: int
+    loans_per_client: float = 1.3
+    history_per_client: float = 1.5
+    years: int = 3
+    on_time: float = 0.8
+    late: float = 0.15
+    missed: float = 0.05
+    batch_size: int = 5000
+    seed: int | None = None
+    today: date = field(default_factory=date.today)
+
+
+@dataclass(slots=True)
+class GeneratedCounts:
+    clients: int = 0
+    loans: int = 0
+    payments: int = 0
+    ledger: int = 0
+    history: int = 0
+
+    @property
+    def rows(self) -> int:
+        return self.clients + self.loans + self.payments + self.ledger + self.history
+
+
+@dataclass(frozen=True, slots=True)
+class _LoanTypeParams:
+    type_id: int
+    interest_rate: Decimal
+    min_amount: float
+    max_amount: float
+    terms: tuple[int, ...]
+    term_weights: tuple[float, ...]
+
+
+class PortfolioGenerator:
+    """Построение строк пачками; идентификаторы продолжают уже существующие в БД"""
+    def __init__(self, options: GeneratorOptions, loan_types: list[LoanType], bank_ids: list[int],
+                 next_ids: dict[str, int], json_as_text: bool):
+        self.options = options
+        self.rng = random.Random(options.seed)
+        self.bank_ids = bank_ids
+        self.next_ids = dict(next_ids)
+        self.json_as_text = json_as_text
+        self.loan_types = [self._type_params(loan_type) for loan_type in loan_types]
+
+        total = options.on_time + options.late + options.missed
+        self.profile_bounds = (options.on_time / total, (options.on_time + options.late) / total)
+        self.first_issue = options.today - timedelta(days=365 * options.years)
+
+    @staticmethod
+    def _type_params(loan_type: LoanType) -> _LoanTypeParams:
+        terms = tuple(term for term in TERMS if loan_type.min_term <= term <= loan_type.max_term) or (loan_type.min_term,)
+        return _LoanTypeParams(
+            type_id=loan_type.type_id,
+            interest_rate=Decimal(str(loan_type.interest_rate)),
+            min_amount=float(loan_type.min_amount),
+            max_amount=float(loan_type.max_amount),
+            terms=terms,
+            # Короткие сроки встречаются чаще длинных
+            term_weights=tuple(1 / (index + 1) for index in range(len(terms)))
+        )
+
+    def _take_id(self, table: str) -> int:
+        value = self.next_ids[table]
+        self.next_ids[table] = value + 1
+        return value
+
+    def _count(self, average: float) -> int:
+        whole = int(average)
+        return whole + (self.rng.random() < average - whole)
+
+    def _amount(self, loan_type: _LoanTypeParams) -> Decimal:
+        """Сумма кредита: логарифмически равномерно в границах типа, кратно 1000"""
+        low, high = math.log(loan_type.min_amount), math.log(loan_type.max_amount)
+        value = round(math.exp(self.rng.uniform(low, high)) / 1000) * 1000
+        return Decimal(min(max(value, loan_type.min_amount), loan_type.max_amount))
+
+    def batch(self, clients: int) -> dict[str, list[tuple]]:
+        """Строки всех таблиц для очередной пачки клиентов"""
+        rng = self.rng
+        today = self.options.today
+        rows = {table.name: [] for table, _ in TABLES}
+
+        loans = []
+        for _ in range(clients):
+            client_id = self._take_id('clients')
+            full_name = f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(MIDDLE_NAMES)}"
+            passport = f"{client_id:010d}"
+            phones = [f"+7900{client_id % 10_000_000:07d}"]
+            registered = datetime.combine(self.first_issue, datetime.min.time()) + timedelta(
+                seconds=rng.randrange(int((today - self.first_issue).total_seconds()) or 1)
+            )
+            rows['clients'].append((
+                client_id, full_name, passport, None,
+                json.dumps(phones) if self.json_as_text else phones,
+                f"client{client_id}@example.com", registered, rng.randint(300, 900)
+            ))
+
+            for _ in range(self._count(self.options.loans_per_client)):
+                loan_type = rng.choice(self.loan_types)
+                issued = registered + timedelta(seconds=rng.randrange(
+                    max(1, int((datetime.combine(today, datetime.min.time()) - registered).total_seconds()))
+                ))
+                loans.append((
+                    self._take_id('loans'), client_id, loan_type, issued, self._amount(loan_type),
+                    rng.choices(loan_type.terms, loan_type.term_weights)[0]
+                ))
+
+            for _ in range(self._count(self.options.history_per_client)):
+                rows['credit_history'].append((
+                    self._take_id('credit_history'), rng.randint(1, 10_000_000), rng.choice(self.bank_ids),
+                    full_name, int(passport), rng.choices(('CLOSED', 'ACTIVE', 'OVERDUE'), (70, 20, 10))[0],
+                    self.first_issue - timedelta(days=rng.randint(0, 3650)),
+                    Decimal(rng.randint(10, 3000) * 1000), rng.choice(TERMS), Decimal(rng.randint(70, 300)) / 10
+                ))
+
+        schedules = amortize(
+            [loan[4] for loan in loans],
+            [loan[5] for loan in loans],
+            [loan[2].interest_rate for loan in loans],
+            [loan[3].date() for loan in loans]
+        )
+        for index, loan in enumerate(loans):
+            self._loan_rows(rows, loan, schedules, index, today)
+        return rows
+
+    def _loan_rows(self, rows: dict, loan: tuple, schedules, index: int, today: date):
+        rng = self.rng
+        loan_id, client_id, loan_type, issued, amount, term = loan
+        profile = rng.random()
+        late = self.profile_bounds[0] <= profile < self.profile_bounds[1]
+        # Для профиля missed - сколько наступивших платежей клиент успевает внести
+        stop_after = rng.randint(0, max(term - 1, 0)) if profile >= self.profile_bounds[1] else term
+
+        remaining = to_cents(amount)
+        paid_total = 0
+        next_payment_date = None
+        rows['loan_ledger'].append((self._take_id('loan_ledger'), loan_id, None, ENTRY_ISSUE, amount, amount, issued))
+
+        for number, row in enumerate(schedules.bounds(index)):
+            plan_date = schedules.due_date[row]
+            planned = schedules.payment[row]
+            payment_id = self._take_id('payments')
+            fact_date = None
+            if plan_date <= today and number < stop_after:
+                delay = rng.randint(1, 30) if late and rng.random() < 0.5 else 0
+                if plan_date + timedelta(days=delay) <= today:
+                    fact_date = plan_date + timedelta(days=delay)
+
+            if fact_date is None:
+                if next_payment_date is None:
+                    next_payment_date = plan_date
+                rows['payments'].append((payment_id, loan_id, plan_date, from_cents(planned),
+                                         None, None, None, None, False))
+                continue
+
+            # Как при приеме платежа: сумма сверх остатка не зачисляется, на нуле кредит закрывается
+            actual = min(planned, remaining)
+            remaining -= actual
+            paid_total += actual
+            delay = (fact_date - plan_date).days
+            rows['payments'].append((
+                payment_id, loan_id, plan_date, from_cents(planned), fact_date, from_cents(actual),
+                fact_date if delay else None,
+                (from_cents(planned) * PENALTY_RATE * delay).quantize(Decimal('0.01')) if delay else None,
+                False
+            ))
+            rows['loan_ledger'].append((
+                self._take_id('loan_ledger'), loan_id, payment_id, ENTRY_PAYMENT, from_cents(actual),
+                from_cents(remaining), datetime.combine(fact_date, datetime.min.time())
+            ))
+            if remaining == 0:
+                next_payment_date = None
+                break
+
+        rows['loans'].append((
+            loan_id, client_id, loan_type.type_id, issued, amount, term,
+            LoanStatus.CLOSED.name if remaining == 0 else LoanStatus.ACTIVE.name,
+            from_cents(paid_total), from_cents(remaining), next_payment_date
+        ))
+
+
+async def _load(session: AsyncSession, rows: dict[str, list[tuple]], use_copy: bool):
+    for table, columns in TABLES:
+        records = rows[table.name]
+        if not records:
+            continue
+        if use_copy:
+            await copy_records(session, table, columns, records)
+        else:
+            await bulk_insert(session, table, [dict(zip(columns, record)) for record in records], use_copy=False)
+
+
+async def _next_ids(session: AsyncSession) -> dict[str, int]:
+    next_ids = {}
+    for table_name, column in ID_COLUMNS.items():
+        table = next(table for table, _ in TABLES if table.name == table_name)
+        next_ids[table_name] = (await session.scalar(select(func.max(table.c[column])))) or 0
+        next_ids[table_name] += 1
+    return next_ids
+
+
+async def _ensure_banks(session: AsyncSession) -> list[int]:
+    bank_ids = (await session.scalars(select(BankName.bankID).order_by(BankName.bankID))).all()
+    if bank_ids:
+        return list(bank_ids)
+    await session.execute(insert(BankName).values([
+        {'bankID': index, 'name': name} for index, name in enumerate(DEFAULT_BANKS, start=1)
+    ]))
+    return list(range(1, len(DEFAULT_BANKS) + 1))
+
+
+async def _sync_sequences(session: AsyncSession):
+    """Сдвигает последовательности PostgreSQL за выданные генератором идентификаторы"""
+    for table_name, column in ID_COLUMNS.items():
+        await session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table_name}\"', '{column}'), "
+            f"(SELECT COALESCE(MAX(\"{column}\"), 0) + 1 FROM \"{table_name}\"), false)"
+        ))
+
+
+async def generate_portfolio(session: AsyncSession, options: GeneratorOptions, rebuild_rollup: bool = True) -> GeneratedCounts:
+    """
+    Генерирует портфель пачками по options.batch_size клиентов, каждая пачка - отдельная транзакция.
+
+    :param session: сессия БД (коммиты выполняются здесь)
+    :param options: параметры генерации
+    :param rebuild_rollup: перестроить сводку портфеля после загрузки
+    :return: количество строк по таблицам
+    """
+    dialect = session.bind.dialect
+    use_copy = dialect.driver == "asyncpg"
+
+    types_added = await add_default_loan_types(session)
+    loan_types = (await session.scalars(select(LoanType).order_by(LoanType.type_id))).all()
+    bank_ids = await _ensure_banks(session)
+    generator = PortfolioGenerator(options, list(loan_types), bank_ids, await _next_ids(session), json_as_text=use_copy)
+    await session.commit()
+    if types_added:
+        loan_type_catalog.invalidate()
+
+    counts = GeneratedCounts()
+    started = time.perf_counter()
+    for offset in range(0, options.clients, options.batch_size):
+        rows = generator.batch(min(options.batch_size, options.clients - offset))
+        await _load(session, rows, use_copy)
+        await session.commit()
+
+        counts.clients += len(rows['clients'])
+        counts.loans += len(rows['loans'])
+        counts.payments += len(rows['payments'])
+        counts.ledger += len(rows['loan_ledger'])
+        counts.history += len(rows['credit_history'])
+        elapsed = time.perf_counter() - started
+        logging.info(
+            f"Клиентов {counts.clients}/{options.clients}, кредитов {counts.loans}, платежей {counts.payments} "
+            f"({counts.rows / elapsed:,.0f} строк/с)"
+        )
+
+    if dialect.name == "postgresql":
+        await _sync_sequences(session)
+        await session.commit()
+        # Свежая статистика для планировщика - иначе первые отчеты пойдут по старым оценкам
+        async with session.bind.connect() as conn:
+            await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for table_name in ID_COLUMNS:
+                await conn.execute(text(f'ANALYZE "{table_name}"'))
+
+    if rebuild_rollup:
+        await rebuild_portfolio_rollup(session, options.today)
+        await session.commit()
+    return counts
+
+
+async def _main():
+    from utils.database import async_session, engine, init_db
+
+    parser = argparse.ArgumentParser(description="Генерация синтетического портфеля")
+    parser.add_argument("--clients", type=int, required=True, help="количество клиентов")
+    parser.add_argument("--loans-per-client", type=float, default=1.3, help="кредитов на клиента в среднем")
+    parser.add_argument("--history-per-client", type=float, default=1.5, help="записей кредитной истории на клиента")
+    parser.add_argument("--years", type=int, default=3, help="период выдачи кредитов, лет до сегодняшнего дня")
+    parser.add_argument("--on-time", type=float, default=0.8, help="доля кредитов, оплачиваемых вовремя")
+    parser.add_argument("--late", type=float, default=0.15, help="доля кредитов с опозданиями")
+    parser.add_argument("--missed", type=float, default=0.05, help="доля кредитов с прекращенными платежами")
+    parser.add_argument("--batch", type=int, default=5000, help="клиентов в одной транзакции")
+    parser.add_argument("--seed", type=int, help="зерно генератора случайных чисел")
+    parser.add_argument("--no-rollup", action="store_true", help="не перестраивать сводку портфеля")
+    args = parser.parse_args()
+    if args.on_time + args.late + args.missed <= 0:
+        parser.error("сумма долей --on-time/--late/--missed должна быть больше нуля")
+
+    options = GeneratorOptions(
+        clients=args.clients,
+        loans_per_client=args.loans_per_client,
+        history_per_client=args.history_per_client,
+        years=args.years,
+        on_time=args.on_time,
+        late=args.late,
+        missed=args.missed,
+        batch_size=args.batch,
+        seed=args.seed
+    )
+
+    try:
+        await init_db()
+        started = time.perf_counter()
+        async with async_session() as session:
+            counts = await generate_portfolio(session, options, rebuild_rollup=not args.no_rollup)
+        print(
+            f"Загружено за {time.perf_counter() - started:.1f} с: клиентов {counts.clients}, кредитов {counts.loans}, "
+            f"платежей {counts.payments}, записей журнала {counts.ledger}, кредитной истории {counts.history}"
+        )
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
@@ -1,19 +1,104 @@
+import time
+import logging
 from typing import AsyncGenerator
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import (
     create_async_engine,
     AsyncSession,
     async_sessionmaker
 )
 from config import Config
-from models.base import Base
+from utils.migrations import migrate
 
-engine = create_async_engine(Config().db_url, echo=True)
+
+class PoolMetrics:
+    """Счетчики ожидания соединений из пула (для подбора размера пула)"""
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        self.checkouts += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, замеряющий время ожидания свободного соединения"""
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - started)
+
+
+def engine_options(config: Config, url: str) -> dict:
+    """Параметры движка и пула из конфигурации"""
+    options = {
+        "echo": config.DB_ECHO,
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "connect_args": {
+            "prepared_statement_cache_size": config.DB_PREPARED_STATEMENT_CACHE_SIZE,
+            "server_settings": {"statement_timeout": str(config.DB_STATEMENT_TIMEOUT_MS)},
+        },
+    }
+    if url.startswith("sqlite"):
+        # Параметры соединения asyncpg для SQLite не подходят
+        del options["connect_args"]
+    return options
+
+
+database_url = Config().db_url
+engine = create_async_engine(database_url, **engine_options(Config, database_url))
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
+
+def pool_stats() -> dict:
+    """
+    Текущее состояние пула соединений:
+        size            постоянный размер пула
+        checked_out     выдано соединений
+        overflow        соединений сверх pool_size (отрицательно - еще не открыты)
+        checkouts       всего выдач соединений
+        timeouts        отказов по pool_timeout
+        wait_avg_ms     среднее ожидание соединения
+        wait_max_ms     максимальное ожидание соединения
+    """
+    pool = engine.sync_engine.pool
+    stats = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "checkouts": pool_metrics.checkouts,
+        "timeouts": pool_metrics.timeouts,
+        "wait_avg_ms": 0.0,
+        "wait_max_ms": pool_metrics.wait_max * 1000,
+    }
+    if pool_metrics.checkouts:
+        stats["wait_avg_ms"] = pool_metrics.wait_total / pool_metrics.checkouts * 1000
+    return stats
+
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """Приводит схему БД к последней версии (см. utils.migrations)"""
+    applied = await migrate(engine)
+    if applied:
+        logging.info(f"Применены миграции: {', '.join(map(str, applied))}")
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
-        yield session
\ No newline at end of file
+        yield session
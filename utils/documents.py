@@ -0,0 +1,214 @@
+"""
+Документы из шаблонов templates/*.html (string.Template).
+
+Шаблоны написаны разметкой Telegram HTML, читаются и компилируются один раз
+(document_renderer.load() при старте бота) и хранятся по типу документа -
+имени файла без расширения. Из одного шаблона получаются HTML для Telegram,
+простой текст и PDF (нужен пакет reportlab и TTF-шрифт с кириллицей).
+
+Значения передаются уже отформатированными (format_date, format_money) и
+экранируются. Значение-список - строки повторяющегося блока: каждый словарь
+подставляется в шаблон <документ>_<ключ>.html, строки соединяются переводом
+строки. У всех файлов отбрасывается один завершающий перевод строки.
+
+Готовые документы кешируются по sha256 от шаблона, формата и значений, поэтому
+повторный запрос неизменившейся справки или отчета не рендерит его заново.
+"""
+import hashlib
+import html
+import io
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+from string import Template
+
+from config import Config
+
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates"
+FORMATS = ("html", "text", "pdf")
+MONTH_NAMES = (
+    "Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+    "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"
+)
+PDF_FONT_NAME = "DocumentFont"
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+@lru_cache(maxsize=512)
+def format_date(value: date) -> str:
+    """Дата в документе: ДД.ММ.ГГГГ"""
+    return value.strftime('%d.%m.%Y')
+
+
+def format_money(value) -> str:
+    """Сумма в документе: два знака после запятой"""
+    return f"{value:.2f}"
+
+
+def to_text(document: str) -> str:
+    """Простой текст из Telegram HTML"""
+    return html.unescape(_TAG_RE.sub("", document))
+
+
+@lru_cache(maxsize=1)
+def _pdf_font() -> str:
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.lib.fonts import addMapping
+
+    if not os.path.exists(Config.PDF_FONT_PATH):
+        raise RuntimeError(f"Шрифт для PDF не найден: {Config.PDF_FONT_PATH}")
+    pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, Config.PDF_FONT_PATH))
+
+    bold_name = PDF_FONT_NAME
+    bold_path = Config.PDF_FONT_PATH.replace(".ttf", "-Bold.ttf")
+    if bold_path != Config.PDF_FONT_PATH and os.path.exists(bold_path):
+        bold_name = PDF_FONT_NAME + "-Bold"
+        pdfmetrics.registerFont(TTFont(bold_name, bold_path))
+    addMapping(PDF_FONT_NAME, 0, 0, PDF_FONT_NAME)
+    addMapping(PDF_FONT_NAME, 1, 0, bold_name)
+    return PDF_FONT_NAME
+
+
+def pdf_supported() -> bool:
+    """Установлен ли reportlab и найден ли шрифт"""
+    try:
+        _pdf_font()
+    except (ImportError, RuntimeError):
+        return False
+    return True
+
+
+def to_pdf(document: str) -> bytes:
+    """PDF из Telegram HTML: строка документа - абзац, <b> - полужирный"""
+    try:
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.styles import ParagraphStyle
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+    except ImportError:
+        raise RuntimeError("Для документов в PDF установите пакет reportlab")
+
+    style = ParagraphStyle("document", fontName=_pdf_font(), fontSize=11, leading=15)
+    story = [Paragraph(line, style) if line.strip() else Spacer(1, 8) for line in document.split("\n")]
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=A4).build(story)
+    return buffer.getvalue()
+
+
+def _format(document: str, fmt: str) -> str | bytes:
+    if fmt == "text":
+        return to_text(document)
+    if fmt == "pdf":
+        return to_pdf(document)
+    return document
+
+
+@dataclass(frozen=True, slots=True)
+class DocumentTemplate:
+    """Скомпилированный шаблон и sha256 его текста"""
+    name: str
+    template: Template
+    digest: str
+
+
+class DocumentRenderer:
+    """Шаблоны по типу документа и кеш готовых документов (LRU по ключу содержимого)"""
+    def __init__(self, directory: Path, cache_size: int):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.templates: dict[str, DocumentTemplate] = {}
+        self._cache: OrderedDict[str, str | bytes] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Читает и проверяет все шаблоны каталога; кеш документов сбрасывается"""
+        templates = {}
+        for path in sorted(self.directory.glob("*.html")):
+            source = path.read_text(encoding="utf-8").removesuffix("\n")
+            template = Template(source)
+            if not template.is_valid():
+                raise ValueError(f"Некорректный шаблон документа: {path.name}")
+            templates[path.stem] = DocumentTemplate(path.stem, template, hashlib.sha256(source.encode()).hexdigest())
+        self.templates = templates
+        self._cache.clear()
+        logging.info(f"Шаблонов документов загружено: {len(templates)}")
+
+    def _template(self, name: str) -> DocumentTemplate:
+        if not self.templates:
+            self.load()
+        try:
+            return self.templates[name]
+        except KeyError:
+            raise ValueError(f"Неизвестный шаблон документа: {name}") from None
+
+    def _substitute(self, name: str, values: dict) -> str:
+        prepared = {}
+        for key, value in values.items():
+            if isinstance(value, list):
+                item = self._template(f"{name}_{key}")
+                prepared[key] = "\n".join(self._substitute(item.name, row) for row in value)
+            else:
+                prepared[key] = html.escape(str(value), quote=False)
+        return self._template(name).template.substitute(prepared)
+
+    def _cached(self, key: str, build, cache: bool) -> str | bytes:
+        if not cache:
+            return build()
+        document = self._cache.get(key)
+        if document is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return document
+
+        self.misses += 1
+        document = self._cache[key] = build()
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return document
+
+    def render(self, name: str, fmt: str = "html", cache: bool = True, **values) -> str | bytes:
+        """
+        Документ по шаблону.
+
+        :param name: тип документа (имя шаблона)
+        :param fmt: 'html' (Telegram), 'text' или 'pdf' (bytes)
+        :param cache: искать и сохранять результат в кеше (для разовых пакетов - False)
+        :param values: значения шаблона; списки - строки повторяющихся блоков
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Неизвестный формат документа: {fmt}")
+        template = self._template(name)
+        key = hashlib.sha256(
+            json.dumps([template.digest, fmt, values], sort_keys=True, ensure_ascii=False, default=str).encode()
+        ).hexdigest()
+        return self._cached(key, lambda: _format(self._substitute(name, values), fmt), cache)
+
+    def convert(self, document: str, fmt: str, cache: bool = True) -> str | bytes:
+        """Готовый HTML-документ (например, сохраненная справка) в другом формате"""
+        if fmt == "html":
+            return document
+        if fmt not in FORMATS:
+            raise ValueError(f"Неизвестный формат документа: {fmt}")
+        key = hashlib.sha256(f"{fmt}\0{document}".encode()).hexdigest()
+        return self._cached(key, lambda: _format(document, fmt), cache)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "templates": len(self.templates),
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+        }
+
+
+document_renderer = DocumentRenderer(TEMPLATES_DIR, Config.DOCUMENT_CACHE_SIZE)
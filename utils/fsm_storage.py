@@ -0,0 +1,144 @@
+"""
+Хранилища FSM для aiogram.
+
+    memory  - MemoryStorage (только один процесс, теряется при перезапуске)
+    redis   - RedisStorage aiogram (нужен пакет redis), общий для всех воркеров
+    db      - SQLAlchemyStorage: таблица fsm_states в основной БД (PostgreSQL)
+              или в отдельной БД из FSM_DB_URL (например, локальный SQLite)
+
+Данные состояний сериализуются в JSON с сохранением типов Decimal, date
+и datetime, которые используют обработчики.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from config import Config
+from models.service import FSMRecord
+
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"Тип {type(value).__name__} не поддерживается в данных FSM")
+
+
+def _decode(obj: dict):
+    if len(obj) == 1:
+        if "__decimal__" in obj:
+            return Decimal(obj["__decimal__"])
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+    return obj
+
+
+def dumps(data: Any) -> str:
+    """JSON с поддержкой Decimal/date/datetime"""
+    return json.dumps(data, default=_encode, ensure_ascii=False)
+
+
+def loads(raw: str) -> Any:
+    """Обратное преобразование для dumps"""
+    return json.loads(raw, object_hook=_decode)
+
+
+def _upsert(dialect_name: str):
+    if dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """Хранилище FSM в таблице fsm_states (одна строка на ключ)"""
+    def __init__(self, session_factory: async_sessionmaker, own_engine: Optional[AsyncEngine] = None):
+        """
+        :param session_factory: фабрика сессий
+        :param own_engine: отдельный движок хранилища - таблица создается при первом
+                           обращении, движок закрывается в close()
+        """
+        self.session_factory = session_factory
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._own_engine = own_engine
+        self._table_ready = own_engine is None
+
+    async def _session(self) -> AsyncSession:
+        if not self._table_ready:
+            async with self._own_engine.begin() as conn:
+                await conn.run_sync(FSMRecord.__table__.create, checkfirst=True)
+            self._table_ready = True
+        return self.session_factory()
+
+    async def _write(self, key: StorageKey, **values):
+        async with await self._session() as session:
+            insert = _upsert(session.bind.dialect.name)
+            stmt = insert(FSMRecord).values(key=self.key_builder.build(key), updated_at=datetime.utcnow(), **values)
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=[FSMRecord.key],
+                set_={**values, "updated_at": stmt.excluded.updated_at}
+            ))
+            await session.commit()
+
+    async def _read(self, key: StorageKey) -> Optional[FSMRecord]:
+        async with await self._session() as session:
+            return await session.get(FSMRecord, self.key_builder.build(key))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._write(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = await self._read(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._write(key, data=dumps(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._read(key)
+        return loads(record.data) if record else {}
+
+    async def close(self) -> None:
+        if self._own_engine is not None:
+            await self._own_engine.dispose()
+
+
+def build_fsm_storage() -> BaseStorage:
+    """Создает хранилище FSM по Config.FSM_STORAGE"""
+    backend = Config.FSM_STORAGE
+
+    if backend == "memory":
+        return MemoryStorage()
+
+    if backend == "redis":
+        # Пакет redis нужен только для этого режима
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(
+            Config.REDIS_URL,
+            key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True),
+            state_ttl=Config.FSM_TTL or None,
+            data_ttl=Config.FSM_TTL or None,
+            json_dumps=dumps,
+            json_loads=loads
+        )
+
+    if backend == "db":
+        if Config.FSM_DB_URL:
+            engine = create_async_engine(Config.FSM_DB_URL)
+            return SQLAlchemyStorage(async_sessionmaker(engine, expire_on_commit=False), own_engine=engine)
+
+        from utils.database import async_session
+        return SQLAlchemyStorage(async_session)
+
+    raise ValueError(f"Неизвестное хранилище FSM: {backend}")
@@ -1,37 +1,150 @@
 import io
+import os
 import csv
+import gzip
+import asyncio
+import tempfile
+from contextlib import asynccontextmanager
 from datetime import datetime
 from decimal import Decimal
+from typing import AsyncIterator, Sequence
 from aiogram import types
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from models.user import Client, Loan, Payment
+from utils.schedule_engine import PaymentSchedule
 
-def generate_payments_csv(payments: list[Payment], loan_id: int) -> types.BufferedInputFile:
-    """Генерирует CSV файл с графиком платежей"""
+def generate_schedule_csv(schedule: PaymentSchedule, loan_id: int) -> types.BufferedInputFile:
+    """Генерирует CSV файл с рассчитанным графиком платежей (без обращения к БД)"""
     output = io.StringIO()
     writer = csv.writer(output)
-    
-    # Заголовки
+
     writer.writerow([
-        'Дата платежа', 'Сумма платежа', 'Статус', 
-        'Фактическая дата', 'Фактическая сумма', 'Штраф'
+        'Дата платежа', 'Сумма платежа', 'Основной долг', 'Проценты', 'Остаток долга'
     ])
-    
-    # Данные
-    for payment in payments:
+
+    for row in schedule:
         writer.writerow([
-            payment.payment_date_plan.strftime('%d.%m.%Y'),
-            f"{payment.planned_amount:.2f}",
-            "Оплачен" if payment.payment_date_fact else "Ожидается",
-            payment.payment_date_fact.strftime('%d.%m.%Y') if payment.payment_date_fact else "-",
-            f"{payment.actual_amount:.2f}" if payment.actual_amount else "-",
-            f"{payment.penalty_amount:.2f}" if payment.penalty_amount else "-"
+            row.payment_date_plan.strftime('%d.%m.%Y'),
+            f"{row.planned_amount:.2f}",
+            f"{row.principal:.2f}",
+            f"{row.interest:.2f}",
+            f"{row.balance:.2f}"
         ])
-    
-    # Сбрасываем буфер в бинарный поток
+
     csv_data = output.getvalue().encode('utf-8')
     output.close()
-    
+
     return types.BufferedInputFile(
         file=csv_data,
         filename=f"payment_schedule_{loan_id}.csv"
-    )
\ No newline at end of file
+    )
+
+
+def _fmt_date(value) -> str:
+    return value.strftime('%d.%m.%Y') if value else "-"
+
+def _fmt_money(value) -> str:
+    return f"{value:.2f}" if value else "-"
+
+# Колонки выгрузки: ключ -> (заголовок, выражение SQL, форматирование)
+EXPORT_COLUMNS = {
+    'loan_id': ('ID кредита', Payment.loan_id, str),
+    'client_id': ('ID клиента', Loan.client_id, str),
+    'payment_date_plan': ('Дата платежа', Payment.payment_date_plan, _fmt_date),
+    'planned_amount': ('Сумма платежа', Payment.planned_amount, _fmt_money),
+    'status': ('Статус', Payment.payment_date_fact, lambda value: "Оплачен" if value else "Ожидается"),
+    'payment_date_fact': ('Фактическая дата', Payment.payment_date_fact, _fmt_date),
+    'actual_amount': ('Фактическая сумма', Payment.actual_amount, _fmt_money),
+    'penalty_amount': ('Штраф', Payment.penalty_amount, _fmt_money),
+}
+
+DEFAULT_EXPORT_COLUMNS = tuple(EXPORT_COLUMNS)
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def _open_xlsx(header: list[str]):
+    try:
+        from openpyxl import Workbook  # Необязательная зависимость, нужна только для XLSX
+    except ImportError:
+        raise RuntimeError("Для выгрузки в XLSX установите пакет openpyxl")
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Платежи")
+    sheet.append(header)
+    return workbook, sheet
+
+
+@asynccontextmanager
+async def export_payments(
+    session: AsyncSession,
+    loan_id: int = None,
+    client_id: int = None,
+    columns: Sequence[str] = DEFAULT_EXPORT_COLUMNS,
+    file_format: str = 'csv',
+    compress: bool = False
+) -> AsyncIterator[types.FSInputFile]:
+    """
+    Потоковая выгрузка платежей во временный файл.
+
+    Строки читаются курсором (session.stream) пачками по EXPORT_CHUNK_SIZE и сразу
+    пишутся в файл, поэтому память не растет с объемом выгрузки. Файл удаляется
+    при выходе из контекста.
+
+    :param session: сессия БД
+    :param loan_id: только платежи кредита
+    :param client_id: только платежи клиента
+    :param columns: ключи из EXPORT_COLUMNS в нужном порядке
+    :param file_format: 'csv' или 'xlsx' (нужен openpyxl)
+    :param compress: сжать CSV в gzip
+    :return: документ для message.answer_document
+    """
+    unknown = [column for column in columns if column not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Неизвестные колонки выгрузки: {', '.join(unknown)}")
+    if file_format not in ('csv', 'xlsx'):
+        raise ValueError(f"Неизвестный формат выгрузки: {file_format}")
+
+    header = [EXPORT_COLUMNS[column][0] for column in columns]
+    formatters = [EXPORT_COLUMNS[column][2] for column in columns]
+
+    stmt = (
+        select(*(EXPORT_COLUMNS[column][1] for column in columns))
+        .select_from(Payment)
+        .join(Loan, Payment.loan_id == Loan.loan_id)
+        .order_by(Payment.loan_id, Payment.payment_date_plan, Payment.payment_id)
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+    if loan_id is not None:
+        stmt = stmt.where(Payment.loan_id == loan_id)
+    if client_id is not None:
+        stmt = stmt.where(Loan.client_id == client_id)
+
+    scope = f"loan_{loan_id}" if loan_id is not None else f"client_{client_id}" if client_id is not None else "all"
+    filename = f"payments_{scope}.{file_format}"
+    if file_format == 'csv' and compress:
+        filename += ".gz"
+
+    fd, path = tempfile.mkstemp(suffix="_" + filename)
+    os.close(fd)
+    try:
+        result = await session.stream(stmt)
+
+        if file_format == 'xlsx':
+            workbook, sheet = _open_xlsx(header)
+            async for chunk in result.partitions():
+                for row in chunk:
+                    sheet.append([fmt(value) for fmt, value in zip(formatters, row)])
+            await asyncio.to_thread(workbook.save, path)
+        else:
+            raw = gzip.open(path, 'wb') if compress else open(path, 'wb')
+            with io.TextIOWrapper(raw, encoding='utf-8', newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(header)
+                async for chunk in result.partitions():
+                    rows = [[fmt(value) for fmt, value in zip(formatters, row)] for row in chunk]
+                    await asyncio.to_thread(writer.writerows, rows)
+
+        yield types.FSInputFile(path, filename=filename)
+    finally:
+        os.remove(path)
@@ -5,47 +5,71 @@ from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from models.user import Client, Loan, Payment
 from models.base import LoanStatus
+from models.service import LoanCertificate
 from typing import Optional
+from services.portfolio_rollup import portfolio_year, portfolio_year_version
+from services.report_cache import report_cache, REPORT_ANNUAL
+from utils.documents import document_renderer, format_date, format_money, MONTH_NAMES
+
+# Повестка - при стольких просроченных платежах
+COURT_NOTICE_MIN_OVERDUE = 3
+
+def render_no_obligations_doc(loan: Loan, client: Client, closed_on: date, fmt: str = "html") -> str | bytes:
+    """Справка об отсутствии взаимных обязательств на дату закрытия кредита"""
+    return document_renderer.render(
+        "no_obligations", fmt,
+        date=format_date(closed_on),
+        client_name=client.fullName,
+        client_id=client.clientID,
+        loan_id=loan.loan_id,
+        amount=format_money(loan.amount),
+        total_paid=format_money(loan.total_paid)
+    )
 
 async def generate_no_obligations_doc(loan_id: int, session: AsyncSession) -> Optional[str]:
-    """Генерирует документ об отсутствии взаимных обязательств"""
+    """Справка об отсутствии взаимных обязательств: сохраненная, на дату закрытия или сформированная сейчас"""
     try:
-        loan = await session.get(Loan, loan_id)
-        if not loan:
-            return None
-
-        client = await session.get(Client, loan.client_id)
-        if not client:
+        row = (await session.execute(
+            select(Loan, Client, LoanCertificate.document, LoanCertificate.closed_on)
+            .join(Client, Client.clientID == Loan.client_id)
+            .outerjoin(LoanCertificate, LoanCertificate.loan_id == Loan.loan_id)
+            .where(Loan.loan_id == loan_id)
+        )).first()
+        if not row:
             return None
 
+        loan, client, document, closed_on = row
         if loan.status != LoanStatus.CLOSED:
             return None
 
-        total_paid = await session.scalar(
-            select(func.sum(Payment.actual_amount))
-            .where(Payment.loan_id == loan_id)
-            .where(Payment.actual_amount.is_not(None))
-        )
-
-        return (
-            f"<b>Справка об отсутствии взаимных обязательств</b>\n\n"
-            f"Дата: {date.today().strftime('%d.%m.%Y')}\n"
-            f"Клиент: {client.fullName}\n"
-            f"ID клиента: {client.clientID}\n"
-            f"ID кредита: {loan_id}\n"
-            f"Сумма кредита: {loan.amount:.2f} руб.\n"
-            f"Оплачено: {total_paid:.2f} руб.\n"
-            f"Статус: Полностью погашен\n\n"
-            f"Настоящим подтверждается, что по состоянию на {date.today().strftime('%d.%m.%Y')} "
-            f"у клиента {client.fullName} отсутствуют обязательства перед кредитной организацией "
-            f"по кредитному договору #{loan_id}."
-        )
+        return document or render_no_obligations_doc(loan, client, closed_on or date.today())
     except Exception as e:
         logging.error(f"Ошибка при генерации документа об отсутствии обязательств: {e}", exc_info=True)
         return None
 
-async def generate_court_notice(loan_id: int, session: AsyncSession) -> Optional[str]:
+def render_court_notice(loan: Loan, client: Client, overdue_payments: list[Payment], today: date,
+                        fmt: str = "html", cache: bool = True) -> str | bytes:
+    """Повестка по кредиту и его просроченным платежам"""
+    total_overdue = sum(Decimal(str(p.planned_amount)) for p in overdue_payments)
+    return document_renderer.render(
+        "court_notice", fmt, cache,
+        date=format_date(today),
+        client_name=client.fullName,
+        client_id=client.clientID,
+        loan_id=loan.loan_id,
+        amount=format_money(loan.amount),
+        remaining_amount=format_money(loan.remaining_amount),
+        payments=[
+            {'date': format_date(p.payment_date_plan), 'amount': format_money(Decimal(str(p.planned_amount)))}
+            for p in overdue_payments
+        ],
+        total_overdue=format_money(total_overdue),
+        overdue_count=len(overdue_payments)
+    )
+
+async def generate_court_notice(loan_id: int, session: AsyncSession, today: date = None) -> Optional[str]:
     """Генерирует повестку в суд при ≥3 просроченных платежах"""
+    today = today or date.today()
     try:
         loan = await session.get(Loan, loan_id)
         if not loan:
@@ -59,202 +83,107 @@ async def generate_court_notice(loan_id: int, session: AsyncSession) -> Optional
             select(Payment)
             .where(Payment.loan_id == loan_id)
             .where(Payment.payment_date_fact.is_(None))
-            .where(Payment.payment_date_plan < date(2025, 10, 4)) # Изменил с date.today() для проверки
+            .where(Payment.payment_date_plan < today)
+            .order_by(Payment.payment_date_plan)
         )
         overdue_payments = payments.all()
 
-        if len(overdue_payments) < 3:
+        if len(overdue_payments) < COURT_NOTICE_MIN_OVERDUE:
             return None
 
-        total_overdue = sum(Decimal(str(p.planned_amount)) for p in overdue_payments)
-        overdue_details = "\n".join(
-            f"- {p.payment_date_plan.strftime('%d.%m.%Y')}: {Decimal(str(p.planned_amount)):.2f} руб."
-            for p in overdue_payments
-        )
-
-        return (
-            f"<b>Уведомление о намерении обратиться в суд</b>\n\n"
-            f"Дата: {date.today().strftime('%d.%m.%Y')}\n"
-            f"Клиент: {client.fullName}\n"
-            f"ID клиента: {client.clientID}\n"
-            f"ID кредита: {loan_id}\n"
-            f"Сумма кредита: {loan.amount:.2f} руб.\n"
-            f"Остаток долга: {loan.remaining_amount:.2f} руб.\n\n"
-            f"<b>Просроченные платежи:</b>\n{overdue_details}\n"
-            f"Общая сумма просрочки: {total_overdue:.2f} руб.\n\n"
-            f"Уважаемый {client.fullName},\n"
-            f"В связи с наличием {len(overdue_payments)} просроченных платежей по кредитному договору #{loan_id}, "
-            f"кредитная организация уведомляет о намерении обратиться в суд для взыскания задолженности. "
-            f"Просим в кратчайшие сроки погасить задолженность во избежание судебного разбирательства."
-        )
+        return render_court_notice(loan, client, overdue_payments, today)
     except Exception as e:
         logging.error(f"Ошибка при генерации повестки в суд: {e}", exc_info=True)
         return None
 
-async def generate_annual_financial_report(year: int, session: AsyncSession) -> str:
-    """Генерирует финансовый отчет за календарный год с разбивкой по месяцам и кварталам"""
-    try:
-        logging.debug(f"Начало генерации финансового отчета за {year} год")
-
-        # Создаем структуры для хранения данных по месяцам и кварталам
-        months_data = {month: {
-            'loans': 0,
-            'issued': Decimal('0'),
-            'paid_loans': 0,
-            'active_loans': 0,
-            'payments': 0,
-            'paid': Decimal('0'),
-            'overdue_payments': 0,
-            'overdue_amount': Decimal('0')
-        } for month in range(1, 13)}
-
-        quarters_data = {quarter: {
-            'loans': 0,
-            'issued': Decimal('0'),
-            'paid_loans': 0,
-            'active_loans': 0,
-            'payments': 0,
-            'paid': Decimal('0'),
-            'overdue_payments': 0,
-            'overdue_amount': Decimal('0')
-        } for quarter in range(1, 5)}
-
-        # Получаем все кредиты за год
-        loans_query = select(Loan).where(func.extract('year', Loan.issue_date) == year)
-        loans_result = await session.scalars(loans_query)
-        loans = loans_result.all()
-        logging.debug(f"Найдено кредитов: {len(loans)}")
-
-        total_issued = Decimal('0')
-        total_loans = len(loans)
-        paid_loans = 0
-        active_loans = 0
-
-        for loan in loans:
-            if loan.amount is not None:
-                month = loan.issue_date.month
-                quarter = (month - 1) // 3 + 1
-                amount = Decimal(str(loan.amount))
-
-                months_data[month]['loans'] += 1
-                months_data[month]['issued'] += amount
-                quarters_data[quarter]['loans'] += 1
-                quarters_data[quarter]['issued'] += amount
-
-                total_issued += amount
-
-                if loan.status == LoanStatus.CLOSED:
-                    months_data[month]['paid_loans'] += 1
-                    quarters_data[quarter]['paid_loans'] += 1
-                    paid_loans += 1
-                elif loan.status == LoanStatus.ACTIVE:
-                    months_data[month]['active_loans'] += 1
-                    quarters_data[quarter]['active_loans'] += 1
-                    active_loans += 1
-
-        logging.debug(f"Кредиты: Всего={total_loans}, Погашенные={paid_loans}, Активные={active_loans}, Сумма={total_issued}")
-
-        # Получаем все платежи за год
-        payments_query = select(Payment).where(
-            func.extract('year', Payment.payment_date_fact) == year
-        ).where(Payment.actual_amount.is_not(None))
-        payments_result = await session.scalars(payments_query)
-        payments = payments_result.all()
-        logging.debug(f"Найдено платежей: {len(payments)}")
-
-        total_paid = Decimal('0')
-        total_payments = len(payments)
-
-        for payment in payments:
-            if payment.actual_amount is not None and payment.payment_date_fact is not None:
-                month = payment.payment_date_fact.month
-                quarter = (month - 1) // 3 + 1
-                amount = Decimal(str(payment.actual_amount))
-
-                months_data[month]['payments'] += 1
-                months_data[month]['paid'] += amount
-                quarters_data[quarter]['payments'] += 1
-                quarters_data[quarter]['paid'] += amount
-
-                total_paid += amount
-
-        logging.debug(f"Платежи: Всего={total_payments}, Сумма={total_paid}")
-
-        # Получаем просроченные платежи
-        overdue_payments_query = select(Payment).where(
-            Payment.payment_date_fact.is_(None)
-        ).where(Payment.payment_date_plan < date.today()).where(
-            func.extract('year', Payment.payment_date_plan) == year
-        )
-        overdue_payments_result = await session.scalars(overdue_payments_query)
-        overdue_payments = overdue_payments_result.all()
-        logging.debug(f"Найдено просроченных платежей: {len(overdue_payments)}")
-
-        total_overdue_amount = Decimal('0')
-
-        for payment in overdue_payments:
-            if payment.planned_amount is not None:
-                month = payment.payment_date_plan.month
-                quarter = (month - 1) // 3 + 1
-                amount = Decimal(str(payment.planned_amount))
-
-                months_data[month]['overdue_payments'] += 1
-                months_data[month]['overdue_amount'] += amount
-                quarters_data[quarter]['overdue_payments'] += 1
-                quarters_data[quarter]['overdue_amount'] += amount
-
-                total_overdue_amount += amount
-
-        logging.debug(f"Просроченные платежи: Сумма={total_overdue_amount}")
-
-        # Формируем отчет
-        report = [
-            f"<b>Финансовый отчет за {year} год</b>\n\n",
-            f"📊 <b>Общие показатели:</b>\n",
-            f"- Выдано кредитов: {total_loans}\n",
-            f"- Общая сумма выданных кредитов: {total_issued:.2f} руб.\n",
-            f"- Погашенные кредиты: {paid_loans}\n",
-            f"- Активные кредиты: {active_loans}\n",
-            f"- Всего платежей: {total_payments}\n",
-            f"- Общая сумма платежей: {total_paid:.2f} руб.\n",
-            f"- Просроченные платежи: {len(overdue_payments)}\n",
-            f"- Сумма просроченных платежей: {total_overdue_amount:.2f} руб.\n\n",
-
-            f"📅 <b>По кварталам:</b>\n"
-        ]
-
-        # Добавляем данные по кварталам
-        for quarter in range(1, 5):
-            q_data = quarters_data[quarter]
-            report.append(
-                f"<b>Квартал {quarter}:</b>\n"
-                f"- Выдано кредитов: {q_data['loans']}\n"
-                f"- Сумма кредитов: {q_data['issued']:.2f} руб.\n"
-                f"- Погашенные кредиты: {q_data['paid_loans']}\n"
-                f"- Активные кредиты: {q_data['active_loans']}\n"
-                f"- Платежи: {q_data['payments']} ({q_data['paid']:.2f} руб.)\n"
-                f"- Просрочки: {q_data['overdue_payments']} ({q_data['overdue_amount']:.2f} руб.)\n\n"
-            )
-
-        # Добавляем данные по месяцам
-        report.append(f"📅 <b>По месяцам:</b>\n")
-        month_names = [
-            "Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
-            "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"
+def _empty_period() -> dict:
+    return {
+        'loans': 0,
+        'issued': Decimal('0'),
+        'paid_loans': 0,
+        'active_loans': 0,
+        'payments': 0,
+        'paid': Decimal('0'),
+        'overdue_payments': 0,
+        'overdue_amount': Decimal('0')
+    }
+
+def _period_values(data: dict) -> dict:
+    """Значения шаблона отчета за период"""
+    return {
+        'loans': data['loans'],
+        'issued': format_money(data['issued']),
+        'paid_loans': data['paid_loans'],
+        'active_loans': data['active_loans'],
+        'payments': data['payments'],
+        'paid': format_money(data['paid']),
+        'overdue_payments': data['overdue_payments'],
+        'overdue_amount': format_money(data['overdue_amount'])
+    }
+
+# Поля отчета -> колонки сводки portfolio_monthly
+REPORT_FIELDS = {
+    'loans': 'loans_issued',
+    'issued': 'issued_amount',
+    'paid_loans': 'loans_closed',
+    'active_loans': 'loans_active',
+    'payments': 'payments_count',
+    'paid': 'payments_amount',
+    'overdue_payments': 'overdue_count',
+    'overdue_amount': 'overdue_amount'
+}
+
+async def annual_monthly_totals(year: int, session: AsyncSession) -> dict[int, dict]:
+    """
+    Показатели по месяцам года из сводки portfolio_monthly (не больше 12 строк).
+    Просрочка - на дату последнего пересчета сводки.
+    """
+    rollup = await portfolio_year(session, year)
+    return {
+        month: {field: values[column] for field, column in REPORT_FIELDS.items()}
+        for month, values in rollup.items()
+    }
+
+async def build_annual_financial_report(year: int, session: AsyncSession) -> str:
+    """Финансовый отчет за календарный год с разбивкой по месяцам и кварталам (без даты формирования)"""
+    logging.debug(f"Начало генерации финансового отчета за {year} год")
+
+    months_data = await annual_monthly_totals(year, session)
+
+    # Кварталы и итоги собираются из помесячных строк
+    quarters_data = {quarter: _empty_period() for quarter in range(1, 5)}
+    totals = _empty_period()
+    for month, m_data in months_data.items():
+        for key, value in m_data.items():
+            quarters_data[(month - 1) // 3 + 1][key] += value
+            totals[key] += value
+
+    logging.debug(
+        f"Кредиты: Всего={totals['loans']}, Погашенные={totals['paid_loans']}, Активные={totals['active_loans']}, "
+        f"Сумма={totals['issued']}; Платежи: Всего={totals['payments']}, Сумма={totals['paid']}; "
+        f"Просрочки: Сумма={totals['overdue_amount']}"
+    )
+
+    return document_renderer.render(
+        "annual_report",
+        year=year,
+        **_period_values(totals),
+        quarters=[{'quarter': quarter, **_period_values(quarters_data[quarter])} for quarter in range(1, 5)],
+        months=[
+            {'month_name': MONTH_NAMES[month - 1], **_period_values(months_data[month])}
+            for month in range(1, 13)
         ]
+    )
 
-        for month in range(1, 13):
-            m_data = months_data[month]
-            report.append(
-                f"<b>{month_names[month-1]}:</b>\n"
-                f"- Кредитов: {m_data['loans']} ({m_data['issued']:.2f} руб.)\n"
-                f"- Платежи: {m_data['payments']} ({m_data['paid']:.2f} руб.)\n"
-                f"- Просрочки: {m_data['overdue_payments']} ({m_data['overdue_amount']:.2f} руб.)\n\n"
-            )
-
-        report.append(f"📅 Дата формирования: {date.today().strftime('%d.%m.%Y')}")
-
-        return "".join(report)
+async def generate_annual_financial_report(year: int, session: AsyncSession, refresh: bool = False) -> str:
+    """Финансовый отчет за год из кеша отчетов (refresh - пересобрать)"""
+    try:
+        version = await portfolio_year_version(session, year)
+        report = await report_cache.get(
+            REPORT_ANNUAL, year, version, lambda: build_annual_financial_report(year, session), refresh=refresh
+        )
+        # Дата формирования - на момент выдачи, а не сборки отчета
+        return report.text + "\n" + document_renderer.render("report_date", date=format_date(date.today()))
     except Exception as e:
         logging.error(f"Ошибка при генерации финансового отчета: {e}", exc_info=True)
         return "⚠ Произошла ошибка при формировании отчета"
\ No newline at end of file
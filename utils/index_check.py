@@ -0,0 +1,90 @@
+"""
+Проверка планов горячих запросов: используют ли они объявленные в моделях индексы.
+
+    python -m utils.index_check
+
+Для каждого запроса выполняется EXPLAIN (на PostgreSQL - с выключенным seq scan,
+чтобы результат не зависел от объема данных в проверяемой БД) и в плане ищется
+имя ожидаемого индекса. Код выхода 1, если хотя бы один запрос идет мимо индекса.
+"""
+import asyncio
+import sys
+from datetime import date
+from sqlalchemy import select, func, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from models.user import Loan, Payment
+from models.base import LoanStatus
+
+# (описание, запрос в том виде, в котором его выполняют обработчики, ожидаемый индекс)
+HOT_QUERIES = (
+    (
+        "Ближайший неоплаченный платеж по кредиту",
+        select(Payment)
+        .where(Payment.loan_id == 1)
+        .where(Payment.payment_date_fact.is_(None))
+        .order_by(Payment.payment_date_plan.asc())
+        .limit(1),
+        "ix_payments_unpaid_by_loan",
+    ),
+    (
+        "Платежи за год (годовой отчет, сводка портфеля)",
+        select(func.count(), func.sum(Payment.actual_amount))
+        .where(Payment.payment_date_fact >= date(2025, 1, 1))
+        .where(Payment.payment_date_fact < date(2026, 1, 1)),
+        "ix_payments_date_fact",
+    ),
+    (
+        "Открытые кредиты клиента",
+        select(Loan)
+        .where(Loan.client_id == 1)
+        .where(Loan.status.in_([LoanStatus.ACTIVE, LoanStatus.OVERDUE])),
+        "ix_loans_client_status",
+    ),
+)
+
+
+async def explain(connection: AsyncConnection, stmt) -> str:
+    """Текст плана запроса для текущего диалекта"""
+    dialect = connection.dialect
+    sql = str(stmt.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    if dialect.name == "sqlite":
+        rows = await connection.execute(text("EXPLAIN QUERY PLAN " + sql))
+        return "\n".join(row[-1] for row in rows)
+    rows = await connection.execute(text("EXPLAIN " + sql))
+    return "\n".join(row[0] for row in rows)
+
+
+async def check_indexes(connection: AsyncConnection) -> list[tuple[str, str, bool, str]]:
+    """:return: (описание, индекс, используется ли, план) для каждого горячего запроса"""
+    if connection.dialect.name == "postgresql":
+        await connection.execute(text("SET LOCAL enable_seqscan = off"))
+
+    results = []
+    for title, stmt, index_name in HOT_QUERIES:
+        plan = await explain(connection, stmt)
+        results.append((title, index_name, index_name in plan, plan))
+    return results
+
+
+async def _main() -> int:
+    from utils.database import engine
+
+    try:
+        async with engine.connect() as connection:
+            async with connection.begin():
+                results = await check_indexes(connection)
+    finally:
+        await engine.dispose()
+
+    failed = 0
+    for title, index_name, used, plan in results:
+        print(f"{'OK  ' if used else 'FAIL'} {title}: {index_name}")
+        if not used:
+            failed += 1
+            print("     " + plan.replace("\n", "\n     "))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main()))
@@ -0,0 +1,292 @@
+"""
+Нагрузочный тест обработчиков: синтетические обновления Telegram через настоящий Dispatcher.
+
+Роутеры basic, db_handlers и admin те же, что в боте, но бот работает с
+поддельной сессией: запросы к Bot API не уходят в сеть, а отправленные
+сообщения запоминаются по чатам (из них сценарий берет кнопки и суммы).
+БД настоящая - PostgreSQL из DB_* или SQLite из DB_URL; схема приводится к
+последней версии перед прогоном, тестовые клиенты остаются в БД.
+
+Хранилище FSM то же, что в боте (FSM_STORAGE): в режиме db чтение и запись
+состояния входят во время обработки и в число SQL-запросов на обновление.
+
+Каждый виртуальный пользователь проходит /register, /take_loan, /make_payment
+и /calculate_penny, параллельно администратор запрашивает статистику и
+финансовый отчет. Для каждой команды печатаются p50/p95/p99 времени обработки
+обновления и среднее число SQL-запросов на обновление, для каждого обработчика -
+средние из services.perf:
+
+    DB_URL=sqlite+aiosqlite:///loadtest.sqlite3 python -m utils.loadtest --users 200 --concurrency 50
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import random
+import re
+import statistics
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime
+from typing import Optional
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update, Message, CallbackQuery, Chat, User, InlineKeyboardMarkup
+from sqlalchemy import event
+
+from config import Config
+from services.perf import setup_perf, install_sql_hooks, perf_registry
+from utils.fsm_storage import build_fsm_storage
+
+current_command: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("loadtest_command", default=None)
+
+LOADTEST_TOKEN = "42:loadtest"
+PAYMENT_AMOUNT_RE = re.compile(r"Сумма платежа: ([\d.]+)")
+FAILURE_PREFIX = "⚠"
+
+
+class FakeSession(BaseSession):
+    """Сессия бота без сети: отвечает на методы Bot API и запоминает последнее сообщение в каждом чате"""
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self.last_sent: dict[int, object] = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            self.last_sent[chat_id] = method
+        if method.__returning__ is bool:
+            return True
+
+        markup = getattr(method, "reply_markup", None)
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.now(),
+            chat=Chat(id=chat_id or 0, type="private"),
+            from_user=User(id=bot.id, is_bot=True, first_name="bot"),
+            text=getattr(method, "text", None),
+            reply_markup=markup if isinstance(markup, InlineKeyboardMarkup) else None
+        ).as_(bot)
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class LoadTest:
+    """Подача обновлений в диспетчер с замером времени и числа SQL-запросов по командам"""
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, session: FakeSession):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.session = session
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statements = Counter()
+        self.errors = Counter()
+        self.failures = Counter()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def count_statement(self, *args):
+        command = current_command.get()
+        if command:
+            self.statements[command] += 1
+
+    def _user(self, user_id: int) -> User:
+        return User(id=user_id, is_bot=False, first_name="Load", last_name=str(user_id))
+
+    async def _feed(self, command: str, user_id: int, update: Update):
+        token = current_command.set(command)
+        self.session.last_sent.pop(user_id, None)
+        started = time.perf_counter()
+        try:
+            await self.dispatcher.feed_update(self.bot, update)
+        except Exception:
+            self.errors[command] += 1
+        finally:
+            self.latencies[command].append(time.perf_counter() - started)
+            current_command.reset(token)
+
+        reply = self.session.last_sent.get(user_id)
+        if reply is not None and (getattr(reply, "text", None) or "").startswith(FAILURE_PREFIX):
+            self.failures[command] += 1
+        return reply
+
+    async def send(self, command: str, user_id: int, text: str, reply_to: Message = None):
+        """Сообщение пользователя; возвращает последний ответ бота в этот чат"""
+        message = Message(
+            message_id=next(self._message_ids),
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=self._user(user_id),
+            text=text,
+            reply_to_message=reply_to
+        )
+        return await self._feed(command, user_id, Update(update_id=next(self._update_ids), message=message))
+
+    async def press(self, command: str, user_id: int, data: str, message: Message = None):
+        """Нажатие инлайн-кнопки под сообщением бота"""
+        message = message or Message(
+            message_id=next(self._message_ids),
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=self.bot.id, is_bot=True, first_name="bot"),
+            text="loadtest"
+        )
+        callback = CallbackQuery(
+            id=str(next(self._update_ids)),
+            from_user=self._user(user_id),
+            chat_instance="loadtest",
+            data=data,
+            message=message
+        )
+        return await self._feed(command, user_id, Update(update_id=next(self._update_ids), callback_query=callback))
+
+    # ---- Сценарии ----
+
+    async def client_scenario(self, user_id: int, index: int, run_id: int):
+        from utils.loan_type_catalog import loan_type_catalog
+
+        await self.send("/register", user_id, "/register")
+        await self.send("/register", user_id, f"Нагрузочный Тест {run_id}-{index}")
+        await self.send("/register", user_id, f"9{run_id:03d}{index:06d}")
+        await self.send("/register", user_id, f"+7916{run_id:03d}{index:04d}")
+        await self.send("/register", user_id, f"loadtest{run_id}.{index}@example.com")
+
+        loan_type = loan_type_catalog.all()[0]
+        await self.send("/take_loan", user_id, "/take_loan")
+        await self.send("/take_loan", user_id, loan_type.button_text)
+        await self.send("/take_loan", user_id, str(loan_type.min_amount))
+        await self.send("/take_loan", user_id, str(loan_type.min_term))
+        await self.send("/take_loan", user_id, "✅ Подтвердить")
+
+        reply = await self.send("/make_payment", user_id, "/make_payment")
+        keyboard = getattr(getattr(reply, "reply_markup", None), "keyboard", None) or []
+        loan_buttons = [button.text for row in keyboard for button in row if button.text.startswith("Кредит #")]
+        if loan_buttons:
+            reply = await self.send("/make_payment", user_id, loan_buttons[0])
+            amount = PAYMENT_AMOUNT_RE.search(getattr(reply, "text", None) or "")
+            if amount:
+                await self.send("/make_payment", user_id, amount.group(1).rstrip("."))
+        else:
+            self.failures["/make_payment"] += 1
+
+        await self.send("/calculate_penny", user_id, "/calculate_penny")
+
+    async def admin_scenario(self, rounds: int):
+        admin_id = Config.ADMINS[0]
+        for _ in range(rounds):
+            await self.send("/admin", admin_id, "/admin")
+            await self.send("/admin", admin_id, Config.ADMIN_PASSWORD)
+            await self.press("admin_stats", admin_id, "admin_stats")
+            await self.press("admin_financial_report", admin_id, "admin_financial_report")
+            prompt = Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=admin_id, type="private"),
+                from_user=User(id=self.bot.id, is_bot=True, first_name="bot"),
+                text="📅 Введите год для формирования финансового отчета (например, 2024):"
+            )
+            await self.send("admin_financial_report", admin_id, str(date.today().year), reply_to=prompt)
+
+    # ---- Отчет ----
+
+    def report(self, elapsed: float) -> str:
+        def percentiles(values: list[float]) -> tuple[float, float, float]:
+            if len(values) < 2:
+                value = values[0] * 1000 if values else 0.0
+                return value, value, value
+            cuts = statistics.quantiles(values, n=100, method="inclusive")
+            return cuts[49] * 1000, cuts[94] * 1000, cuts[98] * 1000
+
+        lines = [f"{'Команда':<24}{'обновл.':>9}{'ошибок':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'SQL/обновл.':>13}"]
+        total = 0
+        for command, values in self.latencies.items():
+            p50, p95, p99 = percentiles(values)
+            total += len(values)
+            lines.append(
+                f"{command:<24}{len(values):>9}{self.errors[command] + self.failures[command]:>8}"
+                f"{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{self.statements[command] / len(values):>13.1f}"
+            )
+        lines.append(f"\n{'Обработчик':<32}{'вызовов':>9}{'ср., мс':>10}{'БД, мс':>10}{'SQL':>7}{'строк':>8}")
+        for row in perf_registry.summary(limit=30):
+            lines.append(
+                f"{row['handler']:<32}{row['calls']:>9}{row['avg_ms']:>10.1f}{row['db_avg_ms']:>10.1f}"
+                f"{row['statements_avg']:>7.1f}{row['rows_avg']:>8.1f}"
+            )
+        lines.append(f"\nОбновлений: {total} за {elapsed:.1f} с ({total / elapsed:.1f} в секунду)")
+        lines.append("Вызовы Bot API: " + ", ".join(f"{name}={count}" for name, count in self.session.calls.most_common()))
+        return "\n".join(lines)
+
+
+def build_dispatcher() -> Dispatcher:
+    """Диспетчер с роутерами бота и тем же хранилищем FSM, что в боте (Config.FSM_STORAGE)"""
+    from handlers import basic, db_handlers, admin
+
+    dispatcher = Dispatcher(storage=build_fsm_storage())
+    dispatcher.include_routers(basic.router, db_handlers.router, admin.router)
+    setup_perf(dispatcher, basic.router, db_handlers.router, admin.router)
+    return dispatcher
+
+
+async def run_loadtest(users: int, concurrency: int, admin_rounds: int, run_id: int) -> str:
+    from utils.database import engine, init_db
+    from utils.loan_type_catalog import loan_type_catalog
+
+    await init_db()
+    await loan_type_catalog.ensure_fresh()
+    if not loan_type_catalog.all():
+        raise RuntimeError("В БД нет типов кредитов")
+
+    session = FakeSession()
+    bot = Bot(token=LOADTEST_TOKEN, session=session)
+    dispatcher = build_dispatcher()
+    test = LoadTest(dispatcher, bot, session)
+    event.listen(engine.sync_engine, "before_cursor_execute", test.count_statement)
+    install_sql_hooks(engine)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    base_user_id = 7_000_000_000 + run_id * 10_000
+
+    async def client(index: int):
+        async with semaphore:
+            await test.client_scenario(base_user_id + index, index, run_id)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(client(index) for index in range(users)),
+            test.admin_scenario(admin_rounds)
+        )
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", test.count_statement)
+        await dispatcher.storage.close()
+    elapsed = time.perf_counter() - started
+    return f"Хранилище FSM: {Config.FSM_STORAGE}\n" + test.report(elapsed)
+
+
+async def _main():
+    from utils.database import engine
+
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота")
+    parser.add_argument("--users", type=int, default=50, help="виртуальных клиентов (до 9999)")
+    parser.add_argument("--concurrency", type=int, default=10, help="клиентов одновременно")
+    parser.add_argument("--admin-rounds", type=int, default=5, help="повторов сценария администратора")
+    parser.add_argument("--run-id", type=int, default=random.randrange(1000),
+                        help="номер прогона 0-999 (telegram_id и паспорта клиентов не пересекаются между прогонами)")
+    args = parser.parse_args()
+    if not 0 < args.users < 10_000 or not 0 <= args.run_id < 1000:
+        parser.error("--users 1-9999, --run-id 0-999")
+
+    try:
+        print(await run_loadtest(args.users, args.concurrency, args.admin_rounds, args.run_id))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,114 @@
+"""
+Справочник типов кредитов в памяти процесса.
+
+Типов несколько, и они почти не меняются, поэтому справочник загружается
+при старте целиком (по id и по названию) вместе с готовой клавиатурой
+выбора типа. Перечитывается по истечении LOAN_TYPE_CACHE_TTL или после
+invalidate() - его вызывает код, изменивший loan_types (миграция 3,
+генератор данных). invalidate() сбрасывает справочник только своего процесса:
+изменения, сделанные другим процессом (миграции и генератор из командной
+строки, правка таблицы вручную), бот увидит по истечении LOAN_TYPE_CACHE_TTL.
+"""
+import asyncio
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional
+from aiogram import types
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Config
+from models.base import LoanType
+from utils.database import async_session
+
+
+@dataclass(frozen=True, slots=True)
+class LoanTypeInfo:
+    """Снимок строки loan_types"""
+    type_id: int
+    name: str
+    interest_rate: Decimal
+    min_amount: Decimal
+    max_amount: Decimal
+    min_term: int
+    max_term: int
+    description: Optional[str]
+
+    @property
+    def button_text(self) -> str:
+        return f"{self.name} ({self.interest_rate}%)"
+
+    @classmethod
+    def from_model(cls, loan_type: LoanType) -> "LoanTypeInfo":
+        return cls(
+            type_id=loan_type.type_id,
+            name=loan_type.name,
+            interest_rate=Decimal(str(loan_type.interest_rate)),
+            min_amount=Decimal(str(loan_type.min_amount)),
+            max_amount=Decimal(str(loan_type.max_amount)),
+            min_term=int(loan_type.min_term),
+            max_term=int(loan_type.max_term),
+            description=loan_type.description
+        )
+
+
+class LoanTypeCatalog:
+    """Типы кредитов по id и по названию с ограничением времени жизни"""
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._by_id: dict[int, LoanTypeInfo] = {}
+        self._by_name: dict[str, LoanTypeInfo] = {}
+        self._keyboard: Optional[types.ReplyKeyboardMarkup] = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self.loads = 0
+
+    @property
+    def is_stale(self) -> bool:
+        return self._expires_at < time.monotonic()
+
+    async def load(self, session: AsyncSession):
+        """Загружает справочник целиком и пересобирает клавиатуру"""
+        loan_types = (await session.scalars(select(LoanType).order_by(LoanType.type_id))).all()
+        entries = [LoanTypeInfo.from_model(loan_type) for loan_type in loan_types]
+
+        self._by_id = {entry.type_id: entry for entry in entries}
+        self._by_name = {entry.name: entry for entry in entries}
+        self._keyboard = types.ReplyKeyboardMarkup(
+            keyboard=[[types.KeyboardButton(text=entry.button_text)] for entry in entries],
+            resize_keyboard=True,
+            one_time_keyboard=True
+        ) if entries else None
+        self._expires_at = time.monotonic() + self.ttl
+        self.loads += 1
+
+    async def ensure_fresh(self):
+        """Перечитывает справочник, если он устарел (обычно - без обращения к БД)"""
+        if not self.is_stale:
+            return
+        async with self._lock:
+            if self.is_stale:
+                async with async_session() as session:
+                    await self.load(session)
+
+    def invalidate(self):
+        """Помечает справочник устаревшим - следующее обращение перечитает его"""
+        self._expires_at = 0.0
+
+    def get(self, type_id: int) -> Optional[LoanTypeInfo]:
+        return self._by_id.get(type_id)
+
+    def by_name(self, name: str) -> Optional[LoanTypeInfo]:
+        return self._by_name.get(name)
+
+    def all(self) -> list[LoanTypeInfo]:
+        return list(self._by_id.values())
+
+    @property
+    def keyboard(self) -> Optional[types.ReplyKeyboardMarkup]:
+        """Готовая клавиатура выбора типа кредита (None, если типов нет)"""
+        return self._keyboard
+
+
+loan_type_catalog = LoanTypeCatalog(Config.LOAN_TYPE_CACHE_TTL)
@@ -0,0 +1,275 @@
+"""
+Таблицы в том виде, в каком их создают миграции (utils.migrations).
+
+Миграция не читает модели: если бы она строила таблицу по Base.metadata,
+свежая БД получала бы на шаге N схему последней версии, а обновленная -
+схему версии N, и дальнейшие миграции работали бы с разными БД. Поэтому
+определения здесь зафиксированы на момент миграции, которая создает таблицу,
+и больше не меняются: колонки и индексы, появившиеся позже, добавляют
+последующие миграции явным DDL.
+
+Изменилась модель - добавьте миграцию, а не правьте этот файл.
+"""
+from sqlalchemy import (
+    MetaData, Table, Column, ForeignKey, Integer, BigInteger, String, Text, JSON,
+    Date, DateTime, Numeric, Boolean, Enum
+)
+
+metadata = MetaData()
+
+# Значения LoanStatus на момент миграции 1 (в БД хранятся имена)
+LOAN_STATUS = Enum('ACTIVE', 'CLOSED', 'OVERDUE', 'UNKNOW', name='loanstatus')
+
+
+# ---- Миграция 1: базовые таблицы ----
+
+bank_name = Table(
+    'bank_name', metadata,
+    Column('bankID', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+)
+
+clients = Table(
+    'clients', metadata,
+    Column('clientID', Integer, primary_key=True, autoincrement=True,
+           comment="Уникальный внутренний ID клиента"),
+    Column('fullName', String(100), nullable=False,
+           comment="Полное имя (фамилия, имя, отчество)"),
+    Column('passport', String(20), unique=True, nullable=False,
+           comment="Серия и номер паспорта (зашифровано)"),
+    Column('telegram_id', BigInteger, unique=True, nullable=True,
+           comment="ID Telegram для уведомлений"),
+    Column('phone_numbers', JSON, nullable=False,
+           comment="Список телефонов в международном формате"),
+    Column('email', String(100), unique=True, nullable=True,
+           comment="Контактный email (зашифровано)"),
+    Column('registration_date', DateTime,
+           comment="Дата регистрации клиента"),
+    Column('creditScore', Integer,
+           comment="Кредитный рейтинг (0-1000)"),
+    comment='Таблица клиентов кредитной организации',
+)
+
+loan_types = Table(
+    'loan_types', metadata,
+    Column('type_id', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('interest_rate', Numeric(5, 2), nullable=False),
+    Column('min_amount', Numeric(15, 2), nullable=False),
+    Column('max_amount', Numeric(15, 2), nullable=False),
+    Column('min_term', Numeric(15), nullable=False),
+    Column('max_term', Numeric(15), nullable=False),
+    Column('description', String(500)),
+)
+
+credit_history = Table(
+    'credit_history', metadata,
+    Column('LoanHistID', Integer, primary_key=True, autoincrement=True,
+           comment="Уникальный внутренний ID клиента"),
+    Column('loanID', Integer,
+           comment="ID кредита (общие-организационный)"),
+    Column('bankID', Integer, ForeignKey('bank_name.bankID'),
+           comment='Название банка кредитования'),
+    Column('fullname', String(100), nullable=False,
+           comment="Полное имя клиента"),
+    Column('passport', Integer, nullable=False,
+           comment="Паспортные данные клиента"),
+    Column('status', LOAN_STATUS, nullable=False,
+           comment="Статус кредита"),
+    Column('issue_date', Date, nullable=False,
+           comment='Дата выдачи кредита'),
+    Column('amount', Numeric(15, 2), nullable=False,
+           comment='Изначальная сумма кредита'),
+    Column('term', Integer, nullable=False,
+           comment='Срок кредита в месяцах'),
+    Column('interest_rate', Numeric(5, 2), nullable=False,
+           comment='Процентная ставка (годовых)'),
+)
+
+# ix_loans_client_id заменен в миграции 2 на ix_loans_client_status,
+# next_payment_date добавлен миграцией 6
+loans = Table(
+    'loans', metadata,
+    Column('loan_id', Integer, primary_key=True, autoincrement=True,
+           comment='Уникальный идентификатор кредита'),
+    Column('client_id', Integer, ForeignKey('clients.clientID', ondelete='CASCADE'),
+           nullable=False, index=True,
+           comment='Ссылка на клиента'),
+    Column('loan_type_id', Integer, ForeignKey('loan_types.type_id'),
+           nullable=False, index=True,
+           comment='Ссылка на тип кредита'),
+    Column('issue_date', DateTime, nullable=False,
+           comment='Дата выдачи кредита'),
+    Column('amount', Numeric(15, 2), nullable=False,
+           comment='Сумма кредита'),
+    Column('term', Integer, nullable=False,
+           comment='Срок кредита (в месяцах)'),
+    Column('status', LOAN_STATUS, nullable=False,
+           comment='Статус кредита'),
+    Column('total_paid', Numeric(15, 2), nullable=False,
+           comment='Общая сумма выплаченных средств'),
+    Column('remaining_amount', Numeric(15, 2), nullable=False,
+           comment='Оставшаяся сумма к выплате'),
+)
+
+payments = Table(
+    'payments', metadata,
+    Column('payment_id', Integer, primary_key=True, autoincrement=True,
+           comment='Уникальный идентификатор платежа (PK)'),
+    Column('loan_id', Integer, ForeignKey('loans.loan_id', ondelete='CASCADE'),
+           nullable=False, index=True,
+           comment='Ссылка на кредит (FK)'),
+    Column('payment_date_plan', Date, nullable=False,
+           comment='Плановая дата внесения платежа'),
+    Column('planned_amount', Numeric(15, 2), nullable=False,
+           comment='Плановая сумма платежа'),
+    Column('payment_date_fact', Date,
+           comment='Фактическая дата внесения платежа (NULL если не оплачен)'),
+    Column('actual_amount', Numeric(15, 2),
+           comment='Фактически внесенная сумма'),
+    Column('penalty_date', Date,
+           comment='Дата начисления штрафа (NULL если нет штрафа)'),
+    Column('penalty_amount', Numeric(15, 2),
+           comment='Сумма штрафа за просрочку'),
+    Column('is_early_payment', Boolean,
+           comment="Признак досрочного платежа (по умолчанию False)"),
+)
+
+
+# ---- Служебная таблица версий (создается до первой миграции) ----
+
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+# ---- Миграция 4 ----
+
+fsm_states = Table(
+    'fsm_states', metadata,
+    Column('key', String(255), primary_key=True),
+    Column('state', String(255)),
+    Column('data', Text, nullable=False),
+    Column('updated_at', DateTime),
+)
+
+
+# ---- Миграция 5 ----
+
+portfolio_monthly = Table(
+    'portfolio_monthly', metadata,
+    Column('month', Date, primary_key=True),
+    Column('loan_type_id', Integer, primary_key=True),
+    Column('loans_issued', Integer, nullable=False),
+    Column('issued_amount', Numeric(15, 2), nullable=False),
+    Column('loans_closed', Integer, nullable=False),
+    Column('loans_active', Integer, nullable=False),
+    Column('payments_count', Integer, nullable=False),
+    Column('payments_amount', Numeric(15, 2), nullable=False),
+    Column('overdue_count', Integer, nullable=False),
+    Column('overdue_amount', Numeric(15, 2), nullable=False),
+    Column('refreshed_at', DateTime, nullable=False),
+)
+
+
+# ---- Миграция 6 ----
+
+loans_next_payment_date = Column('next_payment_date', Date, nullable=True,
+                                 comment='Дата ближайшего неоплаченного платежа (NULL если нет)')
+
+loan_ledger = Table(
+    'loan_ledger', metadata,
+    Column('entry_id', Integer, primary_key=True, autoincrement=True,
+           comment='Уникальный идентификатор записи'),
+    Column('loan_id', Integer, ForeignKey('loans.loan_id', ondelete='CASCADE'), nullable=False, index=True,
+           comment='Ссылка на кредит'),
+    Column('payment_id', Integer, ForeignKey('payments.payment_id', ondelete='SET NULL'), nullable=True,
+           comment='Платеж, породивший запись (NULL для выдачи)'),
+    Column('entry_type', String(20), nullable=False,
+           comment='Тип операции: ISSUE, PAYMENT, EARLY_PAYMENT'),
+    Column('amount', Numeric(15, 2), nullable=False,
+           comment='Сумма операции'),
+    Column('balance_after', Numeric(15, 2), nullable=False,
+           comment='Остаток долга после операции'),
+    Column('created_at', DateTime, nullable=False,
+           comment='Время операции'),
+)
+
+
+# ---- Миграция 7 ----
+
+accepted_payments = Table(
+    'accepted_payments', metadata,
+    Column('idempotency_key', String(64), primary_key=True),
+    Column('loan_id', Integer, nullable=False),
+    Column('amount', Numeric(15, 2), nullable=False),
+    Column('remaining_amount', Numeric(15, 2), nullable=False),
+    Column('next_payment_date', Date),
+    Column('closed', Boolean, nullable=False),
+    Column('accepted_at', DateTime, nullable=False),
+)
+
+
+# ---- Миграция 8 ----
+
+court_notices = Table(
+    'court_notices', metadata,
+    Column('loan_id', Integer, primary_key=True, autoincrement=False),
+    Column('overdue_count', Integer, nullable=False),
+    Column('overdue_amount', Numeric(15, 2), nullable=False),
+    Column('notice_date', Date, nullable=False),
+    Column('created_at', DateTime, nullable=False),
+)
+
+
+# ---- Миграция 9 ----
+
+loan_certificates = Table(
+    'loan_certificates', metadata,
+    Column('loan_id', Integer, primary_key=True, autoincrement=False),
+    Column('client_id', Integer, nullable=False),
+    Column('closed_on', Date, nullable=False),
+    Column('document', Text, nullable=False),
+    Column('created_at', DateTime, nullable=False),
+    Column('delivered_at', DateTime),
+)
+
+
+# ---- Миграция 10 ----
+
+payment_reminders = Table(
+    'payment_reminders', metadata,
+    Column('payment_id', Integer, primary_key=True, autoincrement=False),
+    Column('kind', String(16), primary_key=True),
+    Column('client_id', Integer, nullable=False),
+    Column('loan_id', Integer, nullable=False),
+    Column('due_date', Date, nullable=False),
+    Column('amount', Numeric(15, 2), nullable=False),
+    Column('remind_date', Date, nullable=False),
+    Column('attempts', Integer, nullable=False),
+    Column('sent_at', DateTime),
+    Column('last_error', String(255)),
+    Column('created_at', DateTime, nullable=False),
+)
+
+
+# ---- Миграция 11: справка формируется при отправке, claimed_at - захват отправки ----
+
+loan_certificates_v11 = Table(
+    'loan_certificates', MetaData(),
+    Column('loan_id', Integer, primary_key=True, autoincrement=False),
+    Column('client_id', Integer, nullable=False),
+    Column('closed_on', Date, nullable=False),
+    Column('document', Text),
+    Column('created_at', DateTime, nullable=False),
+    Column('delivered_at', DateTime),
+    Column('claimed_at', DateTime),
+)
+
+
+# ---- Миграция 12: аренда отправки напоминаний ----
+
+payment_reminders_claimed_at = Column('claimed_at', DateTime)
@@ -0,0 +1,325 @@
+"""
+Версионные миграции схемы БД.
+
+Примененные миграции записываются в schema_version. При старте выполняется
+один запрос max(version): если БД уже на последней версии, больше ничего не
+делается. Иначе под блокировкой (advisory lock на PostgreSQL - на случай
+одновременного запуска нескольких экземпляров) в одной транзакции
+применяются недостающие миграции.
+
+Миграции только прямые и идемпотентные: таблицы создаются с checkfirst,
+колонки и индексы - если их еще нет. Поэтому их можно накатить и на БД,
+созданную до появления schema_version.
+
+Миграции не читают модели: таблицы берутся из utils.migration_tables, где
+они зафиксированы на момент своей миграции, а колонки и индексы задаются явно.
+Так свежая и обновленная БД совпадают на каждой версии.
+
+Новая миграция - функция с декоратором @migration(следующий номер, описание):
+
+    python -m utils.migrations            применить недостающие
+    python -m utils.migrations --status   текущая и последняя версии
+"""
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable
+from sqlalchemy import Column, String, Table, select, update, func, inspect, insert, text, literal, case, table, column
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from services.loan_ledger import ENTRY_ISSUE, ENTRY_PAYMENT, ENTRY_EARLY_PAYMENT
+from services.portfolio_rollup import rebuild_portfolio_rollup
+from utils import migration_tables as schema
+from utils.data_filler import add_default_loan_types
+
+MIGRATION_LOCK_KEY = 7_310_614  # Ключ pg_advisory_xact_lock для миграций
+
+
+@dataclass(frozen=True, slots=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[AsyncConnection], Awaitable[None]]
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, description: str):
+    """Регистрирует миграцию; номера идут подряд"""
+    def decorator(func):
+        expected = len(MIGRATIONS) + 1
+        if version != expected:
+            raise ValueError(f"Миграция {version} объявлена вне очереди (ожидалась {expected})")
+        MIGRATIONS.append(Migration(version, description, func))
+        return func
+    return decorator
+
+
+def head_version() -> int:
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+# ---- Помощники для миграций ----
+
+async def create_tables(conn: AsyncConnection, *tables: Table):
+    """Создает таблицы из utils.migration_tables, которых еще нет (вместе с их индексами)"""
+    await conn.run_sync(lambda sync_conn: schema.metadata.create_all(sync_conn, tables=list(tables), checkfirst=True))
+
+
+async def create_index(conn: AsyncConnection, name: str, table_name: str, *columns: str, where: str | None = None):
+    """Создает индекс, если его еще нет (частичный - с условием where; синтаксис общий для PostgreSQL и SQLite)"""
+    ddl = f"CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({', '.join(columns)})"
+    if where:
+        ddl += f" WHERE {where}"
+    await conn.execute(text(ddl))
+
+
+async def add_column_if_missing(conn: AsyncConnection, table_name: str, column: Column):
+    """Добавляет в существующую таблицу колонку (nullable, без значения по умолчанию)"""
+    def add(sync_conn):
+        if column.name in {item['name'] for item in inspect(sync_conn).get_columns(table_name)}:
+            return
+        column_type = column.type.compile(dialect=sync_conn.dialect)
+        sync_conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}"))
+        if column.comment and sync_conn.dialect.name == "postgresql":
+            comment = String().literal_processor(sync_conn.dialect)(column.comment)
+            sync_conn.execute(text(f"COMMENT ON COLUMN {table_name}.{column.name} IS {comment}"))
+    await conn.run_sync(add)
+
+
+async def drop_not_null(conn: AsyncConnection, table: Table, column_name: str):
+    """
+    Снимает NOT NULL с колонки. SQLite так не умеет - там таблица пересоздается
+    по новому определению table с переносом данных общих колонок.
+    """
+    def alter(sync_conn):
+        if sync_conn.dialect.name != "sqlite":
+            sync_conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column_name} DROP NOT NULL"))
+            return
+        inspector = inspect(sync_conn)
+        if next(item for item in inspector.get_columns(table.name) if item['name'] == column_name)['nullable']:
+            return
+        columns = ', '.join(
+            item['name'] for item in inspector.get_columns(table.name) if item['name'] in table.c
+        )
+        for index in inspector.get_indexes(table.name):
+            sync_conn.execute(text(f"DROP INDEX {index['name']}"))
+        sync_conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {table.name}_old"))
+        table.create(sync_conn)
+        sync_conn.execute(text(f"INSERT INTO {table.name} ({columns}) SELECT {columns} FROM {table.name}_old"))
+        sync_conn.execute(text(f"DROP TABLE {table.name}_old"))
+    await conn.run_sync(alter)
+
+
+async def drop_index_if_exists(conn: AsyncConnection, table_name: str, index_name: str):
+    def drop(sync_conn):
+        if index_name in {index['name'] for index in inspect(sync_conn).get_indexes(table_name)}:
+            sync_conn.execute(text(f"DROP INDEX {index_name}"))
+    await conn.run_sync(drop)
+
+
+# ---- Миграции ----
+
+@migration(1, "Базовые таблицы")
+async def _base_tables(conn: AsyncConnection):
+    await create_tables(
+        conn, schema.bank_name, schema.clients, schema.loan_types, schema.credit_history, schema.loans, schema.payments
+    )
+
+
+@migration(2, "Индексы горячих запросов по платежам и кредитам")
+async def _hot_indexes(conn: AsyncConnection):
+    await create_index(conn, 'ix_loans_client_status', 'loans', 'client_id', 'status')
+    await create_index(conn, 'ix_payments_unpaid_by_loan', 'payments', 'loan_id', 'payment_date_plan',
+                       where='payment_date_fact IS NULL')
+    await create_index(conn, 'ix_payments_date_fact', 'payments', 'payment_date_fact')
+    # Заменен составным ix_loans_client_status
+    await drop_index_if_exists(conn, 'loans', 'ix_loans_client_id')
+
+
+@migration(3, "Типы кредитов по умолчанию")
+async def _default_loan_types(conn: AsyncConnection):
+    # Справочник импортирует utils.database, а тот - этот модуль
+    from utils.loan_type_catalog import loan_type_catalog
+
+    async with AsyncSession(bind=conn) as session:
+        if await add_default_loan_types(session):
+            loan_type_catalog.invalidate()
+
+
+@migration(4, "Хранилище FSM")
+async def _fsm_states(conn: AsyncConnection):
+    await create_tables(conn, schema.fsm_states)
+
+
+@migration(5, "Сводка портфеля portfolio_monthly")
+async def _portfolio_monthly(conn: AsyncConnection):
+    await create_tables(conn, schema.portfolio_monthly)
+    async with AsyncSession(bind=conn) as session:
+        await rebuild_portfolio_rollup(session)
+
+
+@migration(6, "Журнал долга loan_ledger и loans.next_payment_date")
+async def _loan_ledger(conn: AsyncConnection):
+    payments, loan_ledger = schema.payments, schema.loan_ledger
+    await add_column_if_missing(conn, 'loans', schema.loans_next_payment_date)
+    await create_tables(conn, loan_ledger)
+    # loans на версии 6 - с новой колонкой
+    loans = table('loans', *(column(item.name, item.type) for item in schema.loans.c),
+                  column('next_payment_date', schema.loans_next_payment_date.type))
+
+    # Сводные поля кредитов - по фактическим платежам, одним UPDATE
+    paid = (
+        select(func.coalesce(func.sum(payments.c.actual_amount), 0))
+        .where(payments.c.loan_id == loans.c.loan_id)
+        .where(payments.c.payment_date_fact.is_not(None))
+        .scalar_subquery()
+    )
+    next_date = (
+        select(func.min(payments.c.payment_date_plan))
+        .where(payments.c.loan_id == loans.c.loan_id)
+        .where(payments.c.payment_date_fact.is_(None))
+        .scalar_subquery()
+    )
+    await conn.execute(
+        update(loans).values(total_paid=paid, remaining_amount=loans.c.amount - paid, next_payment_date=next_date)
+    )
+    await conn.execute(
+        update(loans).where(loans.c.status == 'CLOSED').values(next_payment_date=None)
+    )
+
+    if await conn.scalar(select(func.count()).select_from(loan_ledger)):
+        return
+
+    # Журнал: выдача каждого кредита и его фактические платежи с нарастающим остатком
+    await conn.execute(
+        insert(loan_ledger).from_select(
+            ['loan_id', 'entry_type', 'amount', 'balance_after', 'created_at'],
+            select(loans.c.loan_id, literal(ENTRY_ISSUE), loans.c.amount, loans.c.amount, loans.c.issue_date)
+        )
+    )
+    paid_so_far = func.sum(payments.c.actual_amount).over(
+        partition_by=payments.c.loan_id,
+        order_by=(payments.c.payment_date_fact, payments.c.payment_id)
+    )
+    await conn.execute(
+        insert(loan_ledger).from_select(
+            ['loan_id', 'payment_id', 'entry_type', 'amount', 'balance_after', 'created_at'],
+            select(
+                payments.c.loan_id,
+                payments.c.payment_id,
+                case((payments.c.is_early_payment.is_(True), ENTRY_EARLY_PAYMENT), else_=ENTRY_PAYMENT),
+                payments.c.actual_amount,
+                loans.c.amount - paid_so_far,
+                payments.c.payment_date_fact
+            )
+            .join(loans, payments.c.loan_id == loans.c.loan_id)
+            .where(payments.c.payment_date_fact.is_not(None))
+            .where(payments.c.actual_amount.is_not(None))
+        )
+    )
+
+
+@migration(7, "Ключи идемпотентности принятых платежей")
+async def _accepted_payments(conn: AsyncConnection):
+    await create_tables(conn, schema.accepted_payments)
+
+
+@migration(8, "Учет сформированных повесток в суд")
+async def _court_notices(conn: AsyncConnection):
+    await create_tables(conn, schema.court_notices)
+
+
+@migration(9, "Справки об отсутствии обязательств по закрытым кредитам")
+async def _loan_certificates(conn: AsyncConnection):
+    await create_tables(conn, schema.loan_certificates)
+
+
+@migration(10, "Напоминания о платежах")
+async def _payment_reminders(conn: AsyncConnection):
+    await create_index(conn, 'ix_payments_unpaid_by_date', 'payments', 'payment_date_plan',
+                       where='payment_date_fact IS NULL')
+    await create_tables(conn, schema.payment_reminders)
+    await create_index(conn, 'ix_payment_reminders_pending', 'payment_reminders', 'client_id',
+                       where='sent_at IS NULL')
+
+
+@migration(11, "Справки формируются при отправке, захват отправки справки")
+async def _certificate_delivery(conn: AsyncConnection):
+    await add_column_if_missing(conn, 'loan_certificates', schema.loan_certificates_v11.c.claimed_at)
+    await drop_not_null(conn, schema.loan_certificates_v11, 'document')
+
+
+@migration(12, "Аренда отправки напоминаний")
+async def _reminder_lease(conn: AsyncConnection):
+    await add_column_if_missing(conn, 'payment_reminders', schema.payment_reminders_claimed_at)
+
+
+# ---- Запуск ----
+
+async def current_version(conn: AsyncConnection) -> int:
+    """Последняя примененная миграция (0 - схема еще не версионирована)"""
+    try:
+        version = await conn.scalar(select(func.max(schema.schema_version.c.version)))
+    except DBAPIError:
+        # Таблицы schema_version еще нет
+        await conn.rollback()
+        return 0
+    return version or 0
+
+
+async def migrate(engine: AsyncEngine) -> list[int]:
+    """
+    Приводит схему к последней версии.
+    :return: номера примененных миграций (пусто, если БД уже на последней версии)
+    """
+    head = head_version()
+    async with engine.connect() as conn:
+        if await current_version(conn) == head:
+            await conn.rollback()
+            return []
+        await conn.rollback()
+
+        async with conn.begin():
+            if conn.dialect.name == "postgresql":
+                await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            await create_tables(conn, schema.schema_version)
+
+            # Перечитываем под блокировкой: другой экземпляр мог успеть применить миграции
+            current = await conn.scalar(select(func.max(schema.schema_version.c.version))) or 0
+            applied = []
+            for item in MIGRATIONS[current:]:
+                logging.info(f"Миграция {item.version}: {item.description}")
+                await item.apply(conn)
+                await conn.execute(insert(schema.schema_version).values(
+                    version=item.version, description=item.description, applied_at=datetime.utcnow()
+                ))
+                applied.append(item.version)
+    return applied
+
+
+async def _main():
+    from utils.database import engine
+
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument("--status", action="store_true", help="только показать текущую и последнюю версии")
+    args = parser.parse_args()
+
+    try:
+        if args.status:
+            async with engine.connect() as conn:
+                print(f"Текущая версия: {await current_version(conn)}, последняя: {head_version()}")
+            return
+        applied = await migrate(engine)
+        print(f"Применены миграции: {', '.join(map(str, applied))}" if applied else "Схема уже на последней версии")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
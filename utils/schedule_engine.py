@@ -0,0 +1,262 @@
+"""
+Пакетный расчет аннуитетных графиков платежей.
+
+Движок не зависит от БД и ORM: на вход подаются массивы сумм, сроков,
+ставок и дат начала, на выходе - колоночный результат (ScheduleBatch),
+где все денежные величины хранятся в копейках (целые числа в array('q')).
+Округление до копейки выполняется один раз на каждом шаге (ROUND_HALF_UP),
+последний платеж закрывает остаток, поэтому сумма тела по графику всегда
+в точности равна сумме кредита.
+"""
+from array import array
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP, Context
+from functools import lru_cache
+from typing import Iterator, Sequence
+
+from dateutil.relativedelta import relativedelta
+
+CENT = Decimal('0.01')
+
+# Собственный контекст вместо getcontext().prec - не влияет на остальной код
+_CTX = Context(prec=34, rounding=ROUND_HALF_UP)
+
+
+def to_cents(value) -> int:
+    """Переводит сумму (Decimal/float/int/str) в целое число копеек"""
+    return int(_CTX.multiply(Decimal(str(value)), 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> Decimal:
+    """Переводит копейки обратно в Decimal с двумя знаками"""
+    return (Decimal(cents) / 100).quantize(CENT)
+
+
+@lru_cache(maxsize=1024)
+def monthly_rate(interest_rate: str) -> Decimal:
+    """Месячная ставка из годовой в процентах (ключ - строковое представление)"""
+    return _CTX.divide(Decimal(interest_rate), Decimal(1200))
+
+
+@lru_cache(maxsize=4096)
+def annuity_factor(term: int, interest_rate: str) -> Decimal:
+    """Коэффициент аннуитета для срока и годовой ставки"""
+    rate = monthly_rate(interest_rate)
+    if rate == 0:
+        return _CTX.divide(Decimal(1), Decimal(term))
+    growth = _CTX.power(_CTX.add(Decimal(1), rate), term)
+    return _CTX.divide(_CTX.multiply(rate, growth), _CTX.subtract(growth, Decimal(1)))
+
+
+@lru_cache(maxsize=1024)
+def due_dates(start_date: date, term: int) -> tuple[date, ...]:
+    """Даты платежей: каждый месяц после start_date (без накопления сдвига по дню)"""
+    return tuple(start_date + relativedelta(months=month) for month in range(1, term + 1))
+
+
+def _rate_key(interest_rate) -> str:
+    return str(Decimal(str(interest_rate)).normalize())
+
+
+def _round_cents(value: Decimal) -> int:
+    return int(value.to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def annuity_payment_cents(amount_cents: int, term: int, interest_rate) -> int:
+    """Аннуитетный платеж в копейках"""
+    if term <= 0:
+        raise ValueError("Срок кредита должен быть положительным")
+    return _round_cents(_CTX.multiply(Decimal(amount_cents), annuity_factor(term, _rate_key(interest_rate))))
+
+
+def annuity_payment(amount, term: int, interest_rate) -> Decimal:
+    """Аннуитетный платеж, округленный до копейки"""
+    return from_cents(annuity_payment_cents(to_cents(amount), term, interest_rate))
+
+
+@dataclass(frozen=True, slots=True)
+class ScheduleBatch:
+    """
+    Колоночный результат расчета нескольких графиков.
+        offsets     границы графиков: строки i-го кредита лежат в [offsets[i], offsets[i+1])
+        due_date    плановая дата платежа
+        payment     сумма платежа, коп.
+        principal   погашение тела, коп.
+        interest    проценты, коп.
+        balance     остаток тела после платежа, коп.
+    """
+    offsets: array
+    due_date: list
+    payment: array
+    principal: array
+    interest: array
+    balance: array
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def bounds(self, index: int) -> range:
+        """Индексы строк графика index-го кредита"""
+        return range(self.offsets[index], self.offsets[index + 1])
+
+    def monthly_payment(self, index: int) -> Decimal:
+        """Регулярный (первый) платеж index-го графика"""
+        start = self.offsets[index]
+        return from_cents(self.payment[start]) if start < self.offsets[index + 1] else Decimal('0.00')
+
+    def rows(self, index: int) -> Iterator[tuple[date, Decimal, Decimal, Decimal, Decimal]]:
+        """Строки index-го графика: (дата, платеж, тело, проценты, остаток)"""
+        for row in self.bounds(index):
+            yield (
+                self.due_date[row],
+                from_cents(self.payment[row]),
+                from_cents(self.principal[row]),
+                from_cents(self.interest[row]),
+                from_cents(self.balance[row]),
+            )
+
+
+def amortize(
+    amounts: Sequence,
+    terms: Sequence[int],
+    interest_rates: Sequence,
+    start_dates: Sequence[date],
+) -> ScheduleBatch:
+    """
+    Строит аннуитетные графики сразу для набора кредитов.
+
+    Коэффициенты аннуитета и ряды дат кешируются по (срок, ставка) и
+    (дата начала, срок), поэтому типичный поток котировок с повторяющимися
+    параметрами считается практически только целочисленной арифметикой.
+
+    :param amounts: суммы кредитов
+    :param terms: сроки в месяцах
+    :param interest_rates: годовые ставки в процентах
+    :param start_dates: даты, от которых отсчитывается первый платеж (+1 месяц)
+    :return: колоночный ScheduleBatch
+    """
+    if not (len(amounts) == len(terms) == len(interest_rates) == len(start_dates)):
+        raise ValueError("Массивы параметров кредитов должны быть одной длины")
+
+    offsets = array('q', [0])
+    dates: list[date] = []
+    payment = array('q')
+    principal = array('q')
+    interest = array('q')
+    balance = array('q')
+
+    for amount, term, interest_rate, start_date in zip(amounts, terms, interest_rates, start_dates):
+        term = int(term)
+        rate_key = _rate_key(interest_rate)
+        rate = monthly_rate(rate_key)
+        remaining = to_cents(amount)
+        regular = annuity_payment_cents(remaining, term, rate_key)
+
+        for month in range(term):
+            month_interest = _round_cents(_CTX.multiply(Decimal(remaining), rate))
+            if month == term - 1:
+                # Последний платеж закрывает остаток с учетом накопленного округления
+                month_principal = remaining
+            else:
+                month_principal = min(regular - month_interest, remaining)
+            remaining -= month_principal
+
+            payment.append(month_principal + month_interest)
+            principal.append(month_principal)
+            interest.append(month_interest)
+            balance.append(remaining)
+
+        dates.extend(due_dates(start_date, term))
+        offsets.append(len(payment))
+
+    return ScheduleBatch(offsets, dates, payment, principal, interest, balance)
+
+
+@dataclass(frozen=True, slots=True)
+class ScheduleRow:
+    """Неизменяемая строка графика платежей"""
+    payment_date_plan: date
+    planned_amount: Decimal
+    principal: Decimal
+    interest: Decimal
+    balance: Decimal
+
+
+@dataclass(frozen=True, slots=True)
+class PaymentSchedule:
+    """
+    Рассчитанный в памяти график платежей (без сессии и ORM).
+    Сохраняется отдельным шагом через utils.calculations.save_schedule.
+    """
+    rows: tuple[ScheduleRow, ...]
+
+    @classmethod
+    def from_batch(cls, batch: ScheduleBatch, index: int) -> "PaymentSchedule":
+        """Достает index-й график из пакетного результата"""
+        return cls(tuple(ScheduleRow(*row) for row in batch.rows(index)))
+
+    def __iter__(self) -> Iterator[ScheduleRow]:
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __bool__(self) -> bool:
+        return bool(self.rows)
+
+    @property
+    def monthly_payment(self) -> Decimal:
+        """Регулярный (первый) платеж"""
+        return self.rows[0].planned_amount if self.rows else Decimal('0.00')
+
+    @property
+    def first_date(self) -> date | None:
+        """Дата первого платежа"""
+        return self.rows[0].payment_date_plan if self.rows else None
+
+    @property
+    def total_amount(self) -> Decimal:
+        """Сумма всех платежей по графику"""
+        return sum((row.planned_amount for row in self.rows), Decimal('0.00'))
+
+    @property
+    def total_interest(self) -> Decimal:
+        """Переплата (сумма процентов)"""
+        return sum((row.interest for row in self.rows), Decimal('0.00'))
+
+
+def build_schedule(amount, term: int, interest_rate, start_date: date) -> PaymentSchedule:
+    """Аннуитетный график одного кредита; первый платеж через месяц после start_date"""
+    return PaymentSchedule.from_batch(amortize([amount], [term], [interest_rate], [start_date]), 0)
+
+
+def build_shortened_schedule(balance, monthly_payment, interest_rate, start_date: date) -> PaymentSchedule:
+    """
+    График после досрочного погашения с сохранением размера платежа
+    и сокращением срока: платим monthly_payment, пока не закроем остаток.
+    """
+    rate = monthly_rate(_rate_key(interest_rate))
+    remaining = to_cents(balance)
+    regular = to_cents(monthly_payment)
+    rows = []
+    month = 1
+
+    while remaining > 0:
+        month_interest = _round_cents(_CTX.multiply(Decimal(remaining), rate))
+        month_principal = regular - month_interest
+        if month_principal <= 0:
+            raise ValueError("Размер ежемесячного платежа слишком мал для погашения кредита.")
+
+        month_principal = min(month_principal, remaining)
+        remaining -= month_principal
+        rows.append(ScheduleRow(
+            start_date + relativedelta(months=month),
+            from_cents(month_principal + month_interest),
+            from_cents(month_principal),
+            from_cents(month_interest),
+            from_cents(remaining),
+        ))
+        month += 1
+
+    return PaymentSchedule(tuple(rows))